@@ -12,21 +12,10 @@ import sys
 
 from stdlib import *
 
-Builtins = CoalBuiltin()
-
 # Globals
 returned = False
 ret_value = CoalVoid(obj_type='Void')
 
-local_scope = []
-current_scope = 0
-
-local_scope.append({
-    'types': dict(Builtins.types),
-    'methods': {},
-    'names': dict(Builtins.names)
-})
-
 
 class Globals(object):
     scope_depth = 0
@@ -39,8 +28,6 @@ class Globals(object):
     flow_next = False
     flow_break = False
 
-g = Globals()
-
 
 # Utils
 def throwError(p, pos, message):
@@ -48,62 +35,183 @@ def throwError(p, pos, message):
     Throw an error. (Do I need to explain more?)
     '''
 
-    print('{}.'.format(message))
+    print('{}.'.format(message), file=output())
     sys.exit(1)
 
 
-# Parse a statement
-def ExecuteCoal(stmt, scope=local_scope[current_scope]):
+class CoalExit(SystemExit):
+    '''
+    Raised by "exit", to tell it apart from the SystemExit of an error.
+    '''
+
+
+def exprResult(result):
+    '''
+    Wrap the Python result of an arithmetic expression in a Coal object.
+    '''
+
+    if type(result) == int:
+        return coalInt(result)
+    elif type(result) == float:
+        return CoalFloat(result)
+    elif type(result) == bool:
+        return coalBool(result)
+    else:
+        return CoalBool(result)
+
+
+class Interpreter(object):
+    '''
+    Everything one running program uses: its scopes, its flow flags and
+    its own builtins. Programs run by different interpreters don't see
+    each other, so several of them can run in one process (or thread).
+    '''
+
+    def __init__(self, stdout=None):
+        self.stdout = stdout
+        self.builtins = CoalBuiltin()
+        self.g = Globals()
+
+        self.local_scope = [self.newScope()]
+        self.current_scope = 0
+
+        # CachedValue -> its value, until a ClearCache
+        self.cache = {}
+
+    def newScope(self):
+        return {
+            'types': dict(self.builtins.types),
+            'methods': {},
+            'names': dict(self.builtins.names)
+        }
+
+    def run(self, stmts, names=None, compiled=False):
+        '''
+        Run top-level statements and return the exit status (0 when they
+        all ran). What they print goes to this interpreter's stdout.
+
+        With `compiled`, the statements are closures from closures.py.
+        '''
+
+        previous = setOutput(self.stdout)
+
+        try:
+            if names is not None:
+                scope_names = self.local_scope[self.current_scope]['names']
+
+                for name, value in names.items():
+                    scope_names[name] = unshared(coalValue(value))
+
+            if compiled:
+                scope = self.local_scope[self.current_scope]
+
+                for fn in stmts:
+                    fn(self, scope)
+            else:
+                for stmt in stmts:
+                    self.execute(stmt)
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            elif isinstance(e.code, int):
+                return e.code
+
+            return 1
+        finally:
+            setOutput(previous)
+
+        return 0
+
+    @classmethod
+    def register(cls, node_type, handler):
+        '''
+        Run nodes of `node_type` with handler(interpreter, node, scope).
+        '''
+
+        cls.handlers[node_type] = handler
+
+    # Run a statement
+    def execute(self, stmt, scope=None):
+        if scope is None:
+            scope = self.local_scope[self.current_scope]
+
+        handler = self.handlers.get(type(stmt))
+
+        if handler is None:
+            handler = self.handlerFor(type(stmt))
+
+        return handler(self, stmt, scope)
+
+    def handlerFor(self, node_type):
+        '''
+        The handler of an unregistered node type: the one of its closest
+        registered base class, or one that does nothing.
+        '''
+
+        for base in node_type.__mro__[1:]:
+            if base in self.handlers:
+                handler = self.handlers[base]
+                break
+        else:
+            handler = Interpreter._executeNothing
+
+        self.handlers[node_type] = handler
+
+        return handler
+
+    def _executeNothing(self, stmt, scope):
+        return CoalVoid()
+
     # Call
-    if isinstance(stmt, LocalMethodCall):
+    def _executeLocalMethodCall(self, stmt, scope):
         selectors = stmt.selectors
         selector_args = list(stmt.selector_args)
 
         for i in range(len(selector_args)):
-            selector_args[i] = ExecuteCoal(selector_args[i], scope)
+            selector_args[i] = self.execute(selector_args[i], scope)
 
-        if selectors in Builtins.public:
-            return Builtins.call(selectors, selector_args)
+        if selectors in self.builtins.public:
+            return self.builtins.call(selectors, selector_args)
         elif selectors in scope['methods']:
-            if g.scope_depth == 0:
-                n_scope = {
-                    'types': dict(Builtins.types),
-                    'methods': {},
-                    'names': dict(Builtins.names)
-                }
+            if self.g.scope_depth == 0:
+                n_scope = self.newScope()
             else:
                 n_scope = scope
 
-            g.scope_depth += 1
+            self.g.scope_depth += 1
 
             defs = scope['methods'][selectors](n_scope,
                                                selector_args)
             suite, n_scope, rtype = defs
 
             for st in suite:
-                result = ExecuteCoal(st, n_scope)
+                result = self.execute(st, n_scope)
 
                 if isinstance(st, FuncRet):
                     if result.object_type != rtype:
                         throwError(0, 0,
-                                   'TypeError: Invalid return type for "{}": '
-                                   '"{}"'
+                                   'TypeError: Invalid return type for'
+                                   ' "{}": "{}"'
                                    .format(rtype, result.object_type))
 
-                    g.scope_depth -= 1
+                    self.g.scope_depth -= 1
                     return result
 
-            g.scope_depth -= 1
-    elif isinstance(stmt, ObjectMethodCall):
-        obj = ExecuteCoal(stmt.object, scope)
+            self.g.scope_depth -= 1
+
+        return CoalVoid()
+
+    def _executeObjectMethodCall(self, stmt, scope):
+        obj = self.execute(stmt.object, scope)
         selectors = stmt.selectors
         selector_args = list(stmt.selector_args)
 
         for i in range(len(selector_args)):
-            selector_args[i] = ExecuteCoal(selector_args[i], scope)
+            selector_args[i] = self.execute(selector_args[i], scope)
 
         return obj.call(selectors, selector_args)
-    elif isinstance(stmt, TypeCall):
+
+    def _executeTypeCall(self, stmt, scope):
         _type = stmt.type
         selectors = stmt.selectors
         selector_args = []
@@ -112,13 +220,9 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             selector_args = list(stmt.selector_args)
 
             for i in range(len(selector_args)):
-                selector_args[i] = ExecuteCoal(selector_args[i], scope)
+                selector_args[i] = self.execute(selector_args[i], scope)
 
-        n_scope = {
-            'types': dict(Builtins.types),
-            'methods': {},
-            'names': dict(Builtins.names)
-        }
+        n_scope = self.newScope()
 
         # TODO: Currently, an empty instance of "_type_{...}" is created to
         # call an internal CoalTypeInit and do the "add arguments to scope"
@@ -134,31 +238,35 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             new_obj = scope['types'][_type]
 
             for st in suite:
-                g.self_ = new_obj
+                self.g.self_ = new_obj
 
                 if isinstance(st, SelfAssign):
-                    new_obj.attributes[st.name] = ExecuteCoal(st.value, nscope)
+                    new_obj.attributes[st.name] =\
+                        self.execute(st.value, nscope)
                 else:
-                    ExecuteCoal(st, scope)
+                    self.execute(st, scope)
 
-            g.self_ = None
+            self.g.self_ = None
             return new_obj
 
-    elif isinstance(stmt, NameFromSelf):
-        if g.self_ is None:
-            throwError(0, 0, 'Call to "self" from outside a type constructor.')
+        return CoalVoid()
 
-        if stmt.name not in g.self_.public:
+    def _executeNameFromSelf(self, stmt, scope):
+        if self.g.self_ is None:
+            throwError(0, 0,
+                       'Call to "self" from outside a type constructor.')
+
+        if stmt.name not in self.g.self_.public:
             throwError(0, 0,
                        'NameError: Unknown name "{}"'
                        .format(stmt.name))
 
-        return g.self_.public[stmt.name]
+        return self.g.self_.public[stmt.name]
 
     # Name
-    elif isinstance(stmt, NameDef):
-        value = ExecuteCoal(stmt.value, scope)
-        builtin_types = Builtins.types
+    def _executeNameDef(self, stmt, scope):
+        value = self.execute(stmt.value, scope)
+        builtin_types = self.builtins.types
 
         if stmt.type in builtin_types:
             scope['names'][stmt.name] =\
@@ -166,32 +274,40 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
                                                  value.object_type)
         elif stmt.type in scope['types']:
             if value.object_type != stmt.type:
-                throwError(0, 0, 'TypeError: Unknown value type for "{}": {}'
+                throwError(0, 0,
+                           'TypeError: Unknown value type for "{}": {}'
                            .format(stmt.type, value.object_type))
 
             scope['names'][stmt.name] = value
 
-    elif isinstance(stmt, NameDefEmpty):
+        return CoalVoid()
+
+    def _executeNameDefEmpty(self, stmt, scope):
         if stmt.type in scope['types']\
            or stmt.type == 'Any':
             scope['names'][stmt.name] = CoalVoid(obj_type=stmt.type)
         else:
-            throwError(0, 4, 'TypeError: Unknown type "{}"'.format(stmt.type))
+            throwError(0, 4,
+                       'TypeError: Unknown type "{}"'.format(stmt.type))
+
+        return CoalVoid()
 
     # Assignment
-    elif isinstance(stmt, NameAssign):
-        value = ExecuteCoal(stmt.value, scope)
+    def _executeNameAssign(self, stmt, scope):
+        value = self.execute(stmt.value, scope)
 
         if stmt.name not in scope['names']:
-            throwError(0, 1, 'NameError: Unknown name "{}"'.format(stmt.name))
+            throwError(0, 1,
+                       'NameError: Unknown name "{}"'.format(stmt.name))
 
         if isinstance(scope['names'][stmt.name], CoalVoid):
             var_type = scope['names'][stmt.name].value
 
             if var_type != 'Any'\
                and var_type != value.object_type:
-                throwError(0, 3, 'TypeError: Wrong value type for Void({}): {}'
-                                 .format(var_type, stmt.value.object_type))
+                throwError(0, 3,
+                           'TypeError: Wrong value type for Void({}): {}'
+                           .format(var_type, stmt.value.object_type))
         else:
             var_type = scope['names'][stmt.name].object_type
 
@@ -200,18 +316,21 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
                                  .format(var_type, value.object_type))
 
         if stmt.mode == '=':
-            scope['names'][stmt.name] = value
+            scope['names'][stmt.name] = unshared(value)
         elif stmt.mode == '+=':
-            scope['names'][stmt.name].value += value.value
+            ownValue(scope['names'], stmt.name).value += value.value
         elif stmt.mode == '-=':
-            scope['names'][stmt.name].value -= value.value
+            ownValue(scope['names'], stmt.name).value -= value.value
         elif stmt.mode == '*=':
-            scope['names'][stmt.name].value *= value.value
+            ownValue(scope['names'], stmt.name).value *= value.value
         elif stmt.mode == '/=':
-            scope['names'][stmt.name].value /= value.value
-    elif isinstance(stmt, IterableItemAssign):
-        index = ExecuteCoal(stmt.index, scope)
-        value = ExecuteCoal(stmt.value, scope)
+            ownValue(scope['names'], stmt.name).value /= value.value
+
+        return CoalVoid()
+
+    def _executeIterableItemAssign(self, stmt, scope):
+        index = self.execute(stmt.index, scope)
+        value = self.execute(stmt.value, scope)
 
         if stmt.name not in scope['names']:
             throwError(0, 0,
@@ -226,13 +345,15 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
 
         name.assign(index, value)
 
+        return CoalVoid()
+
     # Type
 
     # TODO: Lists are fun!
     # [ ] Implement private properties.
     # [ ] Implement protected properties.
 
-    elif isinstance(stmt, TypeDef):
+    def _executeTypeDef(self, stmt, scope):
         inits = {}
         public = {}
         protected = {}
@@ -250,7 +371,8 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             # elif isinstance(st, TypePublicDecl):
             #     for pst in st.suite:
             #         if isinstance(pst, NameDef):
-            #             public[stmt.name] = ExecuteCoal(stmt.value, scope)
+            #             public[stmt.name] = self.execute(stmt.value,
+            #                                              scope)
             #         elif isinstance(pst, FuncDef):
             #             public[stmt.selectors] = CoalFunction(
             #                 stmt.selectors,
@@ -262,9 +384,10 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             #                 stmt.simple
             #             )
             #         else:
-            #             throwError(0, 0, 'Exception: What are you trying to'
-            #                        ' do inside a type definition besides...'
-            #                        ' A type definition?')
+            #             throwError(0, 0, 'Exception: What are you'
+            #                        ' trying to do inside a type'
+            #                        ' definition besides... A type'
+            #                        ' definition?')
 
         scope['types'][stmt.name] = CoalType(
             stmt.name,
@@ -274,8 +397,10 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             private
         )
 
+        return CoalVoid()
+
     # Function
-    elif isinstance(stmt, FuncDef):
+    def _executeFuncDef(self, stmt, scope):
         scope['methods'][stmt.selectors] = CoalFunction(
             stmt.selectors,
             stmt.selector_names,
@@ -285,44 +410,49 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             stmt.suite,
             stmt.simple
         )
-    elif isinstance(stmt, FuncRet):
-        return ExecuteCoal(stmt.value, scope)
+
+        return CoalVoid()
+
+    def _executeFuncRet(self, stmt, scope):
+        return self.execute(stmt.value, scope)
 
     # Conditional
-    elif isinstance(stmt, IfBlock):
-        test = ExecuteCoal(stmt.test, scope)
+    def _executeIfBlock(self, stmt, scope):
+        test = self.execute(stmt.test, scope)
 
         if test.value and not isinstance(test.value, CoalVoid):
             for st in stmt.suite:
-                ExecuteCoal(st, scope)
+                self.execute(st, scope)
 
             return
 
         if stmt.elif_blocks is not None:
             for block in stmt.elif_blocks:
-                test = ExecuteCoal(block[0], scope)
+                test = self.execute(block[0], scope)
 
                 if test.value and not isinstance(test.value, CoalVoid):
                     for st in block[1]:
-                        ExecuteCoal(st, scope)
+                        self.execute(st, scope)
 
                     return
 
         if stmt.else_suite is not None:
             for st in stmt.else_suite:
-                ExecuteCoal(st, scope)
+                self.execute(st, scope)
+
+        return CoalVoid()
 
     # Loop
-    elif isinstance(stmt, ForBlock):
-        g.flow = True
+    def _executeForBlock(self, stmt, scope):
+        self.g.flow = True
 
-        start = ExecuteCoal(stmt.start, scope)
-        end = ExecuteCoal(stmt.end, scope)
+        start = self.execute(stmt.start, scope)
+        end = self.execute(stmt.end, scope)
 
         if stmt.interval is not None:
-            interval = ExecuteCoal(stmt.interval, scope)
+            interval = self.execute(stmt.interval, scope)
         else:
-            interval = CoalInt(1)
+            interval = coalInt(1)
 
         if not isinstance(start, CoalInt)\
            or not isinstance(end, CoalInt)\
@@ -342,27 +472,31 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
             scope['names'][stmt.name] = i
 
             while i.value <= end.value:
-                scope['names'][stmt.name].value = i.value
+                if scope['names'][stmt.name] is not i:
+                    ownValue(scope['names'], stmt.name).value = i.value
 
                 for st in stmt.suite:
-                    if g.flow_next:
-                        g.flow_next = False
+                    if self.g.flow_next:
+                        self.g.flow_next = False
                         break
-                    elif g.flow_break:
-                        g.flow_break = False
+                    elif self.g.flow_break:
+                        self.g.flow_break = False
                         return
 
-                    ExecuteCoal(st, scope)
+                    self.execute(st, scope)
 
                 i.value += interval.value
 
             del scope['names'][stmt.name]
 
-        g.flow = False
-    elif isinstance(stmt, EachBlock):
-        g.flow = True
+        self.g.flow = False
+
+        return CoalVoid()
+
+    def _executeEachBlock(self, stmt, scope):
+        self.g.flow = True
 
-        iterable = ExecuteCoal(stmt.iterable, scope)
+        iterable = self.execute(stmt.iterable, scope)
 
         if not isinstance(iterable, CoalIterableObject):
             throwError('TypeError: "{}" object is not iterable.'
@@ -380,169 +514,225 @@ def ExecuteCoal(stmt, scope=local_scope[current_scope]):
                 scope['names'][stmt.name] = iterable.iter(i)
 
                 for st in stmt.suite:
-                    if g.flow_next:
-                        g.flow_next = False
+                    if self.g.flow_next:
+                        self.g.flow_next = False
                         break
-                    elif g.flow_break:
-                        g.flow_break = False
+                    elif self.g.flow_break:
+                        self.g.flow_break = False
                         return
 
-                    ExecuteCoal(st, scope)
+                    self.execute(st, scope)
 
                 i.value += 1
 
             del scope['names'][stmt.name]
 
-        g.flow = False
-    elif isinstance(stmt, WhileBlock):
-        g.flow = True
+        self.g.flow = False
 
-        test = ExecuteCoal(stmt.test, scope)
+        return CoalVoid()
+
+    def _executeWhileBlock(self, stmt, scope):
+        self.g.flow = True
+
+        test = self.execute(stmt.test, scope)
 
         while test.value:
             for st in stmt.suite:
-                if g.flow_next:
-                    g.flow_next = False
+                if self.g.flow_next:
+                    self.g.flow_next = False
                     break
-                elif g.flow_break:
-                    g.flow_break = False
+                elif self.g.flow_break:
+                    self.g.flow_break = False
                     return
 
-                ExecuteCoal(st, scope)
+                self.execute(st, scope)
+
+            test = self.execute(stmt.test, scope)
+
+        self.g.flow = False
 
-            test = ExecuteCoal(stmt.test, scope)
+        return CoalVoid()
 
-        g.flow = False
-    elif isinstance(stmt, FlowBreak):
-        if not g.flow:
+    def _executeFlowBreak(self, stmt, scope):
+        if not self.g.flow:
             throwError('SyntaxError: Invalid syntax: "break".')
 
-        g.flow_break = True
-    elif isinstance(stmt, FlowNext):
-        if not g.flow:
+        self.g.flow_break = True
+
+        return CoalVoid()
+
+    def _executeFlowNext(self, stmt, scope):
+        if not self.g.flow:
             throwError('SyntaxError: Invalid syntax: "next".')
 
-        g.flow_next = True
+        self.g.flow_next = True
+
+        return CoalVoid()
 
     # Expression
-    elif type(stmt).__name__ in ['ExprAddition',
-                                 'ExprSubtraction',
-                                 'ExprMultiplication',
-                                 'ExprDivision',
-                                 'ExprModulo',
-                                 'ExprBitAnd',
-                                 'ExprBitOr',
-                                 'ExprBitXor',
-                                 'ExprBitShiftR',
-                                 'ExprBitShiftL',
-                                 'ExprEqual',
-                                 'ExprNotEqual',
-                                 'ExprGreater',
-                                 'ExprLess',
-                                 'ExprEqualGreater',
-                                 'ExprEqualLess']:
-        a = ExecuteCoal(stmt.a, scope)
-        b = ExecuteCoal(stmt.b, scope)
-
-        # a_type = a.object_type
-        # b_type = b.object_type
-
-        # if all(a_type != t for t in ('Int', 'Float'))\
-        #    or all(b_type != t for t in ('Int', 'Float')):
-        #     throwError(0, 0, 'TypeError: Invalid types for "+": {}, {}'
-        #                      .format(a_type, b_type))
-
-        expr_type = type(stmt).__name__
-
-        if expr_type == 'ExprAddition':
-            result = a.value + b.value
-        elif expr_type == 'ExprSubtraction':
-            result = a.value - b.value
-        elif expr_type == 'ExprMultiplication':
-            result = a.value * b.value
-        elif expr_type == 'ExprDivision':
-            result = a.value / b.value
-        elif expr_type == 'ExprModulo':
-            result = a.value % b.value
-        elif expr_type == 'ExprBitAnd':
-            result = a.value & b.value
-        elif expr_type == 'ExprBitOr':
-            result = a.value | b.value
-        elif expr_type == 'ExprBitXor':
-            result = a.value ^ b.value
-        elif expr_type == 'ExprBitShiftR':
-            result = a.value >> b.value
-        elif expr_type == 'ExprBitShiftL':
-            result = a.value << b.value
-        elif expr_type == 'ExprEqual':
-            result = 'true' if a.value == b.value else 'false'
-        elif expr_type == 'ExprNotEqual':
-            result = 'false' if a.value == b.value else 'true'
-        elif expr_type == 'ExprGreater':
-            result = 'true' if a.value > b.value else 'false'
-        elif expr_type == 'ExprLess':
-            result = 'true' if a.value < b.value else 'false'
-        elif expr_type == 'ExprEqualGreater':
-            result = 'true' if a.value >= b.value else 'false'
-        elif expr_type == 'ExprEqualLess':
-            result = 'true' if a.value <= b.value else 'false'
-
-        if type(result) == int:
-            return CoalInt(result)
-        elif type(result) == float:
-            return CoalFloat(result)
-        else:
-            return CoalBool(result)
+
+    # a_type = a.object_type
+    # b_type = b.object_type
+
+    # if all(a_type != t for t in ('Int', 'Float'))\
+    #    or all(b_type != t for t in ('Int', 'Float')):
+    #     throwError(0, 0, 'TypeError: Invalid types for "+": {}, {}'
+    #                      .format(a_type, b_type))
+
+    def _executeExprAddition(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return exprResult(a.value + b.value)
+
+    def _executeExprSubtraction(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return exprResult(a.value - b.value)
+
+    def _executeExprMultiplication(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return exprResult(a.value * b.value)
+
+    def _executeExprDivision(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return exprResult(a.value / b.value)
+
+    def _executeExprModulo(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return exprResult(a.value % b.value)
+
+    def _executeExprEqual(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return coalBool(a.value == b.value)
+
+    def _executeExprNotEqual(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return coalBool(a.value != b.value)
+
+    def _executeExprGreater(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return coalBool(a.value > b.value)
+
+    def _executeExprLess(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return coalBool(a.value < b.value)
+
+    def _executeExprEqualGreater(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return coalBool(a.value >= b.value)
+
+    def _executeExprEqualLess(self, stmt, scope):
+        a = self.execute(stmt.a, scope)
+        b = self.execute(stmt.b, scope)
+
+        return coalBool(a.value <= b.value)
 
     # Value
-    elif isinstance(stmt, Value):
-        if isinstance(stmt, Name):
-            if stmt.name not in scope['names']:
-                throwError(0, 0,
-                           'NameError: Unknown name "{}"'
-                           .format(stmt.name))
+    def _executeName(self, stmt, scope):
+        if stmt.name not in scope['names']:
+            throwError(0, 0,
+                       'NameError: Unknown name "{}"'
+                       .format(stmt.name))
 
-            return scope['names'][stmt.name]
-        elif isinstance(stmt, ItemFromIterable):
-            iter_name = ExecuteCoal(stmt.name, scope)
-            iter_start = ExecuteCoal(stmt.index, scope)
+        return scope['names'][stmt.name]
 
-            if stmt.end is None:
-                iter_end = None
-            else:
-                iter_end = ExecuteCoal(stmt.end, scope)
-
-            return iter_name.iter(iter_start, iter_end)
-        elif isinstance(stmt, Void):
-            return CoalVoid(stmt.value)
-        elif isinstance(stmt, Bool):
-            return CoalBool(stmt.value)
-        elif isinstance(stmt, Int):
-            return CoalInt(stmt.value)
-        elif isinstance(stmt, Float):
-            return CoalFloat(stmt.value)
-        elif isinstance(stmt, String):
-            return CoalString(stmt.value)
-        elif isinstance(stmt, List):
-            value = []
-            for i in range(len(stmt.value)):
-                value.append(ExecuteCoal(stmt.value[i], scope))
-
-            return CoalList(value)
+    def _executeItemFromIterable(self, stmt, scope):
+        iter_name = self.execute(stmt.name, scope)
+        iter_start = self.execute(stmt.index, scope)
+
+        if stmt.end is None:
+            iter_end = None
+        else:
+            iter_end = self.execute(stmt.end, scope)
+
+        return iter_name.iter(iter_start, iter_end)
+
+    def _executeVoid(self, stmt, scope):
+        return CoalVoid(stmt.value)
+
+    def _executeBool(self, stmt, scope):
+        return stmt.constant
+
+    def _executeInt(self, stmt, scope):
+        return stmt.constant
+
+    def _executeFloat(self, stmt, scope):
+        return stmt.constant
+
+    def _executeString(self, stmt, scope):
+        return stmt.constant
+
+    def _executeList(self, stmt, scope):
+        value = []
+        for i in range(len(stmt.value)):
+            value.append(unshared(self.execute(stmt.value[i], scope)))
+
+        return CoalList(value)
+
+    # Cache
+    def _executeCachedValue(self, stmt, scope):
+        if stmt in self.cache:
+            return self.cache[stmt]
+
+        value = self.execute(stmt.value, scope)
+        names = scope['names']
+
+        # Only methods known to be pure give values that can be kept
+        for name, selectors in stmt.methods:
+            if selectors not in PURE_METHODS.get(type(names.get(name)), ()):
+                return value
+
+        self.cache[stmt] = value
+
+        return value
+
+    def _executeClearCache(self, stmt, scope):
+        for value in stmt.values:
+            self.cache.pop(value, None)
+
+        return CoalVoid()
 
     # Exit the program
-    elif isinstance(stmt, Exit):
-        result = ExecuteCoal(stmt.value, scope)
+    def _executeExit(self, stmt, scope):
+        result = self.execute(stmt.value, scope)
 
         if not isinstance(result, CoalInt) and\
            not isinstance(result, CoalBool):
-            throwError(0, 0,
-                       'TypeError: The program must return "Int" or "Bool".')
+            throwError(0, 0, 'TypeError: The program must return "Int"'
+                             ' or "Bool".')
+
+        raise CoalExit(result.value)
 
-        sys.exit(result.value)
 
-    # Empty return
-    return CoalVoid()
+# The interpreter behind ExecuteCoal() and the command line
+interpreter = Interpreter()
+
+Builtins = interpreter.builtins
+local_scope = interpreter.local_scope
+current_scope = interpreter.current_scope
+g = interpreter.g
+
+
+def ExecuteCoal(stmt, scope=None):
+    return interpreter.execute(stmt, scope)
 
 
 # For organization sake
@@ -647,6 +837,51 @@ class FuncDef(CoalAST):
             self.selectors += '{}:'.format(selector)
 
 
+class LazySuite(object):
+    '''
+    A function body kept as source text until it is first run.
+
+    `parse` is set by coal.py; `created` and `materialized` count bodies.
+    '''
+
+    parse = None
+
+    created = 0
+    materialized = 0
+
+    # Bodies cached without a lexer choice are parsed with PLY's
+    array_lexer = False
+
+    def __init__(self,
+                 src,
+                 lineno,
+                 array_lexer=False):
+        self.src = src
+        self.lineno = lineno
+        self.array_lexer = array_lexer
+        self.suite = None
+
+        LazySuite.created += 1
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        LazySuite.created += 1
+
+        if self.suite is not None:
+            LazySuite.materialized += 1
+
+    def __iter__(self):
+        if self.suite is None:
+            self.suite = LazySuite.parse(self.src, self.lineno,
+                                         self.array_lexer)
+            self.src = None
+
+            LazySuite.materialized += 1
+
+        return iter(self.suite)
+
+
 class FuncRet(CoalAST):
     def __init__(self,
                  value):
@@ -882,28 +1117,59 @@ class Void(Value):
         self.value = value
 
 
-class Bool(Value):
+class Constant(Value):
+    '''
+    A literal, which evaluates to the same pooled object every time.
+    '''
+
+    runtime = None
+
+    def __getstate__(self):
+        # The pooled object is per process: pickles hold only the value
+        state = dict(self.__dict__)
+        state.pop('constant', None)
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.constant = constant(self.runtime, self.value)
+
+
+class Bool(Constant):
+    runtime = CoalBool
+
     def __init__(self,
                  value):
         self.value = value
+        self.constant = constant(CoalBool, self.value)
+
 
+class Int(Constant):
+    runtime = CoalInt
 
-class Int(Value):
     def __init__(self,
                  value):
         self.value = int(value)
+        self.constant = constant(CoalInt, self.value)
+
 
+class Float(Constant):
+    runtime = CoalFloat
 
-class Float(Value):
     def __init__(self,
                  value):
         self.value = float(value)
+        self.constant = constant(CoalFloat, self.value)
 
 
-class String(Value):
+class String(Constant):
+    runtime = CoalString
+
     def __init__(self,
                  value):
         self.value = str(value)
+        self.constant = constant(CoalString, self.value)
 
 
 class List(Value):
@@ -917,3 +1183,68 @@ class Exit(CoalAST):
     def __init__(self,
                  value):
         self.value = value
+
+
+# Cache (made by optimize.py)
+class CachedValue(CoalAST):
+    '''
+    A pure expression whose value is kept after it first runs, until a
+    ClearCache. `methods` are the (name, selectors) of its method calls,
+    checked against PURE_METHODS before the value is kept.
+    '''
+
+    def __init__(self,
+                 value,
+                 methods=()):
+        self.value = value
+        self.methods = methods
+
+
+class ClearCache(CoalAST):
+    def __init__(self,
+                 values):
+        self.values = values
+
+
+# Node type -> handler, for Interpreter.execute()
+Interpreter.handlers = {
+    LocalMethodCall: Interpreter._executeLocalMethodCall,
+    ObjectMethodCall: Interpreter._executeObjectMethodCall,
+    TypeCall: Interpreter._executeTypeCall,
+    NameFromSelf: Interpreter._executeNameFromSelf,
+    NameDef: Interpreter._executeNameDef,
+    NameDefEmpty: Interpreter._executeNameDefEmpty,
+    NameAssign: Interpreter._executeNameAssign,
+    IterableItemAssign: Interpreter._executeIterableItemAssign,
+    TypeDef: Interpreter._executeTypeDef,
+    FuncDef: Interpreter._executeFuncDef,
+    FuncRet: Interpreter._executeFuncRet,
+    IfBlock: Interpreter._executeIfBlock,
+    ForBlock: Interpreter._executeForBlock,
+    EachBlock: Interpreter._executeEachBlock,
+    WhileBlock: Interpreter._executeWhileBlock,
+    FlowBreak: Interpreter._executeFlowBreak,
+    FlowNext: Interpreter._executeFlowNext,
+    ExprAddition: Interpreter._executeExprAddition,
+    ExprSubtraction: Interpreter._executeExprSubtraction,
+    ExprMultiplication: Interpreter._executeExprMultiplication,
+    ExprDivision: Interpreter._executeExprDivision,
+    ExprModulo: Interpreter._executeExprModulo,
+    ExprEqual: Interpreter._executeExprEqual,
+    ExprNotEqual: Interpreter._executeExprNotEqual,
+    ExprGreater: Interpreter._executeExprGreater,
+    ExprLess: Interpreter._executeExprLess,
+    ExprEqualGreater: Interpreter._executeExprEqualGreater,
+    ExprEqualLess: Interpreter._executeExprEqualLess,
+    Name: Interpreter._executeName,
+    ItemFromIterable: Interpreter._executeItemFromIterable,
+    Void: Interpreter._executeVoid,
+    Bool: Interpreter._executeBool,
+    Int: Interpreter._executeInt,
+    Float: Interpreter._executeFloat,
+    String: Interpreter._executeString,
+    List: Interpreter._executeList,
+    Exit: Interpreter._executeExit,
+    CachedValue: Interpreter._executeCachedValue,
+    ClearCache: Interpreter._executeClearCache
+}
@@ -0,0 +1,173 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Batch compilation
+ # version 0.1
+##
+
+# Imports
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+import cache
+import coal
+
+# One parser per worker process, built once and reused for every file
+_parser = None
+
+
+# Utils
+def findSources(paths):
+    '''
+    Collect the .coal files in `paths` (files or directories), sorted.
+    '''
+
+    sources = []
+
+    for path in paths:
+        if os.path.isfile(path):
+            sources.append(path)
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+
+            for name in sorted(files):
+                if name.endswith('.coal'):
+                    sources.append(os.path.join(root, name))
+
+    return sources
+
+
+def positiveInt(text):
+    '''
+    Argument type for counts that must be at least 1.
+    '''
+
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+
+    if value < 1:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not a positive number'.format(text))
+
+    return value
+
+
+def _initWorker():
+    global _parser
+
+    _parser = coal.buildParser()
+
+
+def compileFile(path):
+    '''
+    Parse one file and store it in the program cache.
+
+    Returns (path, parsed, cached, size in bytes, statement count, seconds,
+    error text or None).
+    '''
+
+    start = time.perf_counter()
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            src = f.read()
+
+        program = coal.parse(src, _parser)
+    except SystemExit:
+        # Syntax errors are reported by the parser itself and exit.
+        return (path, False, False, 0, 0, time.perf_counter() - start, None)
+    except Exception as e:
+        return (path, False, False, 0, 0, time.perf_counter() - start,
+                '{}: {}'.format(type(e).__name__, e))
+
+    cached = cache.storeProgram(src, coal.PROGRAM_VERSION, program,
+                                evict=False)
+
+    return (path, True, cached, len(src.encode('utf-8')), len(program),
+            time.perf_counter() - start, None)
+
+
+def main(argv):
+    argparser = argparse.ArgumentParser(
+        prog='coal compile',
+        description='Parse .coal files in parallel and store them in the'
+                    ' compiled program cache.')
+    argparser.add_argument('paths', nargs='+',
+                           help='files or directories to compile')
+    argparser.add_argument('-j', '--jobs', type=positiveInt,
+                           default=os.cpu_count() or 1,
+                           help='number of worker processes'
+                                ' (default: all cores)')
+    argparser.add_argument('-q', '--quiet', action='store_true',
+                           help='only print the summary')
+    args = argparser.parse_args(argv)
+
+    sources = findSources(args.paths)
+
+    if not sources:
+        print('No .coal files found.')
+        return 1
+
+    # Build (or load) the tables once, before the workers need them.
+    coal.buildParser()
+
+    failed = 0
+    uncached = 0
+    total_size = 0
+    total_stmts = 0
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(min(args.jobs, len(sources)),
+                              initializer=_initWorker) as pool:
+        results = pool.imap_unordered(compileFile, sources, chunksize=4)
+
+        for path, parsed, cached, size, stmts, elapsed, error in results:
+            if not parsed:
+                failed += 1
+
+                if error is None:
+                    print('FAILED {}'.format(path))
+                else:
+                    print('FAILED {}: {}'.format(path, error))
+
+                continue
+
+            total_size += size
+            total_stmts += stmts
+
+            if not cached:
+                uncached += 1
+
+            if not args.quiet:
+                print('{:>8.1f} KB {:>8} stmts {:>9.2f} ms {:>9.1f} KB/s  {}{}'
+                      .format(size / 1024.0, stmts, elapsed * 1000.0,
+                              size / 1024.0 / max(elapsed, 1e-9), path,
+                              '' if cached else ' (parsed, not cached)'))
+
+    elapsed = time.perf_counter() - start
+
+    cache.evictPrograms(cache.PROGRAM_CACHE_LIMIT)
+
+    print('Compiled {} of {} files ({:.1f} KB, {} stmts) in {:.2f} s:'
+          ' {:.1f} files/s, {:.1f} KB/s, {} jobs.'
+          .format(len(sources) - failed, len(sources), total_size / 1024.0,
+                  total_stmts, elapsed, len(sources) / elapsed,
+                  total_size / 1024.0 / elapsed, args.jobs))
+
+    if uncached:
+        print('{} of them parsed, but were not cached.'.format(uncached))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
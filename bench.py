@@ -0,0 +1,671 @@
+#!/usr/bin/env python3
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Benchmarks
+ # version 0.1
+##
+
+# Imports
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COAL = os.path.join(HERE, 'coal.py')
+
+
+# Utils
+def timeit(fn, runs):
+    '''
+    Run `fn` `runs` times and return the best and median times in seconds.
+    '''
+
+    times = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+
+    return times[0], times[len(times) // 2]
+
+
+def report(name, best, median, unit='ms'):
+    scale = 1000.0 if unit == 'ms' else 1.0
+
+    print('{:<32} best {:>9.2f} {}   median {:>9.2f} {}'
+          .format(name, best * scale, unit, median * scale, unit))
+
+
+def writeScript(directory, name, src):
+    path = os.path.join(directory, name)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(src)
+
+    return path
+
+
+def runCoal(args, env):
+    subprocess.run([sys.executable, COAL] + args,
+                   env=env,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   check=True)
+
+
+# Benchmarks
+def benchStartup(runs=10):
+    '''
+    Process startup for a trivial script, with a cold and a warm table cache.
+    '''
+
+    tmp = tempfile.mkdtemp(prefix='coal-bench-')
+    script = writeScript(tmp, 'startup.coal', 'let a: Int = 1\n')
+    env = dict(os.environ)
+
+    def cold():
+        env['COAL_CACHE_DIR'] = tempfile.mkdtemp(dir=tmp)
+        runCoal([script], env)
+
+    try:
+        report('startup (cold cache)', *timeit(cold, runs))
+
+        env['COAL_CACHE_DIR'] = tempfile.mkdtemp(dir=tmp)
+        runCoal([script], env)
+
+        report('startup (warm cache)',
+               *timeit(lambda: runCoal([script], env), runs))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def benchProgramCache(runs=10, size=5000):
+    '''
+    Startup for a large program, parsed from source and loaded from .coalc.
+    '''
+
+    tmp = tempfile.mkdtemp(prefix='coal-bench-')
+    lines = ['let a: Int = 0']
+    lines += ['a = a + {} * 2 - 1'.format(i) for i in range(size)]
+    script = writeScript(tmp, 'program.coal', '\n'.join(lines) + '\n')
+    env = dict(os.environ)
+    env['COAL_CACHE_DIR'] = os.path.join(tmp, 'cache')
+    programs = os.path.join(env['COAL_CACHE_DIR'], 'programs')
+
+    def parsed():
+        shutil.rmtree(programs, ignore_errors=True)
+        runCoal([script], env)
+
+    try:
+        runCoal([script], env)
+
+        report('{} stmts (parsed)'.format(size), *timeit(parsed, runs))
+
+        runCoal([script], env)
+
+        report('{} stmts (.coalc)'.format(size),
+               *timeit(lambda: runCoal([script], env), runs))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def benchParseScaling(sizes=(10000, 100000, 1000000)):
+    '''
+    Parse generated programs of growing size; time per statement should stay
+    flat if parsing is linear.
+    '''
+
+    import coal
+
+    parser = coal.buildParser()
+    stmt = 'a = a + 1\n'
+
+    for size in sizes:
+        src = 'let a: Int = 0\n' + stmt * (size - 1)
+
+        start = time.perf_counter()
+        program = coal.parse(src, parser)
+        elapsed = time.perf_counter() - start
+
+        assert len(program) == size
+
+        print('parse {:>8} stmts            {:>9.2f} s    {:>9.2f} us/stmt'
+              .format(size, elapsed, elapsed / size * 1e6))
+
+
+def benchStreaming(runs=5, size=20000):
+    '''
+    Time to first output for a large script, with and without --stream.
+    '''
+
+    tmp = tempfile.mkdtemp(prefix='coal-bench-')
+    lines = ['[print: "first"]', 'let a: Int = 0']
+    lines += ['a = a + 1'] * size
+    script = writeScript(tmp, 'stream.coal', '\n'.join(lines) + '\n')
+    env = dict(os.environ)
+    env['COAL_CACHE_DIR'] = os.path.join(tmp, 'cache')
+    env['PYTHONUNBUFFERED'] = '1'
+    programs = os.path.join(env['COAL_CACHE_DIR'], 'programs')
+
+    def firstLine(args):
+        shutil.rmtree(programs, ignore_errors=True)
+
+        proc = subprocess.Popen([sys.executable, COAL] + args + [script],
+                                env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        assert proc.stdout.readline() == b'first\n'
+        proc.kill()
+        proc.wait()
+
+    try:
+        runCoal([script], env)
+
+        report('first output (batch)', *timeit(lambda: firstLine([]), runs))
+        report('first output (--stream)',
+               *timeit(lambda: firstLine(['--stream']), runs))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def benchLexer(runs=5, size=2 * 1024 * 1024):
+    '''
+    Lexer throughput (MB/s): PLY LexTokens against compact token arrays and
+    the indentation-aware lexer.
+    '''
+
+    import lexer
+
+    with open(os.path.join(HERE, 'test.coal'), encoding='utf-8') as f:
+        chunk = f.read()
+
+    src = chunk * (size // len(chunk) + 1)
+    mb = len(src.encode('utf-8')) / (1024.0 * 1024.0)
+
+    def ply():
+        lex = lexer.lexer
+        lex.input(src)
+
+        for tok in iter(lex.token, None):
+            pass
+
+    def arrays():
+        lexer.tokenize(src)
+
+    def arrayTokens():
+        lex = lexer.ArrayLexer()
+        lex.input(src)
+
+        for tok in iter(lex.token, None):
+            pass
+
+    def indent():
+        lex = lexer.IndentLexer()
+        lex.input(src)
+
+        for tok in iter(lex.token, None):
+            pass
+
+    for name, fn in (('PLY lexer', ply),
+                     ('token arrays', arrays),
+                     ('token arrays + tokens', arrayTokens),
+                     ('IndentLexer', indent)):
+        best, median = timeit(fn, runs)
+
+        print('{:<32} best {:>9.2f} MB/s median {:>9.2f} MB/s'
+              .format(name, mb / best, mb / median))
+
+
+def benchImage(runs=10, size=500):
+    '''
+    Startup with a large prelude: re-running it against loading an image.
+    '''
+
+    tmp = tempfile.mkdtemp(prefix='coal-bench-')
+    funcs = []
+
+    for i in range(size):
+        name = 'fn' + ''.join('abcdefghij'[int(c)] for c in str(i))
+        funcs.append('def {}:(Int v) -> Int\n    return v * {}\nend\n'
+                     .format(name, i))
+        funcs.append('let {}Value: Int = {}\n'.format(name, i))
+
+    prelude = writeScript(tmp, 'prelude.coal', ''.join(funcs))
+    script = writeScript(tmp, 'main.coal', '[print: [fnbc: 3]]\n')
+    img = os.path.join(tmp, 'prelude.img')
+    env = dict(os.environ)
+    env['COAL_CACHE_DIR'] = os.path.join(tmp, 'cache')
+
+    try:
+        runCoal(['--prelude', prelude, '--save-image', img], env)
+
+        report('{} defs (prelude)'.format(size),
+               *timeit(lambda: runCoal(['--prelude', prelude, script], env),
+                       runs))
+        report('{} defs (image)'.format(size),
+               *timeit(lambda: runCoal(['--image', img, script], env), runs))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def benchServe(runs=10, size=500):
+    '''
+    Running a script through daemon.py against a fresh process.
+    '''
+
+    tmp = tempfile.mkdtemp(prefix='coal-bench-')
+    lines = []
+
+    for i in range(size):
+        name = 'v' + ''.join('abcdefghij'[int(c)] for c in str(i))
+        lines.append('let {}: Int = {}\n'.format(name, i))
+
+    lines.append('[print: vbc]\n')
+    script = writeScript(tmp, 'serve.coal', ''.join(lines))
+    env = dict(os.environ)
+    env['COAL_CACHE_DIR'] = os.path.join(tmp, 'cache')
+    env['COAL_SOCKET'] = os.path.join(tmp, 'serve.sock')
+    client = [sys.executable, os.path.join(HERE, 'daemon.py'), script]
+
+    server = subprocess.Popen([sys.executable, COAL, '--serve'],
+                              env=env,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+
+    try:
+        # Wait for "serving on ..."
+        server.stdout.readline()
+
+        report('{} stmts (fresh process)'.format(size),
+               *timeit(lambda: runCoal([script], env), runs))
+        report('{} stmts (daemon.py)'.format(size),
+               *timeit(lambda: subprocess.run(client,
+                                              env=env,
+                                              stdout=subprocess.DEVNULL,
+                                              check=True), runs))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmp)
+
+
+def benchEmbedding(runs=1000):
+    '''
+    Running one program many times with different inputs: parsing each
+    time against coal.compile() once and Program.run().
+    '''
+
+    import io
+    import coal
+
+    src = ''.join([
+        'def square:(Int v) -> Int\n',
+        '    return v * v\n',
+        'end\n',
+        'let total: Int = 0\n',
+        'for 1, n -> i\n',
+        '    total += [square: i]\n',
+        'end\n',
+        '[print: total]\n'
+    ])
+    parser = coal.buildParser()
+
+    def reparse(n):
+        coal.Program(coal.parse(src, parser)).run(stdout=io.StringIO(),
+                                                  names={'n': n})
+
+    program = coal.compile(src)
+
+    def rerun(n):
+        program.run(stdout=io.StringIO(), names={'n': n})
+
+    for name, fn in (('parse + run', reparse), ('compile once, run', rerun)):
+        start = time.perf_counter()
+
+        for n in range(runs):
+            fn(n % 10)
+
+        elapsed = time.perf_counter() - start
+
+        print('{:<32} {:>9.0f} runs/s   {:>9.2f} us/run'
+              .format(name, runs / elapsed, elapsed / runs * 1e6))
+
+
+def benchRepl(runs=1000):
+    '''
+    Per-input latency of the REPL, with its output thrown away.
+    '''
+
+    import io
+    import contextlib
+    import repl
+
+    session = repl.Repl()
+    inputs = (
+        ('let', 'let a: Int = 1\n'),
+        ('assign', 'a = a + 1\n'),
+        ('print', '[print: a]\n'),
+        ('inspect a name', 'a\n'),
+        ('block', 'if a > 0 do\n    a = a - 1\nend\n'),
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        session.feed(inputs[0][1])
+
+    for name, src in inputs[1:]:
+        def feed():
+            with contextlib.redirect_stdout(io.StringIO()):
+                session.feed(src)
+
+        report('repl: ' + name, *timeit(feed, runs))
+
+
+# Loop-heavy programs for comparing execution engines
+LOOP_PROGRAMS = (
+    ('for loop', ''.join([
+        'let total: Int = 0\n',
+        'for 1, 20000 -> i\n',
+        '    total += i * 3 % 7\n',
+        'end\n',
+        '[print: total]\n'
+    ])),
+    ('while + calls', ''.join([
+        'def step:(Int v) -> Int\n',
+        '    return v + 1\n',
+        'end\n',
+        'let i: Int = 0\n',
+        'while i < 5000 do\n',
+        '    i = [step: i]\n',
+        'end\n',
+        '[print: i]\n'
+    ])),
+    ('nested if', ''.join([
+        'let odd: Int = 0\n',
+        'let even: Int = 0\n',
+        'for 1, 10000 -> i\n',
+        '    if (i % 2) == 0 do\n',
+        '        even += 1\n',
+        '    else\n',
+        '        odd += 1\n',
+        '    end\n',
+        'end\n',
+        '[print: odd]\n'
+    ])),
+    ('small calls', ''.join([
+        'def area:(Int w) by:(Int h) -> Int\n',
+        '    return w * h\n',
+        'end\n',
+        'let total: Int = 0\n',
+        'for 1, 5000 -> i\n',
+        '    total += [area: i by: 3]\n',
+        'end\n',
+        '[print: total]\n'
+    ])),
+    ('invariants', ''.join([
+        'let words: List = ("alpha", "beta", "gamma", "delta")\n',
+        'let name: String = "coal"\n',
+        'let total: Int = 0\n',
+        'for 1, 10000 -> i\n',
+        '    total += (i % [words length]) + [name length] * 2\n',
+        'end\n',
+        '[print: total]\n'
+    ])),
+    ('literals', ''.join([
+        'let total: Int = 0\n',
+        'let label: String = ""\n',
+        'for 1, 10000 -> i\n',
+        '    if i > 5000 do\n',
+        '        total += 2\n',
+        '    else\n',
+        '        total += 1\n',
+        '    end\n',
+        '    label = "done"\n',
+        'end\n',
+        '[print: total]\n'
+    ])),
+)
+
+
+# Programs every engine (with and without -O) has to print the same thing
+# for: (name, source, expected output)
+EQUIVALENCE_PROGRAMS = (
+    ('operand order', ''.join([
+        'def bump:(Int v) -> Int\n',
+        '    v += 22\n',
+        '    return v\n',
+        'end\n',
+        'let u: Int = 100\n',
+        '[print: u + [bump: u]]\n'
+    ]), '244\n'),
+    ('compared operands', ''.join([
+        'def bump:(Int v) -> Int\n',
+        '    v += 22\n',
+        '    return v\n',
+        'end\n',
+        'let u: Int = 100\n',
+        '[print: u == [bump: u]]\n',
+        '[print: (u * 2) - [bump: u]]\n'
+    ]), 'Bool(true)\n100\n'),
+    ('stored literals', ''.join([
+        'let l: List = (1, 2, 3)\n',
+        'l{1} = 7\n',
+        '[l append: 5]\n',
+        'each l -> x\n',
+        '    x += 10\n',
+        'end\n',
+        '[print: l]\n',
+        'let a: Int = 5\n',
+        'a += 1\n',
+        '[print: 5]\n',
+        '[print: -0.0]\n',
+        '[print: 0.0]\n'
+    ]), 'List(11, 17, 13, 15)\n5\n-0.0\n0.0\n'),
+    ('aliased names', ''.join([
+        'let p: Int = 0\n',
+        'p = 5\n',
+        'let q: Int = 0\n',
+        'q = p\n',
+        'p += 1\n',
+        '[print: q]\n',
+        'def first:(Int v) -> Int\n',
+        '    let r: Int = 0\n',
+        '    r = v\n',
+        '    v += 1\n',
+        '    return r\n',
+        'end\n',
+        '[print: [first: 5]]\n',
+        '[print: 5]\n'
+    ]), '6\n6\n5\n'),
+)
+
+
+# A program using a name nothing defines: the slots engine reports it
+# before running anything, the others once they get to it
+UNKNOWN_NAME = '[print: 1]\n[print: nope]\n'
+UNKNOWN_NAME_ERROR = 'NameError: Unknown name "nope".\n'
+
+
+def benchEquivalence(engines=None):
+    '''
+    Check that every engine, with and without optimize.py, prints what
+    the tree walker printed before any of them existed, and how each one
+    reports an unknown name.
+    '''
+
+    import io
+    import coal
+
+    if engines is None:
+        engines = coal.ENGINES
+
+    for name, src, expected in EQUIVALENCE_PROGRAMS:
+        for engine in engines:
+            for optimize in (False, True):
+                program = coal.compile(src, engine=engine, optimize=optimize)
+                out = io.StringIO()
+                program.run(stdout=out)
+
+                assert out.getvalue() == expected,\
+                    (name, engine, optimize, out.getvalue())
+
+        print('{:<20} same output on {} engines'.format(name, len(engines)))
+
+    for engine in engines:
+        out = io.StringIO()
+        status = coal.compile(UNKNOWN_NAME, engine=engine).run(stdout=out)
+
+        if engine == 'slots':
+            expected = UNKNOWN_NAME_ERROR
+        else:
+            expected = '1\n' + UNKNOWN_NAME_ERROR
+
+        assert (status, out.getvalue()) == (1, expected),\
+            (engine, status, out.getvalue())
+
+    print('{:<20} reported on {} engines'.format('unknown name',
+                                                 len(engines)))
+
+
+def benchEngines(runs=5, engines=None):
+    '''
+    Loop-heavy programs, run by each execution engine.
+    '''
+
+    import io
+    import coal
+
+    if engines is None:
+        engines = coal.ENGINES
+
+    for name, src in LOOP_PROGRAMS:
+        baseline = None
+        expected = None
+
+        for engine in engines:
+            program = coal.compile(src, engine=engine)
+            out = io.StringIO()
+            program.run(stdout=out)
+
+            # Every engine has to print the same thing
+            if expected is None:
+                expected = out.getvalue()
+
+            assert out.getvalue() == expected, (engine, out.getvalue())
+
+            best, median = timeit(lambda: program.run(stdout=io.StringIO()),
+                                  runs)
+
+            if baseline is None:
+                baseline = best
+
+            print('{:<20} {:<10} best {:>9.2f} ms   median {:>9.2f} ms'
+                  '   x{:.2f}'.format(name, engine, best * 1e3, median * 1e3,
+                                      baseline / best))
+
+
+def benchOptimize(runs=5, engines=('tree', 'closures')):
+    '''
+    Loop-heavy programs, run as they are and after optimize.py.
+    '''
+
+    import io
+    import coal
+
+    for name, src in LOOP_PROGRAMS:
+        for engine in engines:
+            baseline = None
+            expected = None
+
+            for optimize in (False, True):
+                program = coal.compile(src, engine=engine, optimize=optimize)
+                out = io.StringIO()
+                program.run(stdout=out)
+
+                if expected is None:
+                    expected = out.getvalue()
+
+                assert out.getvalue() == expected, (engine, out.getvalue())
+
+                best, median = timeit(
+                    lambda: program.run(stdout=io.StringIO()), runs)
+
+                if baseline is None:
+                    baseline = best
+
+                print('{:<20} {:<10} {:<3} best {:>9.2f} ms   median {:>9.2f}'
+                      ' ms   x{:.2f}'.format(name, engine,
+                                             '-O' if optimize else '',
+                                             best * 1e3, median * 1e3,
+                                             baseline / best))
+
+
+def benchAllocations(engines=None):
+    '''
+    Coal objects made while running the loop-heavy programs, by engine.
+    '''
+
+    import io
+    import coal
+    import stdlib
+
+    if engines is None:
+        engines = coal.ENGINES
+
+    init = stdlib.CoalObject.__init__
+    made = [0]
+
+    def counting(self, *args):
+        made[0] += 1
+        init(self, *args)
+
+    for name, src in LOOP_PROGRAMS:
+        for engine in engines:
+            program = coal.compile(src, engine=engine)
+            made[0] = 0
+            stdlib.CoalObject.__init__ = counting
+
+            try:
+                program.run(stdout=io.StringIO())
+            finally:
+                stdlib.CoalObject.__init__ = init
+
+            print('{:<20} {:<10} {:>9} objects'.format(name, engine,
+                                                       made[0]))
+
+
+BENCHMARKS = {
+    'startup': benchStartup,
+    'program-cache': benchProgramCache,
+    'parse-scaling': benchParseScaling,
+    'streaming': benchStreaming,
+    'lexer': benchLexer,
+    'image': benchImage,
+    'embedding': benchEmbedding,
+    'repl': benchRepl,
+    'engines': benchEngines,
+    'equivalence': benchEquivalence,
+    'optimize': benchOptimize,
+    'allocations': benchAllocations,
+    'serve': benchServe,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+
+    for name in names:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark "{}". Available: {}.'
+                  .format(name, ', '.join(sorted(BENCHMARKS))))
+            sys.exit(1)
+
+        BENCHMARKS[name]()
@@ -0,0 +1,237 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Cache
+ # version 0.1
+##
+
+# Imports
+import os
+import sys
+import pickle
+import hashlib
+import tempfile
+import importlib.util
+
+import ply
+
+# Options
+PROGRAM_MAGIC = b'COALC1\n'
+PROGRAM_CACHE_LIMIT = int(os.environ.get('COAL_PROGRAM_CACHE_LIMIT',
+                                         64 * 1024 * 1024))
+
+
+# Utils
+def cacheDir(*parts):
+    '''
+    Return (and create) the per-user cache directory, or a sub-directory of it.
+
+    $COAL_CACHE_DIR wins, then $XDG_CACHE_HOME/coal, then ~/.cache/coal.
+    '''
+
+    base = os.environ.get('COAL_CACHE_DIR')
+
+    if not base:
+        xdg = os.environ.get('XDG_CACHE_HOME')
+
+        if not xdg:
+            xdg = os.path.join(os.path.expanduser('~'), '.cache')
+
+        base = os.path.join(xdg, 'coal')
+
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def ruleHash(namespace, prefix, *extra):
+    '''
+    Hash every PLY rule (strings and function docstrings) in `namespace`
+    whose name starts with `prefix`, plus any `extra` values.
+
+    Function rules are hashed in the order they are defined, which is the
+    order PLY gives them (and settles conflicts by); string rules by name.
+    '''
+
+    h = hashlib.sha1()
+    h.update(ply.__version__.encode('utf-8'))
+    h.update('{}.{}'.format(*sys.version_info[:2]).encode('utf-8'))
+
+    def order(name):
+        rule = namespace[name]
+
+        if callable(rule) and hasattr(rule, '__code__'):
+            return (1, rule.__code__.co_firstlineno, name)
+
+        return (0, 0, name)
+
+    names = [name for name in namespace if name.startswith(prefix)]
+
+    for name in sorted(names, key=order):
+        rule = namespace[name]
+
+        if callable(rule):
+            rule = rule.__doc__
+
+        h.update(name.encode('utf-8'))
+        h.update(repr(rule).encode('utf-8'))
+
+    for value in extra:
+        h.update(repr(value).encode('utf-8'))
+
+    return h.hexdigest()[:16]
+
+
+def loadTable(name):
+    '''
+    Load a cached PLY table module by name.
+
+    Returns the module when it is in the cache, or `name` itself so PLY
+    generates the tables and writes them to the cache directory.
+    '''
+
+    path = os.path.join(cacheDir(), name + '.py')
+
+    if not os.path.isfile(path):
+        return name
+
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except Exception:
+        # A broken or half-written table; let PLY regenerate it.
+        return name
+
+    return module
+
+
+# Compiled programs (.coalc)
+def programKey(src, version):
+    '''
+    Hash a source string together with the interpreter version.
+    '''
+
+    h = hashlib.sha1()
+    h.update(version.encode('utf-8'))
+    h.update(src.encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def programPath(key):
+    return os.path.join(cacheDir('programs'), key + '.coalc')
+
+
+def loadProgram(src, version):
+    '''
+    Return the cached, already parsed program for `src`, or None.
+    '''
+
+    key = programKey(src, version)
+    path = programPath(key)
+
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(PROGRAM_MAGIC)) != PROGRAM_MAGIC:
+                return None
+
+            header, program = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, ValueError):
+        return None
+
+    if header != (key, version):
+        return None
+
+    # Mark as recently used, for the LRU eviction.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return program
+
+
+def storeProgram(src, version, program, evict=True):
+    '''
+    Serialize a parsed program (a list of CoalAST nodes) to the cache.
+
+    Pass `evict=False` when storing many programs at once, and call
+    evictPrograms() after the last one.
+    '''
+
+    key = programKey(src, version)
+    path = programPath(key)
+    directory = os.path.dirname(path)
+
+    try:
+        data = pickle.dumps(((key, version), program),
+                            pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, RecursionError, TypeError):
+        return False
+
+    if len(data) > PROGRAM_CACHE_LIMIT:
+        return False
+
+    # Write to a temporary file first, so readers never see half a program.
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PROGRAM_MAGIC)
+            f.write(data)
+
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+        return False
+
+    if evict:
+        evictPrograms(PROGRAM_CACHE_LIMIT)
+
+    return True
+
+
+def evictPrograms(limit):
+    '''
+    Remove the least recently used programs until the cache fits in `limit`.
+    '''
+
+    directory = cacheDir('programs')
+    entries = []
+    total = 0
+
+    for name in os.listdir(directory):
+        if not name.endswith('.coalc'):
+            continue
+
+        path = os.path.join(directory, name)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    entries.sort()
+
+    for mtime, size, path in entries:
+        if total <= limit:
+            break
+
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+
+        total -= size
@@ -0,0 +1,567 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Closure compiler
+ # version 0.1
+##
+
+# Imports
+import sys
+import operator
+
+from ast import *
+
+
+# Expression classes and what they do with their operands' values
+OPERATORS = {
+    ExprAddition: operator.add,
+    ExprSubtraction: operator.sub,
+    ExprMultiplication: operator.mul,
+    ExprDivision: operator.truediv,
+    ExprModulo: operator.mod,
+    ExprEqual: operator.eq,
+    ExprNotEqual: operator.ne,
+    ExprGreater: operator.gt,
+    ExprLess: operator.lt,
+    ExprEqualGreater: operator.ge,
+    ExprEqualLess: operator.le
+}
+
+
+class Compiler(object):
+    '''
+    Compiles statements, once, into closures called as fn(interpreter,
+    scope). They do what Interpreter.execute() does for the same nodes,
+    without looking at the node types again; node types the compiler
+    doesn't know are handed to Interpreter.execute().
+
+    Function bodies are compiled on their first call and kept, so a
+    Compiler should live as long as the programs it compiled.
+    '''
+
+    def __init__(self):
+        self.compilers = {
+            LocalMethodCall: self._compileLocalMethodCall,
+            ObjectMethodCall: self._compileObjectMethodCall,
+            NameDef: self._compileNameDef,
+            NameDefEmpty: self._compileNameDefEmpty,
+            NameAssign: self._compileNameAssign,
+            IterableItemAssign: self._compileIterableItemAssign,
+            FuncDef: self._compileFuncDef,
+            FuncRet: self._compileFuncRet,
+            IfBlock: self._compileIfBlock,
+            ForBlock: self._compileForBlock,
+            EachBlock: self._compileEachBlock,
+            WhileBlock: self._compileWhileBlock,
+            FlowBreak: self._compileFlowBreak,
+            FlowNext: self._compileFlowNext,
+            Name: self._compileName,
+            ItemFromIterable: self._compileItemFromIterable,
+            Void: self._compileVoid,
+            Bool: self._compileConstant,
+            Int: self._compileConstant,
+            Float: self._compileConstant,
+            String: self._compileConstant,
+            List: self._compileList,
+            Exit: self._compileExit
+        }
+
+        for node_type in OPERATORS:
+            self.compilers[node_type] = self._compileExpr
+
+        # Compiled function bodies, by id() of their suite
+        self.suites = {}
+
+    def compile(self, node):
+        compiler = self.compilers.get(type(node))
+
+        if compiler is None:
+            return lambda it, scope: it.execute(node, scope)
+
+        return compiler(node)
+
+    def compileSuite(self, suite):
+        return [self.compile(st) for st in suite]
+
+    def functionBody(self, suite):
+        '''
+        A function body as (closure, is it a "return") pairs, compiled on
+        first use.
+        '''
+
+        entry = self.suites.get(id(suite))
+
+        if entry is None or entry[0] is not suite:
+            body = [(self.compile(st), isinstance(st, FuncRet))
+                    for st in suite]
+
+            # The suite is kept too, so its id() isn't reused
+            entry = (suite, body)
+            self.suites[id(suite)] = entry
+
+        return entry[1]
+
+    # Call
+    def _compileLocalMethodCall(self, node):
+        selectors = node.selectors
+        args = self.compileSuite(node.selector_args)
+        functionBody = self.functionBody
+
+        def run(it, scope):
+            selector_args = [arg(it, scope) for arg in args]
+
+            if selectors in it.builtins.public:
+                return it.builtins.call(selectors, selector_args)
+            elif selectors in scope['methods']:
+                g = it.g
+
+                if g.scope_depth == 0:
+                    n_scope = it.newScope()
+                else:
+                    n_scope = scope
+
+                g.scope_depth += 1
+
+                defs = scope['methods'][selectors](n_scope, selector_args)
+                suite, n_scope, rtype = defs
+
+                for st, is_return in functionBody(suite):
+                    result = st(it, n_scope)
+
+                    if is_return:
+                        if result.object_type != rtype:
+                            throwError(0, 0,
+                                       'TypeError: Invalid return type for'
+                                       ' "{}": "{}"'
+                                       .format(rtype, result.object_type))
+
+                        g.scope_depth -= 1
+                        return result
+
+                g.scope_depth -= 1
+
+            return CoalVoid()
+
+        return run
+
+    def _compileObjectMethodCall(self, node):
+        obj = self.compile(node.object)
+        selectors = node.selectors
+        args = self.compileSuite(node.selector_args)
+
+        def run(it, scope):
+            target = obj(it, scope)
+
+            return target.call(selectors, [arg(it, scope) for arg in args])
+
+        return run
+
+    # Name
+    def _compileNameDef(self, node):
+        name = node.name
+        name_type = node.type
+        value = self.compile(node.value)
+
+        def run(it, scope):
+            result = value(it, scope)
+            builtin_types = it.builtins.types
+
+            if name_type in builtin_types:
+                scope['names'][name] =\
+                    builtin_types[name_type]['init'](result.value,
+                                                     result.object_type)
+            elif name_type in scope['types']:
+                if result.object_type != name_type:
+                    throwError(0, 0,
+                               'TypeError: Unknown value type for "{}": {}'
+                               .format(name_type, result.object_type))
+
+                scope['names'][name] = result
+
+            return CoalVoid()
+
+        return run
+
+    def _compileNameDefEmpty(self, node):
+        name = node.name
+        name_type = node.type
+
+        def run(it, scope):
+            if name_type in scope['types'] or name_type == 'Any':
+                scope['names'][name] = CoalVoid(obj_type=name_type)
+            else:
+                throwError(0, 4,
+                           'TypeError: Unknown type "{}"'.format(name_type))
+
+            return CoalVoid()
+
+        return run
+
+    def _compileNameAssign(self, node):
+        name = node.name
+        mode = node.mode
+        value = self.compile(node.value)
+        value_node = node.value
+
+        def run(it, scope):
+            result = value(it, scope)
+            names = scope['names']
+
+            if name not in names:
+                throwError(0, 1,
+                           'NameError: Unknown name "{}"'.format(name))
+
+            current = names[name]
+
+            if isinstance(current, CoalVoid):
+                var_type = current.value
+
+                if var_type != 'Any' and var_type != result.object_type:
+                    throwError(0, 3,
+                               'TypeError: Wrong value type for Void({}): {}'
+                               .format(var_type, value_node.object_type))
+            elif current.object_type != result.object_type:
+                throwError(0, 3, 'TypeError: Wrong value type for {}: {}'
+                                 .format(current.object_type,
+                                         result.object_type))
+
+            if mode == '=':
+                names[name] = unshared(result)
+            elif mode == '+=':
+                ownValue(names, name).value += result.value
+            elif mode == '-=':
+                ownValue(names, name).value -= result.value
+            elif mode == '*=':
+                ownValue(names, name).value *= result.value
+            elif mode == '/=':
+                ownValue(names, name).value /= result.value
+
+            return CoalVoid()
+
+        return run
+
+    def _compileIterableItemAssign(self, node):
+        name = node.name
+        index = self.compile(node.index)
+        value = self.compile(node.value)
+
+        def run(it, scope):
+            index_value = index(it, scope)
+            result = value(it, scope)
+
+            if name not in scope['names']:
+                throwError(0, 0,
+                           'NameError: Unknown name "{}"'.format(name))
+
+            target = scope['names'][name]
+
+            if not isinstance(target, CoalIterableObject):
+                throwError(0, 0, 'Exception: "{}" object is not a writable'
+                           ' iterable'.format(target.object_type))
+
+            target.assign(index_value, result)
+
+            return CoalVoid()
+
+        return run
+
+    # Function
+    def _compileFuncDef(self, node):
+        def run(it, scope):
+            scope['methods'][node.selectors] = CoalFunction(
+                node.selectors,
+                node.selector_names,
+                node.selector_types,
+                node.selector_aliases,
+                node.return_type,
+                node.suite,
+                node.simple
+            )
+
+            return CoalVoid()
+
+        return run
+
+    def _compileFuncRet(self, node):
+        return self.compile(node.value)
+
+    # Conditional
+    def _compileIfBlock(self, node):
+        branches = [(self.compile(node.test), self.compileSuite(node.suite))]
+
+        if node.elif_blocks is not None:
+            for block in node.elif_blocks:
+                branches.append((self.compile(block[0]),
+                                 self.compileSuite(block[1])))
+
+        if node.else_suite is not None:
+            else_suite = self.compileSuite(node.else_suite)
+        else:
+            else_suite = None
+
+        def run(it, scope):
+            for test, suite in branches:
+                result = test(it, scope)
+
+                if result.value and not isinstance(result.value, CoalVoid):
+                    for st in suite:
+                        st(it, scope)
+
+                    return
+
+            if else_suite is not None:
+                for st in else_suite:
+                    st(it, scope)
+
+            return CoalVoid()
+
+        return run
+
+    # Loop
+    def _compileForBlock(self, node):
+        start = self.compile(node.start)
+        end = self.compile(node.end)
+        has_interval = node.interval is not None
+        interval = self.compile(node.interval) if has_interval else None
+        name = node.name
+        suite = self.compileSuite(node.suite)
+
+        def run(it, scope):
+            g = it.g
+            g.flow = True
+
+            start_value = start(it, scope)
+            end_value = end(it, scope)
+
+            if has_interval:
+                interval_value = interval(it, scope)
+            else:
+                interval_value = coalInt(1)
+
+            if not isinstance(start_value, CoalInt)\
+               or not isinstance(end_value, CoalInt)\
+               or (has_interval
+                   and not isinstance(interval_value, CoalInt)):
+                throwError(0, 0, 'TypeError: The values for "start", '
+                                 '"end" and "interval" must be "Int".')
+
+            names = scope['names']
+
+            if name in names:
+                var_type = names[name].object_type
+
+                if var_type != 'Void(Any)' and var_type != 'Int':
+                    throwError(0, 3, 'TypeError: Wrong value type for {}: Int'
+                                     .format(var_type))
+            else:
+                i = CoalInt(start_value.value)
+                names[name] = i
+
+                while i.value <= end_value.value:
+                    if names[name] is not i:
+                        ownValue(names, name).value = i.value
+
+                    for st in suite:
+                        if g.flow_next:
+                            g.flow_next = False
+                            break
+                        elif g.flow_break:
+                            g.flow_break = False
+                            return
+
+                        st(it, scope)
+
+                    i.value += interval_value.value
+
+                del names[name]
+
+            g.flow = False
+
+            return CoalVoid()
+
+        return run
+
+    def _compileEachBlock(self, node):
+        iterable = self.compile(node.iterable)
+        name = node.name
+        suite = self.compileSuite(node.suite)
+
+        def run(it, scope):
+            g = it.g
+            g.flow = True
+
+            items = iterable(it, scope)
+
+            if not isinstance(items, CoalIterableObject):
+                throwError('TypeError: "{}" object is not iterable.'
+                           .format(items.object_type))
+
+            names = scope['names']
+
+            if name not in names:
+                names[name] = CoalVoid(obj_type='Any')
+
+                length = items.call('length:', []).value
+                i = CoalInt(0)
+
+                while i.value < length:
+                    names[name] = items.iter(i)
+
+                    for st in suite:
+                        if g.flow_next:
+                            g.flow_next = False
+                            break
+                        elif g.flow_break:
+                            g.flow_break = False
+                            return
+
+                        st(it, scope)
+
+                    i.value += 1
+
+                del names[name]
+
+            g.flow = False
+
+            return CoalVoid()
+
+        return run
+
+    def _compileWhileBlock(self, node):
+        test = self.compile(node.test)
+        suite = self.compileSuite(node.suite)
+
+        def run(it, scope):
+            g = it.g
+            g.flow = True
+
+            while test(it, scope).value:
+                for st in suite:
+                    if g.flow_next:
+                        g.flow_next = False
+                        break
+                    elif g.flow_break:
+                        g.flow_break = False
+                        return
+
+                    st(it, scope)
+
+            g.flow = False
+
+            return CoalVoid()
+
+        return run
+
+    def _compileFlowBreak(self, node):
+        def run(it, scope):
+            if not it.g.flow:
+                throwError('SyntaxError: Invalid syntax: "break".')
+
+            it.g.flow_break = True
+
+            return CoalVoid()
+
+        return run
+
+    def _compileFlowNext(self, node):
+        def run(it, scope):
+            if not it.g.flow:
+                throwError('SyntaxError: Invalid syntax: "next".')
+
+            it.g.flow_next = True
+
+            return CoalVoid()
+
+        return run
+
+    # Expression
+    def _compileExpr(self, node):
+        a = self.compile(node.a)
+        b = self.compile(node.b)
+        op = OPERATORS[type(node)]
+
+        def run(it, scope):
+            # Both operands run before either value is read, like the
+            # tree walker: the right one may change the left in place
+            left = a(it, scope)
+            right = b(it, scope)
+            result = op(left.value, right.value)
+
+            if type(result) == int:
+                return coalInt(result)
+            elif type(result) == float:
+                return CoalFloat(result)
+            elif type(result) == bool:
+                return coalBool(result)
+
+            return CoalBool(result)
+
+        return run
+
+    # Value
+    def _compileName(self, node):
+        name = node.name
+
+        def run(it, scope):
+            names = scope['names']
+
+            if name not in names:
+                throwError(0, 0,
+                           'NameError: Unknown name "{}"'.format(name))
+
+            return names[name]
+
+        return run
+
+    def _compileItemFromIterable(self, node):
+        name = self.compile(node.name)
+        index = self.compile(node.index)
+        end = self.compile(node.end) if node.end is not None else None
+
+        def run(it, scope):
+            iterable = name(it, scope)
+            start = index(it, scope)
+
+            if end is None:
+                return iterable.iter(start, None)
+
+            return iterable.iter(start, end(it, scope))
+
+        return run
+
+    # Void literals make a new object every time (the others are pooled)
+    def _compileVoid(self, node):
+        value = node.value
+
+        return lambda it, scope: CoalVoid(value)
+
+    def _compileConstant(self, node):
+        value = node.constant
+
+        return lambda it, scope: value
+
+    def _compileList(self, node):
+        items = self.compileSuite(node.value)
+
+        def run(it, scope):
+            return CoalList([unshared(item(it, scope)) for item in items])
+
+        return run
+
+    # Exit the program
+    def _compileExit(self, node):
+        value = self.compile(node.value)
+
+        def run(it, scope):
+            result = value(it, scope)
+
+            if not isinstance(result, CoalInt) and\
+               not isinstance(result, CoalBool):
+                throwError(0, 0, 'TypeError: The program must return "Int"'
+                                 ' or "Bool".')
+
+            raise CoalExit(result.value)
+
+        return run
@@ -5,22 +5,30 @@
  # Python implementation of the Coal language
  #
  # author William "10c8" F.
- # version 0.33
+ # version 0.34
  # copyright MIT
 ##
 
 # Imports
 import sys
 import re
+import threading
 import collections
-import ply.yacc as yacc
 
+import cache
 import lexer
 
 from ast import *
 
 # Options
+VERSION = '0.34'
 DEBUGGING = False
+PROGRAM_CACHE = True
+
+# Execution engines: walking the tree, closures compiled from it,
+# bytecode run by vm.py, Python code written by transpile.py, or walking
+# the tree with hot loops and functions specialized (tiers.py)
+ENGINES = ('tree', 'closures', 'bytecode', 'python', 'tiered', 'slots')
 
 
 # Utils
@@ -86,9 +94,24 @@ tokens = lexer.tokens
 
 def p_program(p):
     '''
-    program : stmts
+    program : program stmt
+            | stmt
     '''
-    p.lexer.ast = list(flatten(p[1]))
+
+    stmt = p[len(p) - 1]
+
+    # Streaming: hand each finished top-level statement to the evaluator
+    # right away, instead of keeping the whole program around.
+    if p.lexer.stream is not None:
+        p.lexer.stream(stmt)
+        p[0] = None
+    elif len(p) == 3:
+        p[1].append(stmt)
+        p[0] = p[1]
+    else:
+        p[0] = [stmt]
+
+    p.lexer.ast = p[0]
 
 
 # Statements
@@ -98,8 +121,10 @@ def p_stmts(p):
           | stmt
     '''
 
+    # Append in place, so long suites are built in linear time
     if len(p) == 3:
-        p[0] = p[1:]
+        p[1].append(p[2])
+        p[0] = p[1]
     else:
         p[0] = [p[1]]
 
@@ -206,11 +231,7 @@ def p_type_def(p):
 
     name = p[2]
     extends = p[4]
-
-    if isinstance(p[5], list):
-        suite = list(flatten(p[5]))
-    else:
-        suite = [p[5]]
+    suite = p[5]
 
     p[0] = TypeDef(
         name,
@@ -228,11 +249,7 @@ def p_type_init_def(p):
     selector_names = [s[0] for s in selectors]
     selector_types = [s[1] for s in selectors]
     selector_aliases = [s[2] if len(s) > 2 else None for s in selectors]
-
-    if isinstance(p[3], list):
-        suite = list(flatten(p[3]))
-    else:
-        suite = [p[3]]
+    suite = p[3]
 
     p[0] = TypeInitDef(
         selector_names,
@@ -368,11 +385,7 @@ def p_func_def_simple(p):
 
     selector = p[2]
     return_type = p[4]
-
-    if isinstance(p[5], list):
-        suite = list(flatten(p[5]))
-    else:
-        suite = [p[5]]
+    suite = p[5]
 
     p[0] = FuncDef(
         [selector],
@@ -398,11 +411,7 @@ def p_func_def(p):
     selector_types = [s[1] for s in selectors]
     selector_aliases = [s[2] if len(s) > 2 else None for s in selectors]
     return_type = p[4]
-
-    if isinstance(p[5], list):
-        suite = list(flatten(p[5]))
-    else:
-        suite = [p[5]]
+    suite = p[5]
 
     p[0] = FuncDef(
         selector_names,
@@ -464,19 +473,11 @@ def p_for(p):
     if len(p) == 10:
         interval = p[6]
         name = p[8]
-
-        if isinstance(p[9], list):
-            suite = list(flatten(p[9]))
-        else:
-            suite = [p[9]]
+        suite = p[9]
     else:
         interval = None
         name = p[6]
-
-        if isinstance(p[7], list):
-            suite = list(flatten(p[7]))
-        else:
-            suite = [p[7]]
+        suite = p[7]
 
     p[0] = ForBlock(
         start,
@@ -495,7 +496,7 @@ def p_each(p):
     p[0] = EachBlock(
         p[2],
         p[4],
-        list(flatten(p[5]))
+        p[5]
     )
 
 
@@ -506,7 +507,7 @@ def p_while(p):
 
     p[0] = WhileBlock(
         p[2],
-        list(flatten(p[4]))
+        p[4]
     )
 
 
@@ -536,38 +537,27 @@ def p_conditional(p):
     if len(p) == 3:  # IF test DO stmts END
         p[0] = IfBlock(
             p[1][0],
-            list(flatten(p[1][1]))
+            p[1][1]
         )
     elif len(p) == 4:  # (IfBlock ELSE stmts END)
         if p[2][0] is None:
-            for i in range(1, len(p[2])):
-                p[2][i] = (p[2][i][0], list(flatten(p[2][i][1])))
-
             p[0] = IfBlock(
                 p[1][0],
-                list(flatten(p[1][1])),
+                p[1][1],
                 p[2][1:]
             )
         else:
             p[0] = IfBlock(
                 p[1][0],
-                list(flatten(p[1][1])),
-                else_suite=list(flatten(p[2]))
+                p[1][1],
+                else_suite=p[2]
             )
     else:
-        if len(p) > 3:
-            else_suite = list(flatten(p[3]))
-        else:
-            else_suite = None
-
-        for i in range(1, len(p[2])):
-            p[2][i] = (p[2][i][0], list(flatten(p[2][i][1])))
-
         p[0] = IfBlock(
             p[1][0],
-            list(flatten(p[1][1])),
+            p[1][1],
             p[2][1:],
-            else_suite
+            p[3]
         )
 
 
@@ -587,7 +577,11 @@ def p_elif_blocks(p):
                | EMPTY
     '''
     if len(p) == 3:
-        p[0] = list(flatten(p[1:]))
+        if p[1] is None:
+            p[0] = [None, p[2]]
+        else:
+            p[1].append(p[2])
+            p[0] = p[1]
 
 
 def p_else_block(p):
@@ -733,7 +727,10 @@ def p_value_list_items(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = list(flatten(filter(lambda a: a != ',', p[1:])))
+        if len(p) == 4:
+            p[1].append(p[3])
+
+        p[0] = p[1]
 
 
 def p_value_name(p):
@@ -775,42 +772,524 @@ def p_exit(p):
 
 # Error rule for syntax errors
 def p_error(p):
+    if p is None:
+        print('Syntax error: Unexpected end of input.')
+        sys.exit(1)
+
     throwError(p, 0, 'Syntax error: {}'.format(p.value))
 
 
+# The LALR tables are cached per grammar, so only the first run after a
+# grammar (or token) change pays for generating them.
+TABLE_HASH = cache.ruleHash(globals(), 'p_', precedence, lexer.TABLE_HASH)
+
+# Compiled programs are only valid for this interpreter and grammar
+PROGRAM_VERSION = '{}-{}'.format(VERSION, TABLE_HASH)
+
+
+def buildParser():
+    '''
+    Build the PLY parser, from the cached LALR tables unless debugging.
+    '''
+
+    # Imported here, so programs loaded from the cache never touch yacc.
+    import ply.yacc as yacc
+
+    if DEBUGGING:
+        return yacc.yacc()
+
+    return yacc.yacc(optimize=True,
+                     debug=False,
+                     tabmodule=cache.loadTable('parsetab_' + TABLE_HASH),
+                     outputdir=cache.cacheDir())
+
+
+# The lexers are shared, so one thread parses at a time (lazily kept
+# function bodies are parsed while programs run).
+_parse_lock = threading.RLock()
+
+
+def parse(src, parser=None, stream=None, lineno=1, array_lexer=False):
+    '''
+    Parse a source string into a flat list of statements.
+
+    If `stream` is given, it is called with every top-level statement as
+    soon as it is parsed, and nothing is kept (an empty list is returned).
+    `lineno` is the line `src` starts at, for error messages. With
+    `array_lexer`, `src` is tokenized into arrays before parsing.
+    '''
+
+    if parser is None:
+        parser = buildParser()
+
+    # lex = lexer.IndentLexer()
+    if array_lexer:
+        lex = lexer.ArrayLexer()
+    else:
+        lex = lexer.lexer
+
+    with _parse_lock:
+        lex.ast = []
+        lex.lineno = lineno
+        lex.stream = stream
+
+        try:
+            parser.parse(src, lexer=lex)
+        finally:
+            lex.stream = None
+
+        return lex.ast or []
+
+
+# Lazily kept function bodies are parsed with one shared parser
+_suite_parser = None
+
+
+def parseSuite(src, lineno, array_lexer=False):
+    '''
+    Parse a function body kept as source by lazy.parse().
+    '''
+
+    global _suite_parser
+
+    if _suite_parser is None:
+        _suite_parser = buildParser()
+
+    return parse(src, _suite_parser, lineno=lineno,
+                 array_lexer=array_lexer)
+
+
+LazySuite.parse = parseSuite
+
+
+def load(src, lazy=False, stream=None, array_lexer=False,
+         check_indent=False):
+    '''
+    Get the program for a source string: from the .coalc cache when it is
+    there, parsed (and cached) otherwise. With `stream`, statements are
+    run while parsing and an empty program is returned. `array_lexer` is
+    passed on to parse(); with `check_indent`, badly indented blocks are
+    reported like syntax errors first.
+    '''
+
+    if check_indent:
+        try:
+            lexer.checkIndentation(src)
+        except IndentationError as e:
+            print('IndentationError: {}.'.format(e))
+            sys.exit(1)
+
+    program_version = PROGRAM_VERSION
+
+    if lazy:
+        # Lazy programs hold source text, so they are cached separately
+        # (and by the lexer their bodies will be parsed with)
+        program_version += '-lazy'
+
+        if array_lexer:
+            program_version += '-arrays'
+
+    if PROGRAM_CACHE and not DEBUGGING:
+        program = cache.loadProgram(src, program_version)
+
+        if program is not None:
+            return program
+
+    parser = buildParser()
+
+    if DEBUGGING:
+        lexer.lexer.input(src)
+
+        while True:
+            tok = lexer.lexer.token()
+
+            if not tok:
+                break
+
+            print(tok)
+
+    if stream is not None:
+        # Nothing is kept, so there is nothing to cache either.
+        return parse(src, parser, stream=stream, array_lexer=array_lexer)
+
+    if lazy:
+        import lazy as lazy_parser
+
+        program = lazy_parser.parse(src, parser, array_lexer)
+    else:
+        program = parse(src, parser, array_lexer=array_lexer)
+
+    if PROGRAM_CACHE and not DEBUGGING:
+        cache.storeProgram(src, program_version, program)
+
+    return program
+
+
+def readFile(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+# Embedding
+class Program(object):
+    '''
+    A parsed program, run as many times as needed (see compile()).
+    '''
+
+    def __init__(self, stmts, engine='tree', path=None, src=None,
+                 version=PROGRAM_VERSION):
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine "{}"'.format(engine))
+
+        self.stmts = stmts
+        self.engine = engine
+
+        if engine == 'closures':
+            import closures
+
+            self.compiler = closures.Compiler()
+            self.compiled = self.compiler.compileSuite(stmts)
+        elif engine == 'bytecode':
+            import vm
+
+            self.compiler = vm.Compiler()
+            self.compiled = [self.compiler.compileProgram(stmts)]
+        elif engine == 'python':
+            import transpile
+
+            self.compiled = [transpile.compileProgram(stmts, path, src,
+                                                      version)]
+        elif engine == 'slots':
+            import slots
+
+            # Compiled for each set of predefined names (see code())
+            self.compiler = slots.Compiler()
+            self.compiled = {}
+
+    def code(self, names=()):
+        '''
+        The compiled statements, as fn(interpreter, scope) closures, for a
+        run with the global `names` already defined.
+        '''
+
+        if self.engine == 'slots':
+            known = frozenset(names)
+
+            if known not in self.compiled:
+                self.compiled[known] = [
+                    self.compiler.compileProgram(self.stmts, known)]
+
+            return self.compiled[known]
+
+        return self.compiled
+
+    def run(self, stdout=None, names=None):
+        '''
+        Run the program in a new Interpreter and return its exit status
+        (0 when it runs to the end). Runs don't share any state, so a
+        Program can be run from several threads at once.
+
+        `names` predefines global names; Python values are converted with
+        coalValue(). `stdout` receives what the program prints (and its
+        error messages), instead of sys.stdout.
+
+        The slots engine compiles the program on its first run with a set
+        of `names`. Unknown names are reported then, before anything runs,
+        and the run ends with status 1.
+        '''
+
+        if self.engine == 'tiered':
+            import tiers
+
+            return tiers.TieredInterpreter(stdout).run(self.stmts, names)
+        elif self.engine == 'slots':
+            # Compiled in the run, so its errors go to `stdout` too
+            def program(it, scope):
+                for fn in self.code(names or ()):
+                    fn(it, scope)
+
+            return Interpreter(stdout).run([program], names, compiled=True)
+        elif self.engine != 'tree':
+            return Interpreter(stdout).run(self.code(names or ()), names,
+                                           compiled=True)
+
+        return Interpreter(stdout).run(self.stmts, names)
+
+    def execute(self, state, scope):
+        '''
+        Run the program in `scope` of an Interpreter that is already set
+        up (with preludes or an image loaded), like the command line
+        does. Errors end it with SystemExit.
+        '''
+
+        if self.engine == 'tree':
+            for stmt in self.stmts:
+                state.execute(stmt, scope)
+        elif self.engine == 'tiered':
+            import tiers
+
+            tiered = tiers.TieredInterpreter(state=state)
+
+            for stmt in self.stmts:
+                tiered.execute(stmt, scope)
+        else:
+            for fn in self.code(scope['names']):
+                fn(state, scope)
+
+
+def compile(src, lazy=False, engine='tree', path=None, optimize=False,
+            array_lexer=False):
+    '''
+    Parse a source string once into a Program, run by `engine` (one of
+    ENGINES). Syntax errors are reported like the command line does:
+    printed, then SystemExit.
+
+    `path` is where `src` was read from; the python engine caches its code
+    next to it. With `optimize`, constant expressions are folded, dead
+    code removed, small functions inlined and pure expressions cached
+    first (see optimize.py). `array_lexer` is passed on to parse().
+    '''
+
+    stmts = load(src, lazy, array_lexer=array_lexer)
+    version = PROGRAM_VERSION
+
+    if optimize:
+        import optimize as optimizer
+
+        stmts = optimizer.optimize(stmts)
+        version += '-O'
+
+    return Program(stmts, engine, path, src, version)
+
+
 # TESTING!
-# Build the parser
-if len(sys.argv) < 2:
-    print('The REPL isn\'t ready yet. :(')
-    print('Please specify a file to run.')
-    print('Example: coal myprogram.coal')
+if __name__ == '__main__':
+    import argparse
+
+    # Modules that import coal (daemon.py, repl.py, lazy.py...) get this
+    # one, instead of loading a second copy with its own parser and state
+    sys.modules['coal'] = sys.modules[__name__]
+
+    if sys.argv[1:2] == ['compile']:
+        import batch
+
+        sys.exit(batch.main(sys.argv[2:]))
+
+    argparser = argparse.ArgumentParser(prog='coal')
+    argparser.add_argument('file', nargs='?',
+                           help='program to run')
+    argparser.add_argument('-s', '--stream', action='store_true',
+                           help='run top-level statements as soon as they'
+                                ' are parsed')
+    argparser.add_argument('--array-lexer', action='store_true',
+                           help='tokenize into compact arrays in a single'
+                                ' pass before parsing')
+    argparser.add_argument('--check-indent', action='store_true',
+                           help='reject programs whose blocks aren\'t'
+                                ' indented consistently')
+    argparser.add_argument('--lazy', action='store_true',
+                           help='only parse function bodies when they are'
+                                ' first called')
+    argparser.add_argument('--lazy-stats', action='store_true',
+                           help='like --lazy, and report how many bodies'
+                                ' were never parsed')
+    argparser.add_argument('--engine', choices=ENGINES, default='tree',
+                           help='how statements are run: by walking the'
+                                ' tree (default), as compiled closures, as'
+                                ' bytecode, transpiled to Python, tiered'
+                                ' (hot code specialized) or as closures'
+                                ' with names resolved to slots')
+    argparser.add_argument('--tier-stats', action='store_true',
+                           help='like --engine tiered, and report how many'
+                                ' loops and functions were specialized')
+    argparser.add_argument('--disassemble', action='store_true',
+                           help='print the bytecode of the program instead'
+                                ' of running it')
+    argparser.add_argument('--python-source', action='store_true',
+                           help='print the program transpiled to Python'
+                                ' instead of running it')
+    argparser.add_argument('-O', '--optimize', action='store_true',
+                           help='fold constant expressions, remove dead code,'
+                                ' inline small functions and hoist loop'
+                                ' invariants before running')
+    argparser.add_argument('--optimize-report', action='store_true',
+                           help='like --optimize, and report what was'
+                                ' folded, removed, inlined, hoisted and'
+                                ' reused')
+    argparser.add_argument('--inline-limit', metavar='NODES', type=int,
+                           help='like --optimize, inlining functions of up'
+                                ' to NODES nodes (0 turns inlining off)')
+    argparser.add_argument('--image', metavar='IMAGE',
+                           help='start from an image saved by --save-image')
+    argparser.add_argument('--prelude', metavar='FILE', action='append',
+                           default=[],
+                           help='run FILE before the program (repeatable)')
+    argparser.add_argument('--save-image', metavar='IMAGE',
+                           help='save the interpreter state, after the'
+                                ' preludes ran, to IMAGE')
+    argparser.add_argument('--serve', metavar='SOCKET', nargs='?', const='',
+                           help='keep a warm interpreter running and run'
+                                ' scripts sent by daemon.py over a Unix'
+                                ' socket (default: serve.sock in the cache'
+                                ' directory)')
+    argparser.add_argument('-v', '--version', action='version',
+                           version='Coal {}'.format(VERSION))
+    args = argparser.parse_args()
+
+    if args.lazy_stats:
+        args.lazy = True
+
+    if args.tier_stats:
+        args.engine = 'tiered'
+
+    if args.optimize_report or args.inline_limit is not None:
+        args.optimize = True
+
+    if args.lazy and args.stream:
+        argparser.error('--lazy and --stream can\'t be used together')
+
+    if args.lazy_stats:
+        import atexit
+        import lazy
+
+        atexit.register(lazy.report)
+
+    if args.image is not None or args.save_image is not None:
+        import image
+
+    if args.engine == 'closures':
+        import closures
+
+        compiler = closures.Compiler()
+
+        def execute(stmt):
+            compiler.compile(stmt)(interpreter, local_scope[0])
+    elif args.engine == 'bytecode' or args.disassemble:
+        import vm
+
+        compiler = vm.Compiler()
+
+        def execute(stmt):
+            compiler.compileProgram([stmt])(interpreter, local_scope[0])
+    elif args.engine == 'python' or args.python_source:
+        import transpile
+
+        def execute(stmt):
+            transpile.compileProgram([stmt])(interpreter, local_scope[0])
+    elif args.engine == 'slots':
+        import slots
+
+        compiler = slots.Compiler()
+
+        def execute(stmt):
+            compiler.compileProgram(
+                [stmt], local_scope[0]['names'])(interpreter, local_scope[0])
+    elif args.engine == 'tiered':
+        import tiers
+
+        tiered = tiers.TieredInterpreter(state=interpreter)
+
+        def execute(stmt):
+            tiered.execute(stmt, local_scope[0])
+
+        if args.tier_stats:
+            import atexit
+
+            atexit.register(tiered.report)
+    else:
+        execute = ExecuteCoal
+
+    version = PROGRAM_VERSION
+
+    if args.optimize:
+        import optimize
+
+        if args.inline_limit is None:
+            optimizer = optimize.Optimizer()
+            version += '-O'
+        else:
+            optimizer = optimize.Optimizer(args.inline_limit)
+            version += '-O{}'.format(args.inline_limit)
+
+        if args.optimize_report:
+            import atexit
 
-    sys.exit()
+            atexit.register(optimizer.report)
 
-test_file = open(sys.argv[1], 'r', encoding='utf-8')
-src = test_file.read()
-test_file.close()
+    def prepare(stmts):
+        if args.optimize:
+            return optimizer.optimize(stmts)
 
-# lexer = lexer.IndentLexer()
-lexer = lexer.lexer
-lexer.ast = []
+        return stmts
 
-if not DEBUGGING:
-    parser = yacc.yacc(optimize=True)
-else:
-    parser = yacc.yacc()
-    lexer.input(src)
+    if args.image is not None:
+        image.loadImage(args.image, local_scope[0], PROGRAM_VERSION)
 
-    while True:
-        tok = lexer.token()
+    for prelude in args.prelude:
+        for stmt in prepare(load(readFile(prelude), args.lazy,
+                                    array_lexer=args.array_lexer,
+                                    check_indent=args.check_indent)):
+            execute(stmt)
 
-        if not tok:
-            break
+    if args.save_image is not None:
+        image.saveImage(args.save_image, local_scope[0], PROGRAM_VERSION)
 
-        print(tok)
+        if args.file is None and args.serve is None:
+            sys.exit()
 
-parser.parse(src)
+    if args.serve is not None:
+        import daemon
 
+        # Preludes and images above are part of the state every script
+        # starts from.
+        daemon.serve(args.serve or None, args.lazy, engine=args.engine,
+                     optimizer=optimizer if args.optimize else None,
+                     array_lexer=args.array_lexer,
+                     check_indent=args.check_indent)
+        sys.exit()
 
-for stmt in lexer.ast:
-    ExecuteCoal(stmt)
+    if args.file is None:
+        import repl
+
+        repl.Repl(array_lexer=args.array_lexer).loop()
+        sys.exit()
+
+    if args.disassemble:
+        vm.disassemble(compiler.compileProgram(
+            prepare(load(readFile(args.file), args.lazy,
+                         array_lexer=args.array_lexer,
+                         check_indent=args.check_indent))))
+        sys.exit()
+
+    if args.python_source:
+        sys.stdout.write(transpile.source(
+            prepare(load(readFile(args.file), args.lazy,
+                         array_lexer=args.array_lexer,
+                         check_indent=args.check_indent))))
+        sys.exit()
+
+    src = readFile(args.file)
+
+    if args.stream:
+        def streamed(stmt):
+            for st in prepare([stmt]):
+                execute(st)
+
+        program = load(src, stream=streamed, array_lexer=args.array_lexer,
+                       check_indent=args.check_indent)
+    else:
+        program = prepare(load(src, args.lazy,
+                               array_lexer=args.array_lexer,
+                               check_indent=args.check_indent))
+
+    if args.engine == 'python' and not args.stream:
+        # The whole program at once, so its code can be cached
+        transpile.compileProgram(program, args.file, src,
+                                 version)(interpreter, local_scope[0])
+    elif args.engine == 'slots' and not args.stream:
+        # The whole program at once, so its names get slots
+        compiler.compileProgram(
+            program, local_scope[0]['names'])(interpreter, local_scope[0])
+    else:
+        for stmt in program:
+            execute(stmt)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Daemon (coal --serve) and its thin client
+ # version 0.1
+##
+
+# Imports
+# The client side only needs the standard library, so it starts quickly;
+# the interpreter itself is imported by serve().
+import os
+import io
+import sys
+import json
+import struct
+import socket
+
+# Frames sent back to the client: kind (1 byte), length, payload
+FRAME = struct.Struct('>cI')
+FRAME_STDOUT = b'o'
+FRAME_STDERR = b'e'
+FRAME_EXIT = b'x'
+
+# How many parsed programs the server keeps in memory
+PROGRAM_SLOTS = 128
+
+
+# Utils
+def socketPath():
+    '''
+    $COAL_SOCKET, or "serve.sock" in the cache directory.
+    '''
+
+    path = os.environ.get('COAL_SOCKET')
+
+    if path:
+        return path
+
+    base = os.environ.get('COAL_CACHE_DIR')
+
+    if not base:
+        xdg = os.environ.get('XDG_CACHE_HOME')
+
+        if not xdg:
+            xdg = os.path.join(os.path.expanduser('~'), '.cache')
+
+        base = os.path.join(xdg, 'coal')
+
+    return os.path.join(base, 'serve.sock')
+
+
+def sendFrame(conn, kind, payload=b''):
+    conn.sendall(FRAME.pack(kind, len(payload)) + payload)
+
+
+def recvExactly(conn, size):
+    data = b''
+
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+
+        if not chunk:
+            return None
+
+        data += chunk
+
+    return data
+
+
+class FrameWriter(io.RawIOBase):
+    '''
+    A writable stream that sends everything as frames of one kind.
+    '''
+
+    def __init__(self, conn, kind):
+        self.conn = conn
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        sendFrame(self.conn, self.kind, bytes(b))
+
+        return len(b)
+
+
+def frameStream(conn, kind):
+    return io.TextIOWrapper(io.BufferedWriter(FrameWriter(conn, kind)),
+                            encoding='utf-8',
+                            line_buffering=True)
+
+
+# Server
+class Server(object):
+    '''
+    Keeps the parser, the builtins and parsed programs warm, and runs each
+    request in a forked child so every script starts from a clean global
+    scope.
+
+    Programs are parsed and run like the command line does: `engine`,
+    `optimizer` (an optimize.Optimizer, for -O), `array_lexer` and
+    `check_indent` are its options.
+    '''
+
+    def __init__(self, path, lazy=False, engine='tree', optimizer=None,
+                 array_lexer=False, check_indent=False):
+        import collections
+        import coal
+
+        self.coal = coal
+        self.path = path
+        self.lazy = lazy
+        self.engine = engine
+        self.optimizer = optimizer
+        self.array_lexer = array_lexer
+        self.check_indent = check_indent
+        self.programs = collections.OrderedDict()
+
+        # Build (or load) the tables now rather than on the first request
+        coal.buildParser()
+
+    def program(self, src):
+        '''
+        Parse `src`, or reuse it if it was parsed before.
+        '''
+
+        program = self.programs.pop(src, None)
+
+        if program is None:
+            stmts = self.coal.load(src, self.lazy,
+                                   array_lexer=self.array_lexer,
+                                   check_indent=self.check_indent)
+
+            if self.optimizer is not None:
+                stmts = self.optimizer.optimize(stmts)
+
+            program = self.coal.Program(stmts, self.engine)
+
+            # Compiled here, so the children don't each compile it again
+            if self.engine not in ('tree', 'tiered'):
+                program.code(self.coal.local_scope[0]['names'])
+
+        self.programs[src] = program
+
+        while len(self.programs) > PROGRAM_SLOTS:
+            self.programs.popitem(last=False)
+
+        return program
+
+    def handle(self, conn):
+        import signal
+
+        request = b''
+
+        while not request.endswith(b'\n'):
+            chunk = conn.recv(65536)
+
+            if not chunk:
+                return
+
+            request += chunk
+
+        request = json.loads(request.decode('utf-8'))
+
+        if 'source' in request:
+            src = request['source']
+        else:
+            try:
+                with open(request['path'], 'r', encoding='utf-8') as f:
+                    src = f.read()
+            except OSError as e:
+                sendFrame(conn, FRAME_STDERR,
+                          'coal: can\'t open "{}": {}\n'
+                          .format(request['path'], e.strerror)
+                          .encode('utf-8'))
+                sendFrame(conn, FRAME_EXIT, b'2')
+                return
+
+        # Parse errors are reported to the client, not to the server log.
+        stdout = sys.stdout
+        sys.stdout = frameStream(conn, FRAME_STDOUT)
+
+        try:
+            program = self.program(src)
+        except SystemExit as e:
+            sys.stdout.flush()
+            sendFrame(conn, FRAME_EXIT, str(exitStatus(e.code)).encode())
+            return
+        finally:
+            sys.stdout = stdout
+
+        if os.fork() == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.run(conn, request, program)
+
+    def run(self, conn, request, program):
+        '''
+        Run a program in the forked child, then exit it.
+        '''
+
+        import traceback
+
+        status = 0
+        sys.stdout = frameStream(conn, FRAME_STDOUT)
+        sys.stderr = frameStream(conn, FRAME_STDERR)
+
+        try:
+            os.chdir(request.get('cwd', '/'))
+            sys.argv = [request.get('path', '-')] + request.get('argv', [])
+
+            program.execute(self.coal.interpreter, self.coal.local_scope[0])
+        except SystemExit as e:
+            status = exitStatus(e.code)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            sendFrame(conn, FRAME_EXIT, str(status).encode())
+        finally:
+            os._exit(0)
+
+    def serve(self):
+        import signal
+
+        # Children are never waited on
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        listener.listen(64)
+
+        print('Coal {} serving on {}'.format(self.coal.VERSION, self.path))
+        sys.stdout.flush()
+
+        try:
+            while True:
+                conn, _ = listener.accept()
+
+                try:
+                    self.handle(conn)
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    conn.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def exitStatus(code):
+    if code is None:
+        return 0
+    elif isinstance(code, int):
+        return code
+
+    return 1
+
+
+def serve(path=None, lazy=False, **options):
+    Server(path or socketPath(), lazy, **options).serve()
+
+
+def runSource(src, argv=(), path='-'):
+    '''
+    Run a script in this process and return its exit status.
+    '''
+
+    import coal
+
+    sys.argv = [path] + list(argv)
+
+    try:
+        for stmt in coal.load(src):
+            coal.ExecuteCoal(stmt)
+    except SystemExit as e:
+        return exitStatus(e.code)
+
+    return 0
+
+
+# Client
+def run(path=None, source=None, argv=(), sock=None):
+    '''
+    Run a script on the server, streaming its output to ours. Returns the
+    exit status, or None if no server is listening.
+    '''
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        conn.connect(sock or socketPath())
+    except OSError:
+        conn.close()
+        return None
+
+    request = {'cwd': os.getcwd(), 'argv': list(argv)}
+
+    if source is not None:
+        request['source'] = source
+    else:
+        request['path'] = os.path.abspath(path)
+
+    conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+    streams = {
+        FRAME_STDOUT: sys.stdout.buffer,
+        FRAME_STDERR: sys.stderr.buffer
+    }
+
+    try:
+        while True:
+            header = recvExactly(conn, FRAME.size)
+
+            if header is None:
+                return 1
+
+            kind, size = FRAME.unpack(header)
+            payload = recvExactly(conn, size) if size else b''
+
+            if payload is None:
+                return 1
+
+            if kind == FRAME_EXIT:
+                return int(payload)
+
+            streams[kind].write(payload)
+            streams[kind].flush()
+    finally:
+        conn.close()
+
+
+def main(argv):
+    if not argv:
+        print('Usage: daemon.py FILE [ARGS...]   (FILE may be "-" for stdin)')
+        return 2
+
+    if argv[0] == '-':
+        source = sys.stdin.read()
+        status = run(source=source, argv=argv[1:])
+
+        if status is None:
+            # No server, and stdin is used up: run the script right here.
+            return runSource(source, argv[1:])
+    else:
+        status = run(path=argv[0], argv=argv[1:])
+
+        if status is None:
+            # No server: run the script right here, with its arguments.
+            try:
+                with open(argv[0], 'r', encoding='utf-8') as f:
+                    source = f.read()
+            except OSError as e:
+                print('Can\'t read "{}": {}.'.format(argv[0], e.strerror))
+                return 1
+
+            return runSource(source, argv[1:], argv[0])
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
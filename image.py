@@ -0,0 +1,79 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Interpreter images
+ # version 0.1
+##
+
+# Imports
+import os
+import sys
+import pickle
+import tempfile
+
+IMAGE_MAGIC = b'COALIMG1\n'
+
+
+# Utils
+def throwError(message):
+    print('{}'.format(message))
+    sys.exit(1)
+
+
+def saveImage(path, scope, version):
+    '''
+    Snapshot an interpreter scope (types, methods and names) into `path`.
+    '''
+
+    state = {
+        'types': scope['types'],
+        'methods': scope['methods'],
+        'names': scope['names']
+    }
+
+    data = pickle.dumps((version, state), pickle.HIGHEST_PROTOCOL)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    # Write to a temporary file first, so a failed save keeps the old image.
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(IMAGE_MAGIC)
+            f.write(data)
+
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)
+        raise
+
+
+def loadImage(path, scope, version):
+    '''
+    Restore a snapshot taken by saveImage() into `scope`, in one load.
+    '''
+
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(IMAGE_MAGIC)) != IMAGE_MAGIC:
+                throwError('ImageError: "{}" is not a Coal image.'
+                           .format(path))
+
+            image_version, state = pickle.load(f)
+    except OSError as e:
+        throwError('ImageError: Can\'t read "{}": {}.'
+                   .format(path, e.strerror))
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+            ValueError, TypeError):
+        throwError('ImageError: "{}" is damaged; rebuild it.'.format(path))
+
+    if image_version != version:
+        throwError('ImageError: "{}" was saved by another interpreter'
+                   ' version ({}); rebuild it.'.format(path, image_version))
+
+    # Update in place: the interpreter holds on to the scope dict.
+    scope['types'] = state['types']
+    scope['methods'] = state['methods']
+    scope['names'] = state['names']
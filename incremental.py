@@ -0,0 +1,141 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Incremental parsing
+ # version 0.1
+##
+
+# Imports
+import lexer
+import coal
+
+# Tokens that open a block closed by "end"
+BLOCK_OPENERS = ('DEF', 'CLASS', 'INIT', 'IF', 'WHILE', 'FOR', 'EACH')
+
+# Top-level blocks that are cached on their own
+DEFINITIONS = ('DEF', 'CLASS')
+
+
+# Utils
+def regionTokens(arrays):
+    '''
+    Split TokenArrays into top-level regions.
+
+    Every top-level "def ... end" and "type ... end" block is a region of
+    its own; the statements between them are grouped into one region per
+    run. Returns a list of (first, stop, is_definition) token indexes.
+    '''
+
+    openers = frozenset(lexer.TOKEN_CODES[t] for t in BLOCK_OPENERS)
+    definitions = frozenset(lexer.TOKEN_CODES[t] for t in DEFINITIONS)
+    end_code = lexer.TOKEN_CODES['END']
+
+    regions = []
+    depth = 0
+    first = 0
+    in_definition = False
+
+    for i, code in enumerate(arrays.types):
+        if depth == 0 and code in definitions:
+            # Close the run of plain statements before this definition
+            if i > first:
+                regions.append((first, i, False))
+
+            first = i
+            in_definition = True
+
+        if code in openers:
+            depth += 1
+        elif code == end_code:
+            depth -= 1
+
+            if depth == 0 and in_definition:
+                regions.append((first, i + 1, True))
+                first = i + 1
+                in_definition = False
+
+    if len(arrays) > first:
+        regions.append((first, len(arrays), in_definition))
+
+    return regions
+
+
+def splitRegions(src, arrays=None):
+    '''
+    Split a source string into top-level regions (see regionTokens()).
+    Returns a list of (start, end) offsets into `src`.
+    '''
+
+    if arrays is None:
+        arrays = lexer.tokenize(src)
+
+    positions = arrays.positions
+    values = arrays.values
+    regions = []
+
+    for first, stop, is_definition in regionTokens(arrays):
+        if stop == len(arrays):
+            end = len(src)
+        elif is_definition:
+            # Up to the end of the closing "end"
+            end = positions[stop - 1] + len(values[stop - 1])
+        else:
+            end = positions[stop]
+
+        regions.append((positions[first], end))
+
+    return regions
+
+
+class IncrementalParser(object):
+    '''
+    Parses a source string region by region, reusing the statements of
+    every region whose text didn't change since the previous parse.
+    '''
+
+    def __init__(self, parser=None, array_lexer=False):
+        if parser is None:
+            parser = coal.buildParser()
+
+        self.parser = parser
+        self.array_lexer = array_lexer
+        self.regions = {}
+
+        # Stats for the last parse
+        self.reused = 0
+        self.reparsed = 0
+
+    def parse(self, src):
+        '''
+        Parse `src` into a flat list of statements, like coal.parse().
+        '''
+
+        program = []
+        regions = {}
+        self.reused = 0
+        self.reparsed = 0
+
+        for start, end in splitRegions(src):
+            text = src[start:end]
+
+            if text in self.regions:
+                stmts = self.regions[text]
+                self.reused += 1
+            elif text in regions:
+                stmts = regions[text]
+                self.reused += 1
+            else:
+                lineno = src.count('\n', 0, start) + 1
+                stmts = coal.parse(text, self.parser, lineno=lineno,
+                                   array_lexer=self.array_lexer)
+                self.reparsed += 1
+
+            regions[text] = stmts
+            program.extend(stmts)
+
+        # Only keep what the current source still uses
+        self.regions = regions
+
+        return program
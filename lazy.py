@@ -0,0 +1,144 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Lazy function bodies
+ # version 0.1
+##
+
+# Imports
+import sys
+
+import lexer
+import coal
+import incremental
+
+from ast import FuncDef, LazySuite
+
+NAMES = ('NAME', 'LETTER_NAME')
+
+
+# Utils
+def funcHeader(types, values, first, stop):
+    '''
+    Read a "def" header from token types/values, by hand:
+
+        def name -> Type
+        def name:(Type [alias]) other:(Type [alias]) ... -> Type
+
+    Returns (FuncDef arguments, index of the first body token), or None
+    if the tokens don't look like a header (the parser will complain).
+    '''
+
+    i = first + 1
+
+    def at(*expected):
+        return i < stop and types[i] in expected
+
+    # Simple form
+    if at(*NAMES) and i + 2 < stop and types[i + 1] == 'AS'\
+       and types[i + 2] == 'TYPE_NAME':
+        return ([values[i]], [], [], values[i + 2], True), i + 3
+
+    names = []
+    arg_types = []
+    aliases = []
+
+    while at(*NAMES):
+        if i + 3 >= stop or types[i + 1] != 'WITH'\
+           or types[i + 2] != 'LPAREN' or types[i + 3] != 'TYPE_NAME':
+            return None
+
+        names.append(values[i])
+        arg_types.append(values[i + 3])
+        i += 4
+
+        if at(*NAMES):
+            aliases.append(values[i])
+            i += 1
+        else:
+            aliases.append(None)
+
+        if not at('RPAREN'):
+            return None
+
+        i += 1
+
+    if not names or not at('AS') or i + 1 >= stop\
+       or types[i + 1] != 'TYPE_NAME':
+        return None
+
+    return (names, arg_types, aliases, values[i + 1], False), i + 2
+
+
+def parse(src, parser=None, array_lexer=False):
+    '''
+    Parse a source string like coal.parse(), but keep the bodies of
+    top-level functions as source until they are first called (and then
+    parsed with the same `array_lexer` choice).
+    '''
+
+    if parser is None:
+        parser = coal.buildParser()
+
+    arrays = lexer.tokenize(src)
+    types = [lexer.tokens[code] for code in arrays.types]
+    values = arrays.values
+    positions = arrays.positions
+
+    program = []
+    line_pos = 0
+    line = 1
+
+    def lineAt(pos):
+        nonlocal line_pos, line
+
+        line += src.count('\n', line_pos, pos)
+        line_pos = pos
+
+        return line
+
+    regions = incremental.regionTokens(arrays)
+    offsets = incremental.splitRegions(src, arrays)
+
+    for (first, stop, is_definition), (start, end) in zip(regions, offsets):
+        header = None
+
+        # Only closed "def" blocks with a non-empty body are kept lazy
+        if is_definition and types[first] == 'DEF'\
+           and types[stop - 1] == 'END':
+            header = funcHeader(types, values, first, stop - 1)
+
+        if header is not None and header[1] < stop - 1:
+            (names, arg_types, aliases, rtype, simple), body = header
+            body_start = positions[body]
+
+            program.append(FuncDef(
+                names,
+                arg_types,
+                aliases,
+                rtype,
+                LazySuite(src[body_start:positions[stop - 1]],
+                          lineAt(body_start),
+                          array_lexer),
+                simple
+            ))
+        else:
+            program.extend(coal.parse(src[start:end], parser,
+                                      lineno=lineAt(start),
+                                      array_lexer=array_lexer))
+
+    return program
+
+
+def report(out=sys.stderr):
+    '''
+    Print how many function bodies were parsed, out of the lazy ones.
+    '''
+
+    created = LazySuite.created
+    materialized = LazySuite.materialized
+
+    out.write('lazy: {} function bodies, {} parsed, {} never parsed\n'
+              .format(created, materialized, created - materialized))
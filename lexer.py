@@ -8,8 +8,15 @@
 ##
 
 # Imports
+import io
+import re
+import array
+import functools
+import contextlib
 import ply.lex as lex
 
+import cache
+
 # Reserved names
 reserved = {
     # Quit!
@@ -222,87 +229,310 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-lexer = lex.lex()
+# Build the lexer from the cached tables, if the token rules didn't change
+TABLE_HASH = cache.ruleHash(globals(), 't_', tokens, reserved)
+
+lexer = lex.lex(optimize=True,
+                lextab=cache.loadTable('lextab_' + TABLE_HASH),
+                outputdir=cache.cacheDir())
+
+# Compact token arrays (fast path)
+# Token type codes are indexes into `tokens`
+TOKEN_CODES = {name: code for code, name in enumerate(tokens)}
+
+# What to do with a match, besides storing it as-is
+_SKIP = -1
+_INT = -2
+_FLOAT = -3
+_STRING = -4
+_NAME = -5
+_ERROR = -6
+
+_NAME_CODES = {word: TOKEN_CODES[kind] for word, kind in reserved.items()}
+_NAME_CODES_DEFAULT = TOKEN_CODES['NAME']
+_INT_CODE = TOKEN_CODES['INT']
+_FLOAT_CODE = TOKEN_CODES['FLOAT']
+_STRING_CODE = TOKEN_CODES['STRING']
+
+
+def _masterPattern():
+    '''
+    Build one regex out of the t_* rules, in the same order PLY uses:
+    function rules as defined, then string rules by decreasing length.
+    Anything else falls through to a one-character error group.
+    '''
+
+    rules = globals()
+    funcs = []
+    strings = []
+
+    for name, rule in rules.items():
+        if not name.startswith('t_') or name in ('t_error', 't_ignore'):
+            continue
+
+        if callable(rule):
+            line = rule.__code__.co_firstlineno
+            funcs.append((line, name[2:], rule.__doc__))
+        else:
+            strings.append((name[2:], rule))
+
+    funcs.sort()
+    strings.sort(key=lambda rule: len(rule[1]), reverse=True)
+
+    ordered = [('ignore', '[{}]+'.format(re.escape(t_ignore)))]
+    ordered += [(name, regex) for _, name, regex in funcs]
+    ordered += strings
+    ordered += [('error', '.')]
+
+    actions = [None]
+    groups = []
+
+    for name, regex in ordered:
+        if name in ('ignore', 'comment', 'newline'):
+            action = _SKIP
+        elif name == 'INT':
+            action = _INT
+        elif name == 'FLOAT':
+            action = _FLOAT
+        elif name == 'STRING':
+            action = _STRING
+        elif name == 'NAME':
+            action = _NAME
+        elif name == 'error':
+            action = _ERROR
+        else:
+            action = TOKEN_CODES[name]
+
+        # Inner groups of a rule take an index too; pad them out.
+        groups.append('(?P<{}>{})'.format(name, regex))
+        actions.append(action)
+        actions.extend([None] * re.compile(regex, re.VERBOSE).groups)
+
+    return re.compile('|'.join(groups), re.VERBOSE | re.DOTALL), actions
+
+
+_PATTERN, _ACTIONS = _masterPattern()
+
+
+class TokenArrays(object):
+    '''
+    A tokenized source, as parallel arrays of type codes, values and
+    positions. Line numbers are computed on demand.
+    '''
+
+    __slots__ = ('src', 'types', 'values', 'positions')
+
+    def __init__(self, src):
+        self.src = src
+        self.types = array.array('B')
+        self.values = []
+        self.positions = array.array('l')
+
+    def __len__(self):
+        return len(self.types)
+
+    def lineno(self, pos):
+        return self.src.count('\n', 0, pos) + 1
+
+
+def tokenize(src):
+    '''
+    Tokenize a whole source string in a single pass, into TokenArrays.
+    '''
+
+    result = TokenArrays(src)
+    types = result.types.append
+    values = result.values.append
+    positions = result.positions.append
+
+    actions = _ACTIONS
+    name_code = _NAME_CODES.get
+    name_default = _NAME_CODES_DEFAULT
+
+    for m in _PATTERN.finditer(src):
+        action = actions[m.lastindex]
+
+        if action >= 0:
+            types(action)
+            values(m.group())
+        elif action == _SKIP:
+            continue
+        elif action == _NAME:
+            value = m.group()
+            types(name_code(value, name_default))
+            values(value)
+        elif action == _INT:
+            types(_INT_CODE)
+            values(int(m.group()))
+        elif action == _FLOAT:
+            types(_FLOAT_CODE)
+            values(float(m.group()))
+        elif action == _STRING:
+            types(_STRING_CODE)
+            values(bytes(m.group()[1:-1], 'utf-8').decode('unicode-escape'))
+        else:
+            print('Illegal character "{}".'.format(m.group()))
+            continue
+
+        positions(m.start())
+
+    return result
+
+
+class ArrayToken(object):
+    '''
+    A light-weight stand-in for LexToken, made from TokenArrays.
+    '''
+
+    __slots__ = ('type', 'value', 'lexpos', 'arrays', 'lexer')
+
+    @property
+    def lineno(self):
+        return self.arrays.lineno(self.lexpos)
+
+    def __repr__(self):
+        return 'LexToken({},{!r},{},{})'.format(self.type, self.value,
+                                                self.lineno, self.lexpos)
+
+
+def _arrayTokens(arrays):
+    names = tokens
+    new = ArrayToken.__new__
 
-# Indentation (WIP)
+    for code, value, pos in zip(arrays.types, arrays.values,
+                                arrays.positions):
+        tok = new(ArrayToken)
+        tok.type = names[code]
+        tok.value = value
+        tok.lexpos = pos
+        tok.arrays = arrays
+
+        yield tok
+
+
+class ArrayLexer(object):
+    '''
+    Feeds the parser from TokenArrays, as a drop-in for `lexer`.
+    '''
+
+    def __init__(self):
+        self.arrays = None
+        self.lineno = 1
+        self.token = lambda: None
+
+    def input(self, s):
+        self.arrays = tokenize(s)
+
+        # The parser grabs `token` once; `next` keeps it out of Python code.
+        self.token = functools.partial(next, _arrayTokens(self.arrays), None)
+
+
+# Indentation
 NO_INDENT = 0
 MAY_INDENT = 1
 MUST_INDENT = 2
 
+# Tokens after which the next line must open an indented block
+BLOCK_OPENERS = ('DO', 'ELSE')
+
+# Tokens that, right after "->", end a block header ("-> Int", "-> i")
+BLOCK_NAMES = ('TYPE_NAME', 'NAME', 'LETTER_NAME')
+
 
 def filtr(lexer):
-    token = None
+    '''
+    Chain the token filters. Every stage is a generator, so tokens are
+    handled one at a time and nothing is buffered.
+    '''
+
     tokens = iter(lexer.token, None)
     tokens = track_tokens_filter(lexer, tokens)
 
-    for token in indentation_filter(tokens):
-        yield token
+    return indentation_filter(tokens)
 
 
 class IndentLexer(object):
-    def __init__(self, debug=0, optimize=0, lextab='lextab', reflags=0):
-        self.lexer = lex.lex(debug=debug,
-                             optimize=optimize,
-                             lextab=lextab,
-                             reflags=reflags)
+    '''
+    Wraps a lexer (a clone of `lexer` by default) and adds INDENT and
+    DEDENT tokens around indented blocks.
+    '''
+
+    def __init__(self, base=None):
+        if base is None:
+            base = lexer.clone()
+
+        self.lexer = base
         self.token_stream = None
 
+    @property
+    def lineno(self):
+        return self.lexer.lineno
+
+    @lineno.setter
+    def lineno(self, value):
+        self.lexer.lineno = value
+
     def input(self, s):
         self.lexer.paren_count = 0
         self.lexer.input(s)
         self.token_stream = filtr(self.lexer)
 
     def token(self):
-        try:
-            return self.token_stream.__next__()
-        except StopIteration:
-            return None
+        return next(self.token_stream, None)
+
+
+def checkIndentation(src):
+    '''
+    Run `src` through IndentLexer, raising IndentationError where a block
+    isn't indented consistently. Blocks are closed by "end", so the INDENT
+    and DEDENT tokens are only checked, never handed to the parser.
+    '''
+
+    lex = IndentLexer()
+    lex.input(src)
+
+    # Illegal characters are reported once the source is parsed
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tok in iter(lex.token, None):
+            pass
 
 
 # only care about whitespace at the start of a line
 def track_tokens_filter(lexer, tokens):
-    lexer.at_line_start = at_line_start = True
+    '''
+    Mark each token with `at_line_start`, `must_indent` and, for the first
+    token of a line, its indentation `depth`.
+
+    The lexer drops newlines and spaces, so line starts are found from
+    token line numbers, and depths from the token position in the line.
+    '''
+
+    lexer.at_line_start = True
     indent = NO_INDENT
+    lineno = None
+    prev_type = None
 
-    # for token in tokens:
-    tokens = list(tokens)
-    print(tokens)
+    for token in tokens:
+        at_line_start = token.lineno != lineno
+        lineno = token.lineno
 
-    for i, token in enumerate(tokens):
         token.at_line_start = at_line_start
-        print(token, token.at_line_start)
-
-        if token.type == "AS":
-            if tokens[i+1].type == "NAME_TYPE"\
-               or tokens[i+1].type == "NAME":
-                at_line_start = False
-                indent = MUST_INDENT
-                token.must_indent = False
-        elif token.type == "DO":
-            at_line_start = False
-            indent = MUST_INDENT
-            token.must_indent = False
-        elif token.type == "NEWLINE":
-            at_line_start = True
 
-            if indent == MAY_INDENT:
-                indent = MUST_INDENT
+        if at_line_start:
+            line_start = lexer.lexdata.rfind('\n', 0, token.lexpos) + 1
+            token.depth = token.lexpos - line_start
 
-            token.must_indent = False
-        elif token.type == "SPACE":
-            assert token.at_line_start is True
+        # A block only has to be indented if it starts on a new line;
+        # "if a do [print: a] end" stays valid.
+        token.must_indent = indent == MUST_INDENT and at_line_start
+        indent = NO_INDENT
 
-            at_line_start = True
-            token.must_indent = False
-        else:
-            # A real token
-            if indent == MUST_INDENT:
-                token.must_indent = True
-            else:
-                token.must_indent = False
+        if token.type in BLOCK_OPENERS:
+            indent = MUST_INDENT
+        elif prev_type == 'AS' and token.type in BLOCK_NAMES:
+            indent = MUST_INDENT
 
-            at_line_start = False
-            indent = NO_INDENT
+        prev_type = token.type
 
         yield token
         lexer.at_line_start = at_line_start
@@ -313,6 +543,7 @@ def _new_token(type, lineno):
     tok.type = type
     tok.value = None
     tok.lineno = lineno
+    tok.lexpos = -1
 
     return tok
 
@@ -332,60 +563,34 @@ def indentation_filter(tokens):
     # A stack of indentation levels; will never pop item 0
     levels = [0]
     token = None
-    depth = 0
-    prev_was_SPACE = False
 
     for token in tokens:
-        # SPACE only occurs at the start of the line
-        # There may be SPACE followed by NEWLINE so
-        # only track the depth here.  Don't indent/dedent
-        # until there's something real.
-
-        if token.type == "SPACE":
-            assert depth == 0
-
-            depth = len(token.value)
-            prev_was_SPACE = True
-
-            # SPACE tokens are never passed to the parser
-            continue
-
-        if token.type == "NEWLINE":
-            depth = 0
-
-            if prev_was_SPACE or token.at_line_start:
-                # ignore blank lines
-                continue
-
-            # pass the other cases on through
-            yield token
-            continue
-
-        # then it must be a real token (not SPACE, not NEWLINE)
-        # which can affect the indentation levels
-
-        prev_was_SPACE = False
         if token.must_indent:
             # The current depth must be larger than the previous level
-            if not (depth > levels[-1]):
-                raise IndentationError("expected an indented block")
+            if not (token.depth > levels[-1]):
+                raise IndentationError("expected an indented block"
+                                       " (line {})".format(token.lineno))
 
-            levels.append(depth)
+            levels.append(token.depth)
             yield INDENT(token.lineno)
         elif token.at_line_start:
+            depth = token.depth
+
             # Must be on the same level or one of the previous levels
             if depth == levels[-1]:
                 # At the same level
                 pass
             elif depth > levels[-1]:
                 raise IndentationError("indentation increase but not in new"
-                                       " block")
+                                       " block (line {})"
+                                       .format(token.lineno))
             else:
                 # Back up; but only if it matches a previous level
                 try:
                     i = levels.index(depth)
                 except ValueError:
-                    raise IndentationError("inconsistent indentation")
+                    raise IndentationError("inconsistent indentation"
+                                           " (line {})".format(token.lineno))
 
                 for _ in range(i+1, len(levels)):
                     yield DEDENT(token.lineno)
@@ -0,0 +1,1360 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: AST optimizer (folding, dead code, inlining, invariants)
+ # version 0.1
+##
+
+# Imports
+import sys
+import copy
+import operator
+
+from ast import *
+
+
+# Utils
+def _compare(test):
+    return lambda a, b: 'true' if test(a, b) else 'false'
+
+
+# Expression classes, their symbol and what they do with their operands
+OPERATORS = {
+    ExprAddition: ('+', operator.add),
+    ExprSubtraction: ('-', operator.sub),
+    ExprMultiplication: ('*', operator.mul),
+    ExprDivision: ('/', operator.truediv),
+    ExprModulo: ('%', operator.mod),
+    ExprEqual: ('==', _compare(operator.eq)),
+    ExprNotEqual: ('!=', _compare(operator.ne)),
+    ExprGreater: ('>', _compare(operator.gt)),
+    ExprLess: ('<', _compare(operator.lt)),
+    ExprEqualGreater: ('>=', _compare(operator.ge)),
+    ExprEqualLess: ('<=', _compare(operator.le))
+}
+
+# Literal classes whose value is known without running anything
+CONSTANTS = {
+    Bool: CoalBool,
+    Int: CoalInt,
+    Float: CoalFloat,
+    String: CoalString
+}
+
+# Where a suite is: loops check "next" and "break" before each statement,
+# and only a "return" at the top of a function body returns.
+PROGRAM = 'program'
+BLOCK = 'block'
+LOOP = 'loop'
+FUNCTION = 'function'
+
+NOTHING = object()
+
+# Literal classes. Their values are pooled and shared between runs, so
+# unshared() and ownValue() copy them before anything changes them in place
+LITERALS = (Void, Bool, Int, Float, String)
+
+# Types whose objects hold nothing another name could share
+SCALAR_TYPES = ('Bool', 'Int', 'Float', 'String')
+
+# Nodes the hoister knows everything these do (the rest may call code)
+PLAIN_NODES = (
+    ObjectMethodCall, NameDef, NameDefEmpty, NameAssign, IterableItemAssign,
+    FuncDef, FuncRet, IfBlock, ForBlock, EachBlock, WhileBlock, FlowBreak,
+    FlowNext, Name, ItemFromIterable, List, Exit, CachedValue, ClearCache
+) + LITERALS + tuple(OPERATORS)
+
+# Statements that only run expressions, then bind or change something
+SIMPLE_STATEMENTS = (
+    LocalMethodCall, ObjectMethodCall, NameDef, NameDefEmpty, NameAssign,
+    IterableItemAssign, FuncRet
+)
+
+# What an expression must cost to be worth caching: one per operation,
+# two per method call
+WORTH = 2
+
+# How many nodes the body of a function inlined at its calls may have
+INLINE_LIMIT = 16
+
+# Literal classes and the type of what they make
+LITERAL_TYPES = {
+    Bool: 'Bool',
+    Int: 'Int',
+    Float: 'Float',
+    String: 'String',
+    List: 'List'
+}
+
+# Nodes an inlined function body may have (besides builtin calls)
+INLINE_NODES = (
+    ObjectMethodCall, NameDef, NameDefEmpty, NameAssign, IterableItemAssign,
+    FuncRet, IfBlock, ForBlock, EachBlock, WhileBlock, Name,
+    ItemFromIterable, Exit
+) + tuple(LITERAL_TYPES) + tuple(OPERATORS)
+
+# Nodes that bind or change the name they have
+NAMED_NODES = (
+    NameDef, NameDefEmpty, NameAssign, IterableItemAssign, ForBlock,
+    EachBlock
+)
+
+
+def constant(node):
+    '''
+    The value a literal has when it runs, or NOTHING.
+    '''
+
+    literal = CONSTANTS.get(type(node))
+
+    if literal is None:
+        return NOTHING
+
+    return literal(node.value).value
+
+
+def literalFor(result):
+    '''
+    The literal that makes what an expression made `result` makes.
+    '''
+
+    if type(result) == int:
+        return Int(result)
+    elif type(result) == float:
+        return Float(result)
+
+    return Bool(result)
+
+
+def text(node):
+    '''
+    An expression, written (about) like in Coal.
+    '''
+
+    node_type = type(node)
+
+    if node_type is Name:
+        return node.name
+    elif node_type is String:
+        return '"{}"'.format(node.value)
+    elif node_type in LITERALS:
+        return str(node.value)
+    elif node_type is CachedValue:
+        return text(node.value)
+    elif node_type in OPERATORS:
+        operands = [text(operand) if type(operand) not in OPERATORS
+                    else '({})'.format(text(operand))
+                    for operand in (node.a, node.b)]
+
+        return '{} {} {}'.format(operands[0], OPERATORS[node_type][0],
+                                 operands[1])
+    elif node_type is ItemFromIterable:
+        index = text(node.index)
+
+        if node.end is not None:
+            index += ', ' + text(node.end)
+
+        return '{}{{{}}}'.format(text(node.name), index)
+    elif node_type in (LocalMethodCall, ObjectMethodCall):
+        selectors = node.selectors.split(':')[:-1]
+
+        if node.selector_args:
+            call = ' '.join('{}: {}'.format(selector, text(arg))
+                            for selector, arg in zip(selectors,
+                                                     node.selector_args))
+        else:
+            call = selectors[0]
+
+        if node_type is ObjectMethodCall:
+            call = '{} {}'.format(text(node.object), call)
+
+        return '[{}]'.format(call)
+
+    return type(node).__name__
+
+
+def describe(node):
+    if type(node) is Bool:
+        # Like Coal prints it
+        return 'Bool({})'.format(node.value)
+    elif type(node) in CONSTANTS:
+        return repr(node.value)
+
+    return type(node).__name__
+
+
+class Optimizer(object):
+    '''
+    Folds expressions on literals into literals, and removes what can
+    never run: "if"/"elif" branches with constant tests and statements
+    after "return" (at the top of a function body) or "exit".
+
+    Then small functions are inlined (see Inliner) and pure expressions
+    cached (see Hoister).
+
+    Nodes are changed in place. `folded`, `removed`, `inlined`, `hoisted`
+    and `reused` describe what was done, for report().
+    '''
+
+    def __init__(self, inline_limit=INLINE_LIMIT):
+        self.inline_limit = inline_limit
+
+        self.folded = []
+        self.removed = []
+        self.inlined = []
+        self.hoisted = []
+        self.reused = []
+
+    def optimize(self, stmts):
+        stmts = self.suite(stmts, PROGRAM)
+
+        for node in nodesIn(stmts, bodies=True):
+            if type(node) is IfBlock and node.elif_blocks is not None:
+                # What is in them is replaced in place from here on
+                node.elif_blocks = [list(block) for block in node.elif_blocks]
+
+        stmts = Inliner(self).optimize(stmts)
+
+        return Hoister(self).optimize(stmts)
+
+    def suite(self, stmts, context):
+        result = []
+
+        for i, st in enumerate(stmts):
+            replaced = self.statement(st, context)
+
+            if not replaced and context == LOOP and i == len(stmts) - 1:
+                # The last statement is where a loop sees a "next" or a
+                # "break" from the one before, so something has to stay.
+                replaced = [IfBlock(Bool('false'), [])]
+
+            result.extend(replaced)
+
+            if isinstance(st, Exit):
+                ends = 'exit'
+            elif context == FUNCTION and isinstance(st, FuncRet):
+                ends = 'return'
+            else:
+                continue
+
+            if i < len(stmts) - 1:
+                self.removed.append('{} statement(s) after "{}"'
+                                    .format(len(stmts) - i - 1, ends))
+
+            break
+
+        return result
+
+    def statement(self, st, context):
+        '''
+        Optimize one statement; returns what replaces it (a list).
+        '''
+
+        if isinstance(st, IfBlock):
+            return self.ifBlock(st, context)
+        elif isinstance(st, (ForBlock, WhileBlock, EachBlock)):
+            if isinstance(st, ForBlock):
+                st.start = self.expression(st.start)
+                st.end = self.expression(st.end)
+
+                if st.interval is not None:
+                    st.interval = self.expression(st.interval)
+            elif isinstance(st, WhileBlock):
+                st.test = self.expression(st.test)
+            else:
+                st.iterable = self.expression(st.iterable)
+
+            st.suite = self.suite(st.suite, LOOP)
+        elif isinstance(st, FuncDef):
+            # Lazily kept bodies aren't parsed yet
+            if not isinstance(st.suite, LazySuite):
+                st.suite = self.suite(st.suite, FUNCTION)
+        elif isinstance(st, (NameDef, NameAssign, FuncRet, Exit)):
+            st.value = self.expression(st.value)
+        elif isinstance(st, IterableItemAssign):
+            st.index = self.expression(st.index)
+            st.value = self.expression(st.value)
+        else:
+            st = self.expression(st)
+
+        return [st]
+
+    def ifBlock(self, st, context):
+        branches = [(st.test, st.suite)]
+
+        if st.elif_blocks is not None:
+            branches.extend((block[0], block[1]) for block in st.elif_blocks)
+
+        kept = []
+        else_suite = st.else_suite
+
+        for i, (test, suite) in enumerate(branches):
+            test = self.expression(test)
+            suite = self.suite(suite, BLOCK)
+            value = constant(test)
+
+            if value is NOTHING:
+                kept.append((test, suite))
+                continue
+
+            if not value:
+                self.removed.append('branch "if {}"'.format(describe(test)))
+                continue
+
+            # Always taken: nothing after it can run
+            if else_suite is not None or i < len(branches) - 1:
+                self.removed.append('branches after "if {}"'
+                                    .format(describe(test)))
+
+            else_suite = suite
+            break
+        else:
+            if else_suite is not None:
+                else_suite = self.suite(else_suite, BLOCK)
+
+        if not kept:
+            return self.splice(else_suite or [], context)
+
+        block = IfBlock(kept[0][0], kept[0][1])
+
+        if len(kept) > 1:
+            block.elif_blocks = kept[1:]
+
+        block.else_suite = else_suite
+
+        return [block]
+
+    def splice(self, suite, context):
+        '''
+        Put the statements of a branch that is always taken in place of
+        its "if", where that doesn't change what they do.
+        '''
+
+        if context == LOOP and len(suite) > 1:
+            # There are no checks for "next" and "break" between them
+            return [IfBlock(Bool('true'), suite)]
+        elif context == FUNCTION and\
+             any(isinstance(st, FuncRet) for st in suite):
+            # These would become "return"s
+            return [IfBlock(Bool('true'), suite)]
+
+        return suite
+
+    def expression(self, node):
+        node_type = type(node)
+
+        if node_type in OPERATORS:
+            node.a = self.expression(node.a)
+            node.b = self.expression(node.b)
+
+            a = constant(node.a)
+            b = constant(node.b)
+
+            if a is NOTHING or b is NOTHING:
+                return node
+
+            symbol, fn = OPERATORS[node_type]
+
+            try:
+                folded = literalFor(fn(a, b))
+            except Exception:
+                # Division by zero and the like happen when it runs
+                return node
+
+            self.folded.append('{} {} {} -> {}'.format(describe(node.a),
+                                                       symbol,
+                                                       describe(node.b),
+                                                       describe(folded)))
+
+            return folded
+        elif node_type in (LocalMethodCall, ObjectMethodCall):
+            if node_type is ObjectMethodCall:
+                node.object = self.expression(node.object)
+
+            node.selector_args = [self.expression(arg)
+                                  for arg in node.selector_args]
+        elif node_type is ItemFromIterable:
+            node.name = self.expression(node.name)
+            node.index = self.expression(node.index)
+
+            if node.end is not None:
+                node.end = self.expression(node.end)
+        elif node_type is List:
+            node.value = [self.expression(item) for item in node.value]
+
+        return node
+
+    def report(self, out=sys.stderr):
+        '''
+        Print what was folded and removed.
+        '''
+
+        out.write('optimize: {} expression(s) folded, {} removal(s),'
+                  ' {} call(s) inlined, {} hoisted, {} reused\n'
+                  .format(len(self.folded), len(self.removed),
+                          len(self.inlined), len(self.hoisted),
+                          len(self.reused)))
+
+        for line in self.folded:
+            out.write('  folded {}\n'.format(line))
+
+        for line in self.removed:
+            out.write('  removed {}\n'.format(line))
+
+        for line in self.inlined:
+            out.write('  inlined {}\n'.format(line))
+
+        for line in self.hoisted:
+            out.write('  hoisted {}\n'.format(line))
+
+        for line in self.reused:
+            out.write('  reused {}\n'.format(line))
+
+
+# Invariants and common subexpressions
+def nodesIn(stmts, bodies=False):
+    '''
+    Every node that runs with a region of code; with `bodies`, those of
+    the functions and types it defines too (a body kept lazily is given
+    as its LazySuite).
+    '''
+
+    stack = [stmts]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+        elif isinstance(item, LazySuite):
+            yield item
+        elif isinstance(item, CoalAST):
+            yield item
+
+            if bodies or not isinstance(item, (FuncDef, TypeDef)):
+                stack.extend(reversed(list(vars(item).values())))
+
+
+def getSlot(holder, field):
+    if isinstance(holder, list):
+        return holder[field]
+
+    return getattr(holder, field)
+
+
+def setSlot(holder, field, value):
+    if isinstance(holder, list):
+        holder[field] = value
+    else:
+        setattr(holder, field, value)
+
+
+class Pure(object):
+    '''
+    What a pure expression is made of: `key` is the same for expressions
+    that are written the same, `names` are the names it reads, `heap` is
+    whether it reads lists and strings through items or methods, whose
+    (name, selectors) are in `methods`.
+    '''
+
+    def __init__(self, key, names=frozenset(), heap=False, cost=0,
+                 methods=()):
+        self.key = key
+        self.names = names
+        self.heap = heap
+        self.cost = cost
+        self.methods = methods
+
+
+class Effects(object):
+    '''
+    What a region of code may change: the names in `names`, the objects
+    lists and items hold if `heap`, and anything if not `safe`.
+    '''
+
+    def __init__(self):
+        self.names = set()
+        self.heap = False
+        self.safe = True
+
+    def keeps(self, pure):
+        '''
+        Whether the value of a pure expression stays the same.
+        '''
+
+        return not (pure.names & self.names or pure.heap and self.heap)
+
+
+class Hoister(object):
+    '''
+    Caches pure expressions (arithmetic, items and PURE_METHODS calls on
+    names) in CachedValues: loop-invariant ones for as long as their loop
+    runs, and ones that repeat in a row of statements for that row.
+
+    Values are kept from where they first run, so nothing runs earlier
+    than it did, and only where they are used up by what runs them (as
+    operands, indexes or tests): no name ever gets a cached object, which
+    a "+=" could change.
+    '''
+
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        self.pure_selectors = set().union(*PURE_METHODS.values())
+        self.builtins = CoalBuiltin()
+
+        # Filled by optimize()
+        self.shared = set()
+        self.scalars = set()
+        self.pures = {}
+
+    def optimize(self, stmts):
+        self.aliases(stmts)
+
+        return self.suite(stmts)
+
+    def aliases(self, stmts):
+        '''
+        Find the names whose objects other names or lists may hold too
+        (`shared`), and the ones that only ever hold Bools, Ints, Floats
+        or Strings of their own (`scalars`).
+        '''
+
+        bound = set()
+        shared = set()
+        scalars = set()
+        others = set()
+        used = set()
+
+        for node in nodesIn(stmts, bodies=True):
+            node_type = type(node)
+
+            if node_type is LazySuite or node_type not in PLAIN_NODES and\
+               node_type not in (LocalMethodCall, TypeDef, TypeCall):
+                # Code this can't see may share anything
+                self.shared = None
+                return
+            elif node_type is Name:
+                used.add(node.name)
+            elif node_type is NameDef:
+                bound.add(node.name)
+
+                if node.type in SCALAR_TYPES:
+                    scalars.add(node.name)
+                else:
+                    others.add(node.name)
+
+                if node.type not in self.builtins.types and\
+                   not self.fresh(node.value):
+                    shared.add(node.name)
+                    shared.update(self.namesOf([node.value]))
+            elif node_type is NameDefEmpty:
+                bound.add(node.name)
+                others.add(node.name)
+            elif node_type is NameAssign:
+                used.add(node.name)
+
+                if node.mode == '=' and not self.fresh(node.value):
+                    shared.add(node.name)
+                    shared.update(self.namesOf([node.value]))
+            elif node_type is ForBlock:
+                bound.add(node.name)
+                scalars.add(node.name)
+            elif node_type is EachBlock:
+                bound.add(node.name)
+                shared.add(node.name)
+                others.add(node.name)
+            elif node_type is FuncDef:
+                for name, alias in zip(node.selector_names,
+                                       node.selector_aliases):
+                    name = name if alias is None else alias
+
+                    bound.add(name)
+                    shared.add(name)
+                    others.add(name)
+            elif node_type in (LocalMethodCall, ObjectMethodCall, TypeCall):
+                if not self.consumes(node):
+                    # Arguments may be kept by what is called
+                    shared.update(self.namesOf(node.selector_args or []))
+            elif node_type is List:
+                shared.update(self.namesOf(node.value))
+            elif node_type in (IterableItemAssign, FuncRet):
+                shared.update(self.namesOf([node.value]))
+
+        # Names from preludes, images or the caller are anyone's
+        shared.update(used - bound)
+
+        self.shared = shared
+        self.scalars = scalars - others - shared
+
+    def namesOf(self, values):
+        return [value.name for value in values if type(value) is Name]
+
+    def fresh(self, node):
+        '''
+        Whether an expression makes an object nothing else holds.
+        '''
+
+        node_type = type(node)
+
+        return node_type in OPERATORS or node_type in LITERALS or\
+            node_type is List or node_type is TypeCall or\
+            node_type is LocalMethodCall and\
+            node.selectors in self.builtins.public
+
+    def consumes(self, node):
+        '''
+        Whether a call only uses the values of its object and arguments.
+        '''
+
+        if type(node) is LocalMethodCall:
+            return node.selectors in self.builtins.public
+        elif type(node) is ObjectMethodCall:
+            return node.selectors in self.pure_selectors
+
+        return False
+
+    def pure(self, node):
+        '''
+        The Pure of an expression, or None.
+        '''
+
+        if id(node) not in self.pures:
+            # Keeping the node keeps its id() from being reused
+            self.pures[id(node)] = (node, self.purity(node))
+
+        return self.pures[id(node)][1]
+
+    def purity(self, node):
+        node_type = type(node)
+
+        if node_type is Name:
+            return Pure(('Name', node.name), frozenset([node.name]))
+        elif node_type in LITERALS:
+            return Pure((node_type.__name__, node.value))
+        elif node_type is CachedValue:
+            pure = self.pure(node.value)
+
+            return Pure(('Cached', id(node)), pure.names, pure.heap, 0,
+                        pure.methods)
+        elif node_type in OPERATORS:
+            parts = [node.a, node.b]
+            cost = 1
+        elif node_type is ItemFromIterable:
+            parts = [node.name, node.index, node.end]
+            cost = 1
+        elif node_type is ObjectMethodCall and\
+             type(node.object) is Name and\
+             node.selectors in self.pure_selectors:
+            parts = [node.object] + list(node.selector_args)
+            cost = 2
+        else:
+            return None
+
+        pures = [self.pure(part) for part in parts if part is not None]
+
+        if None in pures:
+            return None
+
+        methods = sum((pure.methods for pure in pures), ())
+
+        if node_type is ObjectMethodCall:
+            methods += ((node.object.name, node.selectors),)
+            key = (node.selectors,)
+        else:
+            key = (node_type.__name__, node.end is not None)\
+                  if node_type is ItemFromIterable else (node_type.__name__,)
+
+        return Pure(key + tuple(pure.key for pure in pures),
+                    frozenset().union(*(pure.names for pure in pures)),
+                    node_type in (ItemFromIterable, ObjectMethodCall) or
+                    any(pure.heap for pure in pures),
+                    cost + sum(pure.cost for pure in pures),
+                    methods)
+
+    def effects(self, stmts):
+        '''
+        The Effects of a region of code.
+        '''
+
+        effects = Effects()
+
+        for node in nodesIn(stmts):
+            node_type = type(node)
+
+            if node_type is LocalMethodCall:
+                if node.selectors not in self.builtins.public:
+                    effects.safe = False
+            elif node_type not in PLAIN_NODES:
+                effects.safe = False
+            elif node_type in (NameDef, NameDefEmpty, EachBlock):
+                effects.names.add(node.name)
+            elif node_type is NameAssign and node.mode == '=':
+                effects.names.add(node.name)
+            elif node_type in (NameAssign, ForBlock):
+                # Loops change their Int in place too
+                self.changes(effects, node.name)
+            elif node_type is IterableItemAssign:
+                effects.heap = True
+            elif node_type is ObjectMethodCall and\
+                 node.selectors not in self.pure_selectors:
+                effects.heap = True
+
+        return effects
+
+    def changes(self, effects, name):
+        '''
+        Add to `effects` what changing the object of `name` may change.
+        '''
+
+        effects.names.add(name)
+
+        if self.shared is None:
+            effects.safe = False
+        elif name in self.shared:
+            effects.names.update(self.shared)
+            effects.heap = True
+        elif name not in self.scalars:
+            # Lists made from others share their items
+            effects.heap = True
+
+    def operands(self, node):
+        '''
+        Where an expression has expressions, as (holder, field, consumed):
+        `consumed` if only their values are used.
+        '''
+
+        node_type = type(node)
+
+        if node_type in OPERATORS:
+            return [(node, 'a', True), (node, 'b', True)]
+        elif node_type is ItemFromIterable:
+            slots = [(node, 'name', True), (node, 'index', True)]
+
+            if node.end is not None:
+                slots.append((node, 'end', True))
+
+            return slots
+        elif node_type in (LocalMethodCall, ObjectMethodCall):
+            consumed = self.consumes(node)
+            slots = [(node.selector_args, i, consumed)
+                     for i in range(len(node.selector_args))]
+
+            if node_type is ObjectMethodCall:
+                slots.insert(0, (node, 'object', consumed))
+
+            return slots
+        elif node_type is List:
+            return [(node.value, i, False) for i in range(len(node.value))]
+
+        return []
+
+    def statementSlots(self, stmts, i):
+        '''
+        Where a statement has expressions, leaving out its suites.
+        '''
+
+        st = stmts[i]
+        st_type = type(st)
+
+        if st_type in (NameDef, FuncRet):
+            return [(st, 'value', False)]
+        elif st_type is NameAssign:
+            return [(st, 'value', st.mode != '=')]
+        elif st_type is IterableItemAssign:
+            return [(st, 'index', True), (st, 'value', False)]
+        elif st_type is Exit:
+            return [(st, 'value', True)]
+        elif st_type is IfBlock:
+            return [(st, 'test', True)] +\
+                   [(block, 0, True) for block in st.elif_blocks or []]
+        elif st_type is ForBlock:
+            return [(st, field, True) for field in ('start', 'end', 'interval')
+                    if getattr(st, field) is not None]
+        elif st_type is EachBlock:
+            return [(st, 'iterable', False)]
+        elif st_type is WhileBlock:
+            return [(st, 'test', True)]
+        elif st_type in (LocalMethodCall, ObjectMethodCall):
+            return [(stmts, i, False)]
+
+        return []
+
+    def slots(self, stmts):
+        '''
+        Where the statements of a suite, and the suites in them, have
+        expressions.
+        '''
+
+        for i, st in enumerate(stmts):
+            for slot in self.statementSlots(stmts, i):
+                yield slot
+
+            for suite in self.suitesOf(st, functions=False):
+                for slot in self.slots(suite):
+                    yield slot
+
+    def suitesOf(self, st, functions=True):
+        st_type = type(st)
+
+        if st_type is IfBlock:
+            suites = [st.suite] + [block[1] for block in st.elif_blocks or []]
+
+            if st.else_suite is not None:
+                suites.append(st.else_suite)
+
+            return suites
+        elif st_type in (ForBlock, EachBlock, WhileBlock):
+            return [st.suite]
+        elif st_type is FuncDef and functions and\
+             not isinstance(st.suite, LazySuite):
+            return [st.suite]
+
+        return []
+
+    def suite(self, stmts):
+        '''
+        Hoist the invariants of the loops in a suite, then reuse what
+        repeats in it; returns the new suite.
+        '''
+
+        result = []
+
+        for st in stmts:
+            if type(st) in (ForBlock, EachBlock, WhileBlock):
+                values = self.loop(st)
+
+                if values:
+                    result.append(ClearCache(values))
+
+            result.append(st)
+
+            if type(st) is IfBlock:
+                st.suite = self.suite(st.suite)
+
+                for block in st.elif_blocks or []:
+                    block[1] = self.suite(block[1])
+
+                if st.else_suite is not None:
+                    st.else_suite = self.suite(st.else_suite)
+            elif self.suitesOf(st):
+                st.suite = self.suite(st.suite)
+
+        return self.rows(result)
+
+    def loop(self, st):
+        '''
+        Cache what doesn't change while a loop runs; returns the
+        CachedValues to clear before it does.
+        '''
+
+        if type(st) is WhileBlock:
+            effects = self.effects([st.test, st.suite])
+            slots = [(st, 'test', True)]
+        else:
+            effects = self.effects(st.suite)
+            slots = []
+
+            if type(st) is ForBlock:
+                self.changes(effects, st.name)
+            else:
+                effects.names.add(st.name)
+
+        if not effects.safe:
+            return []
+
+        cached = {}
+
+        for slot in slots + list(self.slots(st.suite)):
+            self.hoist(slot, effects, cached)
+
+        return list(cached.values())
+
+    def hoist(self, slot, effects, cached):
+        holder, field, consumed = slot
+        node = getSlot(holder, field)
+        pure = self.pure(node) if consumed else None
+
+        if pure is not None and pure.cost >= WORTH and effects.keeps(pure):
+            value = cached.get(pure.key)
+
+            if value is None:
+                value = cached[pure.key] = CachedValue(node, pure.methods)
+
+                self.optimizer.hoisted.append('{} out of a loop'
+                                              .format(text(node)))
+
+            setSlot(holder, field, value)
+            return
+
+        for operand in self.operands(node):
+            self.hoist(operand, effects, cached)
+
+    def repeats(self, slot):
+        '''
+        The (holder, field, Pure) of the expressions worth caching in and
+        under a slot.
+        '''
+
+        holder, field, consumed = slot
+        node = getSlot(holder, field)
+        pure = self.pure(node) if consumed else None
+
+        if pure is not None and pure.cost >= WORTH:
+            yield holder, field, pure
+
+        for operand in self.operands(node):
+            for repeat in self.repeats(operand):
+                yield repeat
+
+    def rows(self, stmts):
+        '''
+        Reuse expressions that repeat in rows of simple statements, until
+        a statement changes what they read.
+        '''
+
+        live = {}
+        groups = []
+
+        for i, st in enumerate(stmts):
+            effects = Effects()
+
+            if type(st) in SIMPLE_STATEMENTS:
+                effects = self.effects([st])
+
+                # A call in the middle could change what was read before it
+                if any(type(node) is ObjectMethodCall and
+                       not self.consumes(node) and node is not st
+                       for node in nodesIn([st])):
+                    effects.safe = False
+
+            if type(st) not in SIMPLE_STATEMENTS or not effects.safe:
+                groups.extend(live.values())
+                live = {}
+                continue
+
+            for slot in self.statementSlots(stmts, i):
+                for holder, field, pure in self.repeats(slot):
+                    live.setdefault(pure.key, (pure, []))[1].append(
+                        (i, holder, field))
+
+            for key, (pure, uses) in list(live.items()):
+                if not effects.keeps(pure):
+                    groups.append(live.pop(key))
+
+        groups.extend(live.values())
+
+        # The biggest first: what they contain runs with them
+        groups.sort(key=lambda group: -group[0].cost)
+        taken = set()
+        clear = {}
+
+        for pure, uses in groups:
+            uses = [use for use in uses
+                    if id(getSlot(use[1], use[2])) not in taken]
+
+            if len(uses) < 2:
+                continue
+
+            node = getSlot(uses[0][1], uses[0][2])
+            value = CachedValue(node, pure.methods)
+
+            for i, holder, field in uses:
+                taken.update(id(inner) for inner in
+                             nodesIn([getSlot(holder, field)]))
+                setSlot(holder, field, value)
+
+            clear.setdefault(uses[0][0], []).append(value)
+            self.optimizer.reused.append('{} ({} uses)'
+                                         .format(text(node), len(uses)))
+
+        result = []
+
+        for i, st in enumerate(stmts):
+            if i in clear:
+                result.append(ClearCache(clear[i]))
+
+            result.append(st)
+
+        return result
+
+
+# Inlining
+class Inliner(object):
+    '''
+    Puts the bodies of small functions in place of the calls to them.
+
+    Calls run their function in a scope of its own, after checking the
+    types of the arguments, and check the type of what it returns. So
+    only functions whose bodies read nothing but their parameters and
+    their own names (renamed to names Coal code can't have), don't call
+    user functions and have at most one "return", at their end, are
+    inlined; and only where the types of the arguments and of what is
+    returned are known without running anything.
+
+    A function is inlined where it is called first in a statement of the
+    program after its (only) definition: its body goes before that
+    statement, and what it returns in place of the call.
+    '''
+
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        self.builtins = CoalBuiltin()
+
+        # Serial numbers of the names given to parameters and locals
+        self.serial = 0
+
+        # Filled by optimize()
+        self.types = {}
+        self.exact = True
+        self.functions = {}
+
+    def optimize(self, stmts):
+        if self.optimizer.inline_limit <= 0:
+            return stmts
+
+        self.typing(stmts)
+
+        definitions = {}
+
+        for node in nodesIn(stmts, bodies=True):
+            if type(node) is FuncDef:
+                definitions.setdefault(node.selectors, []).append(node)
+
+        result = []
+
+        for st in stmts:
+            result.extend(self.statement(st, PROGRAM))
+
+            if type(st) is FuncDef and len(definitions[st.selectors]) == 1:
+                defined = self.inlinable(st)
+
+                if defined is not None:
+                    # Calls after this can't get another function
+                    self.functions[st.selectors] = (st, defined)
+
+        return result
+
+    def typing(self, stmts):
+        '''
+        Find the builtin type each name of a program always has, and
+        whether its Ints always hold ints (a "/=" makes floats).
+        '''
+
+        types = {}
+
+        for node in nodesIn(stmts, bodies=True):
+            node_type = type(node)
+
+            if node_type is LazySuite or\
+               node_type is NameAssign and node.mode == '/=':
+                self.exact = False
+            elif node_type is NameDef:
+                types.setdefault(node.name, set()).add(
+                    node.type if node.type in LITERAL_TYPES.values() else None)
+            elif node_type is ForBlock:
+                types.setdefault(node.name, set()).add('Int')
+            elif node_type in (NameDefEmpty, EachBlock):
+                types.setdefault(node.name, set()).add(None)
+            elif node_type is FuncDef:
+                for name, alias in zip(node.selector_names,
+                                       node.selector_aliases):
+                    types.setdefault(name if alias is None else alias,
+                                     set()).add(None)
+
+        self.types = {name: kinds.pop() for name, kinds in types.items()
+                      if len(kinds) == 1 and None not in kinds}
+
+    def typeOf(self, node, types):
+        '''
+        The type of what an expression makes, or None if it isn't known.
+        '''
+
+        node_type = type(node)
+
+        if node_type in LITERAL_TYPES:
+            return LITERAL_TYPES[node_type]
+        elif node_type is Name:
+            return types.get(node.name)
+        elif node_type in OPERATORS:
+            if node_type in (ExprEqual, ExprNotEqual, ExprGreater, ExprLess,
+                             ExprEqualGreater, ExprEqualLess):
+                return 'Bool'
+
+            operands = (self.typeOf(node.a, types),
+                        self.typeOf(node.b, types))
+
+            if any(operand not in ('Int', 'Float') for operand in operands):
+                return None
+            elif node_type is ExprDivision or 'Float' in operands:
+                return 'Float'
+            elif self.exact:
+                return 'Int'
+        elif node_type is LocalMethodCall:
+            return {'chr:': 'String', 'ord:': 'Int'}.get(node.selectors)
+        elif node_type is ObjectMethodCall and node.selectors == 'length:':
+            return 'Int'
+
+        return None
+
+    def isUserCall(self, node):
+        return type(node) is LocalMethodCall and\
+               node.selectors not in self.builtins.public
+
+    def parameters(self, fd):
+        return [name if alias is None else alias
+                for name, alias in zip(fd.selector_names,
+                                       fd.selector_aliases)]
+
+    def inlinable(self, fd):
+        '''
+        The names a function defines if calls to it can be inlined (when
+        their arguments have the right types), or None.
+        '''
+
+        if isinstance(fd.suite, LazySuite):
+            return None
+
+        nodes = list(nodesIn(fd.suite))
+
+        if len(nodes) > self.optimizer.inline_limit:
+            return None
+
+        types = dict(zip(self.parameters(fd), fd.selector_types))
+        defined = set()
+
+        for node in nodes:
+            node_type = type(node)
+
+            if node_type is LocalMethodCall:
+                if self.isUserCall(node):
+                    return None
+            elif node_type not in INLINE_NODES:
+                return None
+            elif node_type is NameDef:
+                if node.type not in LITERAL_TYPES.values():
+                    return None
+
+                defined.add(node.name)
+
+                if types.get(node.name, node.type) != node.type:
+                    # Not always the same type
+                    types[node.name] = None
+                else:
+                    types[node.name] = node.type
+            elif node_type is ForBlock:
+                defined.add(node.name)
+                types[node.name] = 'Int'
+            elif node_type in (NameDefEmpty, EachBlock):
+                defined.add(node.name)
+                types[node.name] = None
+
+        known = set(self.parameters(fd)) | defined
+
+        for node in nodes:
+            if type(node) in NAMED_NODES + (Name,) and\
+               node.name not in known:
+                # From the scope of the caller, which the function can't see
+                return None
+
+        returns = [i for i, st in enumerate(fd.suite) if type(st) is FuncRet]
+
+        if returns:
+            if returns != [len(fd.suite) - 1] or\
+               self.typeOf(fd.suite[-1].value, types) != fd.return_type:
+                return None
+
+        return defined
+
+    def statement(self, st, context):
+        '''
+        Inline in one statement, and in the suites in it; returns what
+        replaces it (a list).
+        '''
+
+        if type(st) is IfBlock:
+            st.suite = self.suite(st.suite, BLOCK)
+
+            for block in st.elif_blocks or []:
+                block[1] = self.suite(block[1], BLOCK)
+
+            if st.else_suite is not None:
+                st.else_suite = self.suite(st.else_suite, BLOCK)
+        elif type(st) in (ForBlock, EachBlock, WhileBlock):
+            st.suite = self.suite(st.suite, LOOP)
+
+        stmts = [st]
+
+        for holder, field in self.leading(stmts, 0):
+            call = getSlot(holder, field)
+
+            if not self.isUserCall(call):
+                continue
+
+            function = self.functions.get(call.selectors)
+
+            if function is not None and\
+               not any(self.isUserCall(node)
+                       for node in nodesIn(call.selector_args)):
+                return self.inline(stmts, holder, field, function, context)
+
+        return stmts
+
+    def suite(self, stmts, context):
+        result = []
+
+        for st in stmts:
+            result.extend(self.statement(st, context))
+
+        return result
+
+    def leading(self, stmts, i):
+        '''
+        The slots of what runs first in a statement, outermost first.
+        '''
+
+        st = stmts[i]
+        st_type = type(st)
+
+        if st_type in (NameDef, NameAssign, FuncRet, Exit):
+            holder, field = st, 'value'
+        elif st_type is IterableItemAssign:
+            holder, field = st, 'index'
+        elif st_type is IfBlock:
+            holder, field = st, 'test'
+        elif st_type in (LocalMethodCall, ObjectMethodCall, ItemFromIterable)\
+             or st_type in OPERATORS:
+            holder, field = stmts, i
+        else:
+            return
+
+        while True:
+            yield holder, field
+
+            node = getSlot(holder, field)
+            node_type = type(node)
+
+            if node_type in OPERATORS:
+                holder, field = node, 'a'
+            elif node_type is ItemFromIterable:
+                holder, field = node, 'name'
+            elif node_type is ObjectMethodCall:
+                holder, field = node, 'object'
+            elif node_type is LocalMethodCall and node.selector_args:
+                holder, field = node.selector_args, 0
+            else:
+                return
+
+    def operands(self, name, body):
+        '''
+        The slots where a name is used up by what runs it (as an operand
+        or an index) in a function body.
+        '''
+
+        slots = []
+
+        for node in nodesIn(body):
+            if type(node) in OPERATORS:
+                fields = ('a', 'b')
+            elif type(node) is ItemFromIterable:
+                fields = ('index', 'end')
+            else:
+                continue
+
+            slots.extend((node, field) for field in fields
+                         if type(getattr(node, field)) is Name
+                         and getattr(node, field).name == name)
+
+        return slots
+
+    def usedUp(self, name, body):
+        uses = [node for node in nodesIn(body)
+                if type(node) is Name and node.name == name]
+
+        return len(uses) == len(self.operands(name, body))
+
+    def name(self, name):
+        self.serial += 1
+
+        return '{}.{}'.format(name, self.serial)
+
+    def inline(self, stmts, holder, field, function, context):
+        fd, defined = function
+        call = getSlot(holder, field)
+        body = copy.deepcopy(fd.suite)
+        names = {}
+        result = []
+
+        for name, name_type, arg in zip(self.parameters(fd),
+                                        fd.selector_types,
+                                        call.selector_args):
+            if self.typeOf(arg, self.types) != name_type:
+                return stmts
+
+            read_only = name not in defined and\
+                not any(type(node) in NAMED_NODES and node.name == name
+                        for node in nodesIn(body))
+
+            if read_only and type(arg) is Name:
+                # The argument can be read instead
+                names[name] = arg.name
+                continue
+            elif read_only and type(arg) in LITERAL_TYPES and\
+                 type(arg) is not List and self.usedUp(name, body):
+                # A new object for each use is as good as one for all
+                for operand in self.operands(name, body):
+                    setSlot(operand[0], operand[1], copy.copy(arg))
+
+                continue
+
+            names[name] = self.name(name)
+
+            if type(arg) in LITERAL_TYPES or type(arg) in OPERATORS:
+                # A copy of a new object is as good as the object
+                result.append(NameDef(names[name], name_type, arg))
+            else:
+                result.append(NameDefEmpty(names[name], 'Any'))
+                result.append(NameAssign(names[name], '=', arg))
+
+        for name in defined - set(names):
+            names[name] = self.name(name)
+
+        for node in nodesIn(body):
+            if type(node) in NAMED_NODES + (Name,):
+                node.name = names[node.name]
+
+        if body and type(body[-1]) is FuncRet:
+            setSlot(holder, field, body.pop().value)
+        elif holder is stmts:
+            # Nothing is returned, to a statement that drops it
+            stmts = []
+        else:
+            return [stmts[0]]
+
+        result.extend(body)
+
+        self.optimizer.inlined.append('{} ({} statement(s))'
+                                      .format(text(call), len(result)))
+
+        result.extend(stmts)
+
+        if not result and context == LOOP:
+            # See Optimizer.suite()
+            result = [IfBlock(Bool('false'), [])]
+
+        return result
+
+
+def optimize(stmts, out=None):
+    '''
+    Optimize a program, reporting to `out` if given.
+    '''
+
+    optimizer = Optimizer()
+    stmts = optimizer.optimize(stmts)
+
+    if out is not None:
+        optimizer.report(out)
+
+    return stmts
@@ -0,0 +1,201 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Interactive REPL
+ # version 0.1
+##
+
+# Imports
+import io
+import sys
+import time
+import contextlib
+
+import lexer
+import coal
+import incremental
+
+from stdlib import setOutput
+from ast import CoalExit
+
+PROMPT = '>>> '
+CONTINUE = '... '
+
+
+# Utils
+def blockDepth(src):
+    '''
+    How many blocks are still open at the end of `src`.
+    '''
+
+    openers = frozenset(lexer.TOKEN_CODES[t]
+                        for t in incremental.BLOCK_OPENERS)
+    end_code = lexer.TOKEN_CODES['END']
+
+    # Illegal characters are reported once the input is parsed
+    with contextlib.redirect_stdout(io.StringIO()):
+        codes = lexer.tokenize(src).types
+
+    depth = 0
+
+    for code in codes:
+        if code in openers:
+            depth += 1
+        elif code == end_code:
+            depth -= 1
+
+    return depth
+
+
+class Repl(object):
+    '''
+    Reads statements (or whole blocks) and runs them right away, with one
+    parser and one interpreter kept warm for the whole session.
+    '''
+
+    def __init__(self, interpreter=None, parser=None, array_lexer=False):
+        if interpreter is None:
+            interpreter = coal.interpreter
+
+        if parser is None:
+            parser = coal.buildParser()
+
+        self.interpreter = interpreter
+        self.parser = parser
+        self.array_lexer = array_lexer
+        self.lineno = 1
+        self.timing = False
+
+    def compile(self, src):
+        '''
+        Parse one input. A lone value (which isn't a statement) is parsed
+        as "[print: value]", so names can be inspected by just typing
+        them. Returns None, after printing the error, on a syntax error.
+        '''
+
+        lineno = self.lineno
+        self.lineno += src.count('\n')
+        errors = io.StringIO()
+
+        try:
+            with contextlib.redirect_stdout(errors):
+                return coal.parse(src, self.parser, lineno=lineno,
+                                  array_lexer=self.array_lexer)
+        except SystemExit:
+            pass
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return coal.parse('[print: {}]\n'.format(src.strip()),
+                                  self.parser, lineno=lineno,
+                                  array_lexer=self.array_lexer)
+        except SystemExit:
+            sys.stdout.write(errors.getvalue())
+
+        return None
+
+    def feed(self, src):
+        '''
+        Parse and run one complete input.
+        '''
+
+        start = time.perf_counter()
+        stmts = self.compile(src)
+
+        if stmts is not None:
+            self.run(stmts)
+
+        if self.timing:
+            print('({:.3f} ms)'.format((time.perf_counter() - start) * 1e3))
+
+    def run(self, stmts):
+        '''
+        Run the statements of one input. "exit" ends the session, wherever
+        it runs; an error only ends the input, and leaves the functions
+        and loops it happened in, so the next input starts at the top
+        level again.
+        '''
+
+        it = self.interpreter
+        g = it.g
+        state = (it.current_scope, g.scope_depth, g.self_, g.flow,
+                 g.flow_next, g.flow_break)
+        previous = setOutput(it.stdout)
+
+        try:
+            for stmt in stmts:
+                it.execute(stmt)
+        except CoalExit:
+            raise
+        except SystemExit:
+            (it.current_scope, g.scope_depth, g.self_, g.flow,
+             g.flow_next, g.flow_break) = state
+        finally:
+            setOutput(previous)
+
+    def command(self, line):
+        '''
+        Run a REPL command (":help", ":names", ":time" or ":quit").
+        '''
+
+        name = line.strip()[1:]
+
+        if name in ('q', 'quit'):
+            sys.exit()
+        elif name == 'names':
+            scope = self.interpreter.local_scope[
+                self.interpreter.current_scope]
+
+            for key in sorted(scope['names']):
+                print('{} = {}'.format(key,
+                                       scope['names'][key].repr('String')
+                                                          .value))
+
+            for key in sorted(scope['methods']):
+                print('def {}'.format(key))
+        elif name == 'time':
+            self.timing = not self.timing
+            print('Timing is {}.'.format('on' if self.timing else 'off'))
+        else:
+            print(':names  list the defined names and functions')
+            print(':time   toggle showing how long each input took')
+            print(':quit   leave (or Ctrl-D)')
+
+    def loop(self):
+        try:
+            # Line editing and history, where available
+            import readline
+        except ImportError:
+            pass
+
+        print('Coal {} (:help for help, Ctrl-D to quit)'.format(coal.VERSION))
+
+        lines = []
+
+        while True:
+            try:
+                line = input(CONTINUE if lines else PROMPT)
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                print()
+                lines = []
+                continue
+
+            if not lines and line.strip().startswith(':'):
+                self.command(line)
+                continue
+
+            lines.append(line)
+            src = '\n'.join(lines) + '\n'
+
+            if blockDepth(src) > 0:
+                continue
+
+            lines = []
+
+            if src.strip():
+                self.feed(src)
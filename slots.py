@@ -0,0 +1,763 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Slot resolver
+ # version 0.1
+##
+
+# Imports
+import operator
+import threading
+
+import closures
+
+from ast import *
+
+# Nodes the tree walker runs for a frame of slots: they never read or bind
+# names, so the scope is all they need
+NAME_FREE = (TypeDef, NameFromSelf, ClearCache)
+
+# What statements run with slots give back: nothing reads it, so they
+# share one object (the closures of expressions still make their Voids)
+NOTHING = CoalVoid()
+NOTHING.shared = True
+
+# Python operators for the assignment modes that change a value in place
+IN_PLACE = {
+    '+=': operator.add,
+    '-=': operator.sub,
+    '*=': operator.mul,
+    '/=': operator.truediv
+}
+
+
+class Frame(object):
+    '''
+    The names of a program, or of a function together with the functions
+    it defines (called from it, they run with its scope), each given a
+    slot. Slot 0 of a running frame holds its scope.
+    '''
+
+    def __init__(self):
+        self.slots = {}
+        self.order = []
+
+        # Names something binds, and names read or assigned
+        self.bound = set()
+        self.used = []
+
+        # Parameter slots, by id() of the body of each function run in the
+        # frame (the bodies are kept, so their id()s aren't reused)
+        self.params = {}
+        self.bodies = []
+
+        # Whether everything in the frame can run with slots
+        self.resolved = True
+
+    def slot(self, name):
+        if name not in self.slots:
+            self.order.append(name)
+            self.slots[name] = len(self.order)
+
+        return self.slots[name]
+
+    def bind(self, name):
+        self.bound.add(name)
+
+        return self.slot(name)
+
+    def use(self, name):
+        if name not in self.used:
+            self.used.append(name)
+
+        return self.slot(name)
+
+    def enter(self, scope):
+        '''
+        A running frame, with the names `scope` already has.
+        '''
+
+        names = scope['names']
+
+        if not names:
+            return [scope] + [None] * len(self.order)
+
+        return [scope] + [names.get(name) for name in self.order]
+
+    def leave(self, frame, names):
+        '''
+        Copy a running frame's names back into `names`.
+        '''
+
+        for name, slot in self.slots.items():
+            if frame[slot] is None:
+                names.pop(name, None)
+            else:
+                names[name] = frame[slot]
+
+
+class Resolver(object):
+    '''
+    Gives the names of a program and of its functions their slots, and
+    reports the names that can't be known.
+    '''
+
+    def __init__(self, handled):
+        # Node types with a compiler that uses slots
+        self.handled = set(handled)
+
+        # Frame of each function body, by its id()
+        self.frames = {}
+
+    def program(self, stmts, known=()):
+        '''
+        The frame of top-level statements, run with the names `known`
+        (and those of the builtins) already defined.
+        '''
+
+        frame = Frame()
+
+        for name in known:
+            frame.bind(name)
+
+        self.walk(frame, stmts, True)
+        self.check(frame)
+
+        return frame
+
+    def function(self, suite, params):
+        '''
+        The frame of a function called from top-level code.
+        '''
+
+        frame = self.frames.get(id(suite))
+
+        if frame is not None and frame.bodies[0] is suite:
+            return frame
+
+        frame = Frame()
+        self.body(frame, suite, params)
+        self.walk(frame, list(suite), False)
+        self.check(frame)
+
+        return frame
+
+    def body(self, frame, suite, params):
+        frame.params[id(suite)] = [frame.bind(name) for name in params]
+        frame.bodies.append(suite)
+        self.frames[id(suite)] = frame
+
+    def walk(self, frame, stmts, top):
+        stack = [stmts]
+
+        while stack:
+            item = stack.pop()
+
+            if isinstance(item, (list, tuple)):
+                stack.extend(reversed(item))
+                continue
+            elif not isinstance(item, CoalAST) or isinstance(item, NAME_FREE):
+                continue
+            elif type(item) not in self.handled:
+                # Anything could happen to the names
+                frame.resolved = False
+                continue
+
+            if isinstance(item, FuncDef):
+                params = [alias if alias is not None else name
+                          for name, alias in zip(item.selector_names,
+                                                 item.selector_aliases)]
+
+                if top:
+                    # A body kept lazily is resolved when it is first called
+                    if not isinstance(item.suite, LazySuite):
+                        self.function(item.suite, params)
+                else:
+                    self.body(frame, item.suite, params)
+                    stack.append(list(item.suite))
+
+                continue
+            elif isinstance(item, (Name, NameAssign, IterableItemAssign)):
+                frame.use(item.name)
+            elif isinstance(item, (NameDef, NameDefEmpty, ForBlock,
+                                   EachBlock)):
+                frame.bind(item.name)
+            elif isinstance(item, CachedValue):
+                for name, selectors in item.methods:
+                    frame.slot(name)
+
+            stack.extend(reversed(list(vars(item).values())))
+
+    def check(self, frame):
+        '''
+        Report a name nothing in a frame can define.
+        '''
+
+        if not frame.resolved:
+            return
+
+        for name in frame.used:
+            if name not in frame.bound and name not in CoalBuiltin.names:
+                throwError(0, 0,
+                           'NameError: Unknown name "{}"'.format(name))
+
+
+class Compiler(closures.Compiler):
+    '''
+    Compiles statements like closures.Compiler, for frames whose names are
+    all resolved to slots: the closures are called as fn(interpreter,
+    frame), and names are read and bound by index. Frames that can't be
+    resolved (and functions they call) run as closures.Compiler's.
+
+    Names that nothing in a frame defines are reported before it runs.
+    '''
+
+    def __init__(self):
+        super(Compiler, self).__init__()
+
+        self.compilers.update({
+            LocalMethodCall: self._compileLocalMethodCall,
+            NameDef: self._compileNameDef,
+            NameDefEmpty: self._compileNameDefEmpty,
+            NameAssign: self._compileNameAssign,
+            IterableItemAssign: self._compileIterableItemAssign,
+            FuncDef: self._compileFuncDef,
+            ForBlock: self._compileForBlock,
+            EachBlock: self._compileEachBlock,
+            Name: self._compileName,
+            CachedValue: self._compileCachedValue
+        })
+
+        for node_type in closures.OPERATORS:
+            self.compilers[node_type] = self._compileExpr
+
+        self.resolver = Resolver(self.compilers)
+        self.plain = closures.Compiler()
+
+        # The frame being compiled; compiling is locked, since Programs
+        # may run (and compile function bodies) in several threads
+        self.frame = None
+        self.lock = threading.RLock()
+
+    def compile(self, node):
+        compiler = self.compilers.get(type(node))
+
+        if compiler is None:
+            return lambda it, frame: it.execute(node, frame[0])
+
+        return compiler(node)
+
+    def operand(self, node):
+        '''
+        How a closure can read `node` without calling another one: as
+        (slot, None) for a name, as (0, pooled object) for a literal, or
+        not at all, as (0, None).
+        '''
+
+        if type(node) is Name:
+            return self.frame.slots[node.name], None
+        elif isinstance(node, Constant):
+            return 0, node.constant
+
+        return 0, None
+
+    def compileProgram(self, stmts, known=()):
+        '''
+        Top-level statements as one fn(interpreter, scope). Their names
+        live in slots while they run, and are copied back into the scope
+        at the end.
+        '''
+
+        with self.lock:
+            frame = self.resolver.program(stmts, known)
+
+            if not frame.resolved:
+                suite = self.plain.compileSuite(stmts)
+
+                def run(it, scope):
+                    for st in suite:
+                        st(it, scope)
+
+                    return CoalVoid()
+
+                return run
+
+            previous = self.frame
+            self.frame = frame
+
+            try:
+                suite = self.compileSuite(stmts)
+            finally:
+                self.frame = previous
+
+        def run(it, scope):
+            running = frame.enter(scope)
+
+            try:
+                for st in suite:
+                    st(it, running)
+            finally:
+                frame.leave(running, scope['names'])
+
+            return CoalVoid()
+
+        return run
+
+    def functionBody(self, suite):
+        entry = self.suites.get(id(suite))
+
+        if entry is not None and entry[0] is suite:
+            return entry[1]
+
+        with self.lock:
+            previous = self.frame
+            self.frame = self.resolver.frames[id(suite)]
+
+            try:
+                return super(Compiler, self).functionBody(suite)
+            finally:
+                self.frame = previous
+
+    def frameOf(self, fn):
+        '''
+        The frame a function called from top-level code runs in, or None
+        if it has to run with a scope of names.
+        '''
+
+        frame = self.resolver.frames.get(id(fn.suite))
+
+        if frame is None or frame.bodies[0] is not fn.suite:
+            with self.lock:
+                frame = self.resolver.function(fn.suite, fn.parameters())
+
+        return frame if frame.resolved else None
+
+    def callWithScope(self, it, fn, args):
+        '''
+        Call a function whose frame isn't resolved from top-level code: it
+        runs as closures.Compiler's, with a scope of names.
+        '''
+
+        g = it.g
+        g.scope_depth += 1
+
+        suite, scope, rtype = fn(it.newScope(), args)
+
+        for st, is_return in self.plain.functionBody(suite):
+            result = st(it, scope)
+
+            if is_return:
+                if result.object_type != rtype:
+                    throwError(0, 0, 'TypeError: Invalid return type for'
+                                     ' "{}": "{}"'
+                                     .format(rtype, result.object_type))
+
+                g.scope_depth -= 1
+                return result
+
+        g.scope_depth -= 1
+
+        return CoalVoid()
+
+    # Call
+    def _compileLocalMethodCall(self, node):
+        selectors = node.selectors
+        args = self.compileSuite(node.selector_args)
+        functionBody = self.functionBody
+        callWithScope = self.callWithScope
+        frameOf = self.frameOf
+        layout = self.frame
+
+        # The last function called from here: (body, called from a
+        # function, its frame, parameter slots, compiled body)
+        last = [(None, None, None, None, None)]
+
+        def run(it, frame):
+            selector_args = [arg(it, frame) for arg in args]
+
+            if selectors in it.builtins.public:
+                return it.builtins.call(selectors, selector_args)
+
+            methods = frame[0]['methods']
+
+            if selectors in methods:
+                fn = methods[selectors]
+                g = it.g
+
+                # Functions called from a function run in its frame
+                nested = g.scope_depth != 0
+                entry = last[0]
+
+                if entry[0] is not fn.suite or entry[1] is not nested:
+                    callee = layout if nested else frameOf(fn)
+
+                    if callee is None:
+                        return callWithScope(it, fn, selector_args)
+
+                    entry = (fn.suite, nested, callee,
+                             callee.params[id(fn.suite)],
+                             functionBody(fn.suite))
+                    last[0] = entry
+
+                n_frame = frame if nested else entry[2].enter(it.newScope())
+                params = entry[3]
+
+                g.scope_depth += 1
+
+                fn.checkArgs(selector_args)
+
+                for i in range(len(selector_args)):
+                    n_frame[params[i]] = unshared(selector_args[i])
+
+                rtype = fn.rtype
+
+                for st, is_return in entry[4]:
+                    result = st(it, n_frame)
+
+                    if is_return:
+                        if result.object_type != rtype:
+                            throwError(0, 0,
+                                       'TypeError: Invalid return type for'
+                                       ' "{}": "{}"'
+                                       .format(rtype, result.object_type))
+
+                        g.scope_depth -= 1
+                        return result
+
+                g.scope_depth -= 1
+
+            return CoalVoid()
+
+        return run
+
+    # Name
+    def _compileNameDef(self, node):
+        slot = self.frame.slots[node.name]
+        name_type = node.type
+        value = self.compile(node.value)
+
+        def run(it, frame):
+            result = value(it, frame)
+            builtin_types = it.builtins.types
+
+            if name_type in builtin_types:
+                frame[slot] =\
+                    builtin_types[name_type]['init'](result.value,
+                                                     result.object_type)
+            elif name_type in frame[0]['types']:
+                if result.object_type != name_type:
+                    throwError(0, 0,
+                               'TypeError: Unknown value type for "{}": {}'
+                               .format(name_type, result.object_type))
+
+                frame[slot] = result
+
+            return NOTHING
+
+        return run
+
+    def _compileNameDefEmpty(self, node):
+        slot = self.frame.slots[node.name]
+        name_type = node.type
+
+        def run(it, frame):
+            if name_type in frame[0]['types'] or name_type == 'Any':
+                frame[slot] = CoalVoid(obj_type=name_type)
+            else:
+                throwError(0, 4,
+                           'TypeError: Unknown type "{}"'.format(name_type))
+
+            return NOTHING
+
+        return run
+
+    def _compileNameAssign(self, node):
+        name = node.name
+        slot = self.frame.slots[name]
+        op = IN_PLACE.get(node.mode)
+        value = self.compile(node.value)
+        value_slot, constant = self.operand(node.value)
+        value_node = node.value
+
+        def run(it, frame):
+            if value_slot:
+                result = frame[value_slot]
+
+                if result is None:
+                    throwError(0, 0, 'NameError: Unknown name "{}"'
+                                     .format(value_node.name))
+            elif constant is not None:
+                result = constant
+            else:
+                result = value(it, frame)
+
+            current = frame[slot]
+
+            if current is None:
+                throwError(0, 1,
+                           'NameError: Unknown name "{}"'.format(name))
+
+            if isinstance(current, CoalVoid):
+                var_type = current.value
+
+                if var_type != 'Any' and var_type != result.object_type:
+                    throwError(0, 3,
+                               'TypeError: Wrong value type for Void({}): {}'
+                               .format(var_type, value_node.object_type))
+            elif current.object_type != result.object_type:
+                throwError(0, 3, 'TypeError: Wrong value type for {}: {}'
+                                 .format(current.object_type,
+                                         result.object_type))
+
+            if op is None:
+                frame[slot] = unshared(result)
+            else:
+                if current.shared:
+                    current = frame[slot] = unshared(current)
+
+                current.value = op(current.value, result.value)
+
+            return NOTHING
+
+        return run
+
+    def _compileIterableItemAssign(self, node):
+        name = node.name
+        slot = self.frame.slots[name]
+        index = self.compile(node.index)
+        value = self.compile(node.value)
+
+        def run(it, frame):
+            index_value = index(it, frame)
+            result = value(it, frame)
+            target = frame[slot]
+
+            if target is None:
+                throwError(0, 0,
+                           'NameError: Unknown name "{}"'.format(name))
+
+            if not isinstance(target, CoalIterableObject):
+                throwError(0, 0, 'Exception: "{}" object is not a writable'
+                           ' iterable'.format(target.object_type))
+
+            target.assign(index_value, result)
+
+            return NOTHING
+
+        return run
+
+    # Function
+    def _compileFuncDef(self, node):
+        def run(it, frame):
+            frame[0]['methods'][node.selectors] = CoalFunction(
+                node.selectors,
+                node.selector_names,
+                node.selector_types,
+                node.selector_aliases,
+                node.return_type,
+                node.suite,
+                node.simple
+            )
+
+            return NOTHING
+
+        return run
+
+    # Loop
+    def _compileForBlock(self, node):
+        start = self.compile(node.start)
+        end = self.compile(node.end)
+        has_interval = node.interval is not None
+        interval = self.compile(node.interval) if has_interval else None
+        slot = self.frame.slots[node.name]
+        suite = self.compileSuite(node.suite)
+
+        def run(it, frame):
+            g = it.g
+            g.flow = True
+
+            start_value = start(it, frame)
+            end_value = end(it, frame)
+
+            if has_interval:
+                interval_value = interval(it, frame)
+            else:
+                interval_value = coalInt(1)
+
+            if not isinstance(start_value, CoalInt)\
+               or not isinstance(end_value, CoalInt)\
+               or (has_interval
+                   and not isinstance(interval_value, CoalInt)):
+                throwError(0, 0, 'TypeError: The values for "start", '
+                                 '"end" and "interval" must be "Int".')
+
+            if frame[slot] is not None:
+                var_type = frame[slot].object_type
+
+                if var_type != 'Void(Any)' and var_type != 'Int':
+                    throwError(0, 3, 'TypeError: Wrong value type for {}: Int'
+                                     .format(var_type))
+            else:
+                i = CoalInt(start_value.value)
+                frame[slot] = i
+
+                while i.value <= end_value.value:
+                    if frame[slot] is not i:
+                        current = frame[slot]
+
+                        if current.shared:
+                            current = frame[slot] = unshared(current)
+
+                        current.value = i.value
+
+                    for st in suite:
+                        if g.flow_next:
+                            g.flow_next = False
+                            break
+                        elif g.flow_break:
+                            g.flow_break = False
+                            return
+
+                        st(it, frame)
+
+                    i.value += interval_value.value
+
+                frame[slot] = None
+
+            g.flow = False
+
+            return NOTHING
+
+        return run
+
+    def _compileEachBlock(self, node):
+        iterable = self.compile(node.iterable)
+        slot = self.frame.slots[node.name]
+        suite = self.compileSuite(node.suite)
+
+        def run(it, frame):
+            g = it.g
+            g.flow = True
+
+            items = iterable(it, frame)
+
+            if not isinstance(items, CoalIterableObject):
+                throwError('TypeError: "{}" object is not iterable.'
+                           .format(items.object_type))
+
+            if frame[slot] is None:
+                frame[slot] = CoalVoid(obj_type='Any')
+
+                length = items.call('length:', []).value
+                i = CoalInt(0)
+
+                while i.value < length:
+                    frame[slot] = items.iter(i)
+
+                    for st in suite:
+                        if g.flow_next:
+                            g.flow_next = False
+                            break
+                        elif g.flow_break:
+                            g.flow_break = False
+                            return
+
+                        st(it, frame)
+
+                    i.value += 1
+
+                frame[slot] = None
+
+            g.flow = False
+
+            return NOTHING
+
+        return run
+
+    # Value
+    def _compileName(self, node):
+        name = node.name
+        slot = self.frame.slots[name]
+
+        def run(it, frame):
+            value = frame[slot]
+
+            if value is None:
+                throwError(0, 0,
+                           'NameError: Unknown name "{}"'.format(name))
+
+            return value
+
+        return run
+
+    # Expression
+    def _compileExpr(self, node):
+        op = closures.OPERATORS[type(node)]
+        a = self.compile(node.a)
+        b = self.compile(node.b)
+        a_slot, a_constant = self.operand(node.a)
+        b_slot, b_constant = self.operand(node.b)
+        a_node = node.a
+        b_node = node.b
+
+        # Names and literals are read right here, not by their closures
+        def run(it, frame):
+            if a_slot:
+                left = frame[a_slot]
+
+                if left is None:
+                    throwError(0, 0, 'NameError: Unknown name "{}"'
+                                     .format(a_node.name))
+            elif a_constant is not None:
+                left = a_constant
+            else:
+                left = a(it, frame)
+
+            if b_slot:
+                right = frame[b_slot]
+
+                if right is None:
+                    throwError(0, 0, 'NameError: Unknown name "{}"'
+                                     .format(b_node.name))
+            elif b_constant is not None:
+                right = b_constant
+            else:
+                right = b(it, frame)
+
+            result = op(left.value, right.value)
+
+            if type(result) == int:
+                return coalInt(result)
+            elif type(result) == float:
+                return CoalFloat(result)
+            elif type(result) == bool:
+                return coalBool(result)
+
+            return CoalBool(result)
+
+        return run
+
+    # Cache
+    def _compileCachedValue(self, node):
+        value = self.compile(node.value)
+        methods = [(self.frame.slots[name], selectors)
+                   for name, selectors in node.methods]
+
+        def run(it, frame):
+            if node in it.cache:
+                return it.cache[node]
+
+            result = value(it, frame)
+
+            # Only methods known to be pure give values that can be kept
+            for slot, selectors in methods:
+                if selectors not in PURE_METHODS.get(type(frame[slot]), ()):
+                    return result
+
+            it.cache[node] = result
+
+            return result
+
+        return run
@@ -9,12 +9,42 @@
 
 # Imports
 import sys
+import threading
 # import copy
 
+# Where programs print, per thread (see ast.Interpreter.run())
+_output = threading.local()
+
 
 # Utils
+def output():
+    '''
+    The stream the running program prints to: sys.stdout unless its
+    interpreter was given another one.
+    '''
+
+    stream = getattr(_output, 'stream', None)
+
+    if stream is None:
+        return sys.stdout
+
+    return stream
+
+
+def setOutput(stream):
+    '''
+    Make `stream` (None for sys.stdout) this thread's output, and return
+    the previous one.
+    '''
+
+    previous = getattr(_output, 'stream', None)
+    _output.stream = stream
+
+    return previous
+
+
 def throwMethodError(message):
-    print('MethodError: {}'.format(message))
+    print('MethodError: {}'.format(message), file=output())
     sys.exit(1)
 
 
@@ -26,12 +56,12 @@ def throwWrongCallError(obj, method):
 
 def throwTypeError(obj, obj_type):
     print('TypeError: Wrong type of value for object "{}": {}.'
-          .format(obj, obj_type))
+          .format(obj, obj_type), file=output())
     sys.exit(1)
 
 
 def throwError(message):
-    print('{}'.format(message))
+    print('{}'.format(message), file=output())
     sys.exit(1)
 
 
@@ -43,6 +73,9 @@ def throwError(message):
 # [ ] Implement protected properties.
 
 class CoalObject(object):
+    # Pooled objects are shared by every use of a literal (see constant())
+    shared = False
+
     def __init__(self, obj_type, type, value):
         self.object_type = obj_type
         self.type = type
@@ -80,8 +113,17 @@ class CoalObject(object):
     def repr(self, as_type):
         return self.repr_as[as_type]()
 
+    def __reduce__(self):
+        # "methods" and "repr_as" hold bound methods and lambdas, so objects
+        # are pickled as constructor arguments (plus their attributes).
+        return (self.__class__, self._reduce_args(),
+                {'attributes': self.attributes})
+
+    def _reduce_args(self):
+        return (self.object_type, self.type, self.value)
+
     def _method_length_(self):
-        return CoalInt(len(self.value))
+        return coalInt(len(self.value))
 
 
 # Sub-types
@@ -109,6 +151,10 @@ class CoalIterableObject(CoalObject):
             return CoalVoid()
 
     def assign(self, index, value):
+        # Items are changed in place through "each", so they can't be
+        # pooled literals
+        value = unshared(value)
+
         if index.value == len(self.value) + 1:
             self.value.append(value)
         elif index.value <= len(self.value) - 1:
@@ -141,6 +187,18 @@ class CoalVoid(CoalObject):
             'String': lambda: CoalString('{}?'.format(self.value))
         }
 
+    def __reduce__(self):
+        return (_restoreVoid, (self.object_type, self.value),
+                {'attributes': self.attributes})
+
+
+def _restoreVoid(obj_type, value):
+    void = CoalVoid()
+    void.object_type = obj_type
+    void.value = value
+
+    return void
+
 
 class CoalBool(CoalObject):
     def __init__(self, value, obj_type=None):
@@ -160,6 +218,9 @@ class CoalBool(CoalObject):
         except:
             throwTypeError('Bool', obj_type)
 
+    def _reduce_args(self):
+        return (self.type,)
+
 
 # Function
 class CoalFunction(object):
@@ -174,6 +235,18 @@ class CoalFunction(object):
         self.simple = simple
 
     def __call__(self, scope, args):
+        self.checkArgs(args)
+
+        # Like names bound with "=", arguments never hold pooled literals
+        for i in range(len(args)):
+            if self.aliases[i] is not None:
+                scope['names'][self.aliases[i]] = unshared(args[i])
+            else:
+                scope['names'][self.names[i]] = unshared(args[i])
+
+        return (self.suite, scope, self.rtype)
+
+    def checkArgs(self, args):
         if len(args) < len(self.names) and not self.simple:
             throwError('Exception: Wrong argument count for {}.'
                        .format(self.selectors))
@@ -183,12 +256,13 @@ class CoalFunction(object):
                 throwError('TypeError: Wrong argument type for "{}": "{}"'
                            .format(self.selectors, args[i].object_type))
 
-            if self.aliases[i] is not None:
-                scope['names'][self.aliases[i]] = args[i]
-            else:
-                scope['names'][self.names[i]] = args[i]
+    def parameters(self):
+        '''
+        The names the arguments are bound to, in order.
+        '''
 
-        return (self.suite, scope, self.rtype)
+        return [alias if alias is not None else name
+                for name, alias in zip(self.names, self.aliases)]
 
 
 # Type
@@ -217,6 +291,9 @@ class CoalType(CoalObject):
                        ' constructor "{}"'
                        .format(self.object_type, selectors))
 
+    def _reduce_args(self):
+        return (self.object_type, self.inits)
+
 
 class CoalTypeInit(CoalObject):
     def __init__(self, selectors, names, types, aliases, suite):
@@ -248,6 +325,10 @@ class CoalTypeInit(CoalObject):
 
         return (self.suite, scope)
 
+    def __reduce__(self):
+        return (self.__class__, (self.selectors, self.names, self.types,
+                                 self.aliases, self.suite))
+
 
 # Integer
 class CoalInt(CoalObject):
@@ -259,6 +340,9 @@ class CoalInt(CoalObject):
         except:
             throwTypeError('Int', obj_type)
 
+    def _reduce_args(self):
+        return (self.value,)
+
 
 # Float
 class CoalFloat(CoalObject):
@@ -270,6 +354,9 @@ class CoalFloat(CoalObject):
         except:
             throwTypeError('Float', obj_type)
 
+    def _reduce_args(self):
+        return (self.value,)
+
 
 # String
 class CoalString(CoalObject):
@@ -313,6 +400,9 @@ class CoalString(CoalObject):
         except:
             throwTypeError('String', obj_type)
 
+    def _reduce_args(self):
+        return (self.value,)
+
     def iter(self, start, end=None):
         try:
             if end is None:
@@ -332,7 +422,7 @@ class CoalString(CoalObject):
 
         names = []
         for i in range(arg.call('length:', []).value):
-            names.append(arg.iter(CoalInt(i)).repr('String').value)
+            names.append(arg.iter(coalInt(i)).repr('String').value)
 
         return CoalString(self.value.format(*names))
 
@@ -401,8 +491,11 @@ class CoalList(CoalIterableObject):
         except:
             throwTypeError('List', obj_type)
 
+    def _reduce_args(self):
+        return (self.value,)
+
     def _method_append_(self, arg):
-        self.value.append(arg)
+        self.value.append(unshared(arg))
 
     def _method_update_(self, arg):
         if not isinstance(arg, CoalIterableObject):
@@ -410,10 +503,142 @@ class CoalList(CoalIterableObject):
                        .format(arg.object_type))
 
         for i in range(arg.call('length:', []).value):
-            self.value.append(arg.iter(CoalInt(i)))
+            self.value.append(arg.iter(coalInt(i)))
+
+
+# Methods that only read their object and arguments, by class: calls to
+# them can be cached (see optimize.py). pureMethods() adds more.
+PURE_METHODS = {}
+
+
+def pureMethods(cls, *selectors):
+    '''
+    Declare the methods `selectors` of `cls` free of side effects.
+    '''
+
+    PURE_METHODS.setdefault(cls, set()).update(selectors)
+
+
+pureMethods(CoalString,
+            'length:',
+            'concat:',
+            'format:',
+            'toUpper:',
+            'toLower:',
+            'stringAfterReplacing:with:',
+            'stringAfterReplacing:with:times:',
+            'stringAfterTrimming:')
+pureMethods(CoalList,
+            'length:',
+            'iterate:')
+
+
+# Literals evaluate to pooled objects, made once per value. Nothing may
+# change a pooled object in place: use ownValue() first.
+_constants = {}
+
+# How many objects the pool keeps (the REPL and the daemon parse new
+# literals for as long as they run)
+CONSTANT_SLOTS = 8192
+
+
+def constant(cls, value):
+    '''
+    The shared `cls` object for the literal `value`.
+    '''
+
+    # repr() keeps -0.0 apart from 0.0 (and lets NaN be found again)
+    key = (cls, type(value), repr(value) if type(value) is float else value)
+    obj = _constants.get(key)
+
+    if obj is None:
+        obj = cls(value)
+        obj.shared = True
+
+        if len(_constants) < CONSTANT_SLOTS:
+            _constants[key] = obj
+
+    return obj
+
+
+def unshared(value):
+    '''
+    `value`, or a copy of it if it is a pooled object.
+    '''
+
+    if value.shared:
+        return value.__class__(*value._reduce_args())
+
+    return value
+
+
+def ownValue(names, name):
+    '''
+    The object bound to `name`, copied into `names` first if it is a pooled
+    one, so that it can be changed in place.
+    '''
+
+    value = names[name]
+
+    if value.shared:
+        value = names[name] = unshared(value)
+
+    return value
+
+
+# Small Ints and the two Bools are pooled up front: arithmetic, comparisons
+# and loops get them from coalInt() and coalBool() instead of making them.
+SMALL_INTS = range(-5, 1025)
+
+_small_ints = [constant(CoalInt, i) for i in SMALL_INTS]
+
+TRUE = constant(CoalBool, 'true')
+FALSE = constant(CoalBool, 'false')
+
+
+def coalInt(value):
+    '''
+    The Int `value`, pooled if it is a small one.
+    '''
+
+    if -5 <= value <= 1024:
+        return _small_ints[value + 5]
+
+    return CoalInt(value)
+
+
+def coalBool(test):
+    '''
+    The pooled Bool for a Python truth value.
+    '''
+
+    return TRUE if test else FALSE
 
 
 # Builtins!
+def coalValue(value):
+    '''
+    Convert a Python value (bool, int, float, str, list or tuple) into a
+    Coal object. Coal objects are returned unchanged.
+    '''
+
+    if isinstance(value, CoalObject):
+        return value
+    elif isinstance(value, bool):
+        return coalBool(value)
+    elif isinstance(value, int):
+        return coalInt(value)
+    elif isinstance(value, float):
+        return CoalFloat(value)
+    elif isinstance(value, str):
+        return CoalString(value)
+    elif isinstance(value, (list, tuple)):
+        return CoalList([unshared(coalValue(item)) for item in value])
+
+    throwError('TypeError: Can\'t convert "{}" to a Coal value.'
+               .format(type(value).__name__))
+
+
 class CoalBuiltin(CoalObject):
     types = {
         'Void': {
@@ -441,6 +666,10 @@ class CoalBuiltin(CoalObject):
     def __init__(self):
         super(self.__class__, self).__init__('Builtins', None, None)
 
+        # Every interpreter gets its own copies
+        self.types = {name: dict(info) for name, info in self.types.items()}
+        self.names = dict(self.names)
+
         # self.public = list(self.public) + [
         self.public += [
             'print:',
@@ -457,11 +686,14 @@ class CoalBuiltin(CoalObject):
             'ord:': self._method_ord_
         })
 
+    def _reduce_args(self):
+        return ()
+
     def _method_print_(self, value):
         if isinstance(value, CoalString):
-            print(value.value)
+            print(value.value, file=output())
         else:
-            print(value.repr('String').value)
+            print(value.repr('String').value, file=output())
 
     def _method_print_sep_(self, value, sep):
         if not isinstance(sep, CoalString):
@@ -469,9 +701,9 @@ class CoalBuiltin(CoalObject):
                        ' as "Int".')
 
         if isinstance(value, CoalString):
-            sys.stdout.write(value.value + sep.value)
+            output().write(value.value + sep.value)
         else:
-            sys.stdout.write(value.repr('String').value + sep.value)
+            output().write(value.repr('String').value + sep.value)
 
     def _method_chr_(self, num):
         if isinstance(num, CoalInt):
@@ -481,6 +713,6 @@ class CoalBuiltin(CoalObject):
 
     def _method_ord_(self, char):
         if isinstance(char, CoalString):
-            return CoalInt(ord(char.value))
+            return coalInt(ord(char.value))
         else:
             throwError('TypeError: Built-in method "ord:" takes "String".')
@@ -0,0 +1,586 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Tiered execution
+ # version 0.1
+##
+
+# Imports
+import sys
+
+import transpile
+
+from ast import *
+
+# Options
+# Loop iterations (or function calls) before a body is specialized
+THRESHOLD = 1000
+# How many times a body is specialized again after its guards failed
+RESPECIALIZE_LIMIT = 3
+
+# What a specialized loop iteration returns, besides None (go on)
+BREAK = object()
+END = object()
+DEOPT = object()
+
+# Operators that keep Int values Int
+INT_ARITHMETIC = (ExprAddition, ExprSubtraction, ExprMultiplication,
+                  ExprModulo)
+
+# Nodes specialized code knows all the effects of (loops run through the
+# interpreter again, so they are tiered on their own)
+KNOWN_NODES = (
+    LocalMethodCall, ObjectMethodCall, NameDef, NameDefEmpty, NameAssign,
+    IterableItemAssign, FuncDef, FuncRet, IfBlock, ForBlock, EachBlock,
+    WhileBlock, FlowBreak, FlowNext, Name, ItemFromIterable, Void, Bool,
+    Int, Float, String, List, Exit, CachedValue, ClearCache
+) + tuple(transpile.ARITHMETIC) + tuple(transpile.COMPARISONS)
+
+
+# Utils
+def isIntValue(value):
+    return value.__class__ is CoalInt and value.value.__class__ is int
+
+
+class Profile(object):
+    '''
+    What the interpreter knows about one loop or function body: how often
+    it ran, and its specialized code.
+    '''
+
+    def __init__(self, key, kind):
+        self.key = key
+        self.kind = kind
+        self.count = 0
+        self.code = None
+        self.specialized = 0
+        self.deoptimized = 0
+
+    def deoptimize(self):
+        self.code = None
+        self.count = 0
+        self.deoptimized += 1
+
+
+def intNames(stmts, names, builtins):
+    '''
+    The names a region of code may assume hold Int objects with int
+    values, given the `names` it starts with, and whether it calls user
+    functions (which may redefine names when they share the scope).
+    '''
+
+    nodes = transpile.collectNodes(stmts)
+    calls = False
+    used = set()
+    bound = set()
+    assigns = []
+
+    for node in nodes:
+        if not isinstance(node, KNOWN_NODES):
+            # Anything could happen to the names
+            return set(), True
+        elif isinstance(node, Name):
+            used.add(node.name)
+        elif isinstance(node, (NameDef, NameDefEmpty, ForBlock, EachBlock)):
+            bound.add(node.name)
+        elif isinstance(node, NameAssign):
+            used.add(node.name)
+            assigns.append(node)
+        elif isinstance(node, LocalMethodCall):
+            if node.selectors not in builtins.public:
+                calls = True
+
+    known = set(name for name in used - bound
+                if name in names and isIntValue(names[name]))
+
+    # Assignments keep a name Int only with an Int value
+    changed = True
+
+    while changed:
+        changed = False
+
+        for node in assigns:
+            if node.name in known and\
+               (node.mode not in ('=', '+=', '-=', '*=')
+                    or not isInt(node.value, known)):
+                known.discard(node.name)
+                changed = True
+
+    return known, calls
+
+
+def isInt(node, known):
+    '''
+    Whether an expression always makes an Int with an int value.
+    '''
+
+    node_type = type(node)
+
+    if node_type is Int:
+        return node.value.__class__ is int
+    elif node_type is Name:
+        return node.name in known
+    elif node_type in INT_ARITHMETIC:
+        return isInt(node.a, known) and isInt(node.b, known)
+
+    return False
+
+
+class Specializer(transpile.Generator):
+    '''
+    Writes one loop iteration or function body for the types its names
+    have: arithmetic on names known to be Int works on the int values
+    directly. Guards at the top check those names and return DEOPT,
+    before anything ran, when they don't hold.
+    '''
+
+    def __init__(self, stmts, known, calls):
+        super(Specializer, self).__init__(stmts)
+
+        self.known = known
+        self.calls = calls
+
+        for node_type in (ForBlock, EachBlock, WhileBlock):
+            self.statements[node_type] = self._statementLoop
+
+    def guards(self):
+        checks = []
+
+        if self.known and self.calls:
+            # Called functions share the scope below the top level
+            checks.append('g.scope_depth == 0')
+
+        for name in sorted(self.known):
+            checks.append('{0!r} in names and'
+                          ' names[{0!r}].__class__ is CoalInt and'
+                          ' names[{0!r}].value.__class__ is int'
+                          .format(name))
+
+        if checks:
+            self.emit('if not ({}):'.format(' and '.join(checks)))
+            self.emit(transpile.INDENT + 'return _DEOPT')
+
+    def start(self):
+        self.emit('def _fast(it, scope):')
+        self.depth += 1
+        self.emit('names = scope[\'names\']')
+        self.emit('g = it.g')
+        self.guards()
+
+    def iteration(self, suite, test=None):
+        '''
+        One iteration of a loop (with a "while" loop's test first).
+        '''
+
+        self.start()
+
+        if test is not None:
+            if self.isComparison(test):
+                self.emit('if not ({}):'.format(self.raw(test)))
+            else:
+                self.emit('if not {}.value:'.format(self.expression(test)))
+
+            self.emit(transpile.INDENT + 'return _END')
+
+        for st in suite:
+            self.emit('if g.flow_next:')
+            self.emit(transpile.INDENT + 'g.flow_next = False')
+            self.emit(transpile.INDENT + 'return None')
+            self.emit('if g.flow_break:')
+            self.emit(transpile.INDENT + 'g.flow_break = False')
+            self.emit(transpile.INDENT + 'return _BREAK')
+            self.statement(st)
+
+        self.emit('return None')
+
+        return '\n'.join(self.lines) + '\n'
+
+    def body(self, suite):
+        '''
+        A function body.
+        '''
+
+        self.start()
+
+        for st in suite:
+            if isinstance(st, FuncRet):
+                self.emit('return {}'.format(self.expression(st.value)))
+            else:
+                self.statement(st)
+
+        self.emit('return _NO_RETURN')
+
+        return '\n'.join(self.lines) + '\n'
+
+    # Statement
+    def _statementLoop(self, st):
+        self.emit('it.execute({}, scope)'.format(self.node(st)))
+
+    def _statementNameAssign(self, st):
+        if st.name not in self.known or st.mode == '=':
+            return super(Specializer, self)._statementNameAssign(st)
+
+        # Only an int needs no checks (objects shared with other names can
+        # still end up holding floats)
+        result = self.temp('v')
+        current = self.temp('c')
+
+        self.emit('{} = {}'.format(result, self.raw(st.value)))
+        self.emit('if {}.__class__ is not int:'.format(result))
+        self.emit(transpile.INDENT +
+                  '_checkAssign(names[{!r}], exprResult({}), {}.value)'
+                  .format(st.name, result, self.node(st)))
+        self.emit('{} = names[{!r}]'.format(current, st.name))
+        self.emit('if {}.shared:'.format(current))
+        self.emit(transpile.INDENT + '{} = ownValue(names, {!r})'
+                  .format(current, st.name))
+        self.emit('{}.value {} {}'.format(current, st.mode, result))
+
+    def condition(self, test):
+        if self.isComparison(test):
+            return self.raw(test)
+
+        return super(Specializer, self).condition(test)
+
+    # Expression
+    def isComparison(self, node):
+        return type(node) in transpile.COMPARISONS and\
+               isInt(node.a, self.known) and isInt(node.b, self.known)
+
+    def raw(self, node):
+        '''
+        The Python value of an Int expression (or of a comparison).
+        '''
+
+        node_type = type(node)
+
+        if node_type is Int:
+            return repr(node.value)
+        elif node_type is Name:
+            return 'names[{!r}].value'.format(node.name)
+        elif node_type in transpile.COMPARISONS:
+            operators = transpile.COMPARISONS
+        else:
+            operators = transpile.ARITHMETIC
+
+        return '({} {} {})'.format(self.raw(node.a),
+                                   operators[node_type],
+                                   self.raw(node.b))
+
+    def expression(self, node):
+        node_type = type(node)
+
+        if node_type is Name and node.name in self.known:
+            return 'names[{!r}]'.format(node.name)
+        elif node_type in INT_ARITHMETIC and isInt(node, self.known):
+            return 'exprResult({})'.format(self.raw(node))
+        elif self.isComparison(node):
+            return 'coalBool({})'.format(self.raw(node))
+
+        return super(Specializer, self).expression(node)
+
+
+# The interpreter
+class TieredInterpreter(Interpreter):
+    '''
+    Walks the tree like Interpreter, counting loop iterations and function
+    calls. Bodies that run more than THRESHOLD times are specialized (see
+    Specializer) for the types their names have by then; when a guard
+    fails, the body goes back to being walked, and may be specialized
+    again later.
+
+    `state` is an Interpreter whose scopes, flags and builtins are used
+    instead of new ones.
+    '''
+
+    handlers = dict(Interpreter.handlers)
+
+    def __init__(self, stdout=None, state=None):
+        super(TieredInterpreter, self).__init__(stdout)
+
+        if state is not None:
+            self.builtins = state.builtins
+            self.g = state.g
+            self.local_scope = state.local_scope
+            self.current_scope = state.current_scope
+            self.cache = state.cache
+
+        # Profiles, by id() of their loop or suite
+        self.profiles = {}
+
+    def handlerFor(self, node_type):
+        # Handlers registered on Interpreter after this class was made
+        handler = Interpreter.handlers.get(node_type)
+
+        if handler is None:
+            return super(TieredInterpreter, self).handlerFor(node_type)
+
+        self.handlers[node_type] = handler
+
+        return handler
+
+    def profile(self, key, kind):
+        profile = self.profiles.get(id(key))
+
+        if profile is None or profile.key is not key:
+            profile = Profile(key, kind)
+            self.profiles[id(key)] = profile
+
+        return profile
+
+    def specialize(self, profile, stmts, scope, test=None):
+        '''
+        Compile specialized code for a profile, from the names in `scope`
+        as they are now.
+        '''
+
+        stmts = list(stmts)
+        region = stmts + ([test] if test is not None else [])
+        known, calls = intNames(region, scope['names'], self.builtins)
+
+        if calls and self.g.scope_depth != 0:
+            # The functions it calls share this scope
+            known = set()
+
+        specializer = Specializer(region, known, calls)
+
+        try:
+            if profile.kind == 'function':
+                src = specializer.body(stmts)
+            else:
+                src = specializer.iteration(stmts, test)
+
+            code = compile(src, '<coal tier>', 'exec')
+        except (SyntaxError, RecursionError, MemoryError):
+            # Keep walking this one
+            profile.deoptimized = RESPECIALIZE_LIMIT
+            return
+
+        namespace = dict(transpile.RUNTIME,
+                         _nodes=specializer.nodes,
+                         _call=TieredInterpreter.call,
+                         _BREAK=BREAK,
+                         _END=END,
+                         _DEOPT=DEOPT)
+        exec(code, namespace)
+
+        profile.code = namespace['_fast']
+        profile.specialized += 1
+
+    def hot(self, profile):
+        if profile.code is not None:
+            return False
+
+        profile.count += 1
+
+        return profile.count > THRESHOLD and\
+            profile.deoptimized < RESPECIALIZE_LIMIT
+
+    def iterate(self, profile, suite, scope, test=None):
+        '''
+        Run one loop iteration. Returns BREAK, END (a "while" test was
+        false) or None.
+        '''
+
+        if self.hot(profile):
+            self.specialize(profile, suite, scope, test)
+
+        if profile.code is not None:
+            status = profile.code(self, scope)
+
+            if status is not DEOPT:
+                return status
+
+            profile.deoptimize()
+
+        g = self.g
+
+        if test is not None and not self.execute(test, scope).value:
+            return END
+
+        for st in suite:
+            if g.flow_next:
+                g.flow_next = False
+                break
+            elif g.flow_break:
+                g.flow_break = False
+                return BREAK
+
+            self.execute(st, scope)
+
+        return None
+
+    def call(self, scope, selectors, args):
+        '''
+        Call a function (or a builtin) with evaluated arguments.
+        '''
+
+        if selectors in self.builtins.public:
+            return self.builtins.call(selectors, args)
+        elif selectors in scope['methods']:
+            g = self.g
+
+            if g.scope_depth == 0:
+                n_scope = self.newScope()
+            else:
+                n_scope = scope
+
+            g.scope_depth += 1
+
+            suite, n_scope, rtype = scope['methods'][selectors](n_scope, args)
+            profile = self.profile(suite, 'function')
+
+            if self.hot(profile):
+                self.specialize(profile, suite, n_scope)
+
+            result = DEOPT
+
+            if profile.code is not None:
+                result = profile.code(self, n_scope)
+
+                if result is DEOPT:
+                    profile.deoptimize()
+
+            if result is DEOPT:
+                result = transpile.NO_RETURN
+
+                for st in suite:
+                    value = self.execute(st, n_scope)
+
+                    if isinstance(st, FuncRet):
+                        result = value
+                        break
+
+            if result is not transpile.NO_RETURN:
+                if result.object_type != rtype:
+                    throwError(0, 0, 'TypeError: Invalid return type for'
+                                     ' "{}": "{}"'
+                                     .format(rtype, result.object_type))
+
+                g.scope_depth -= 1
+                return result
+
+            g.scope_depth -= 1
+
+        return CoalVoid()
+
+    def report(self, out=sys.stderr):
+        '''
+        Print how many loops and functions were specialized.
+        '''
+
+        for kind in ('loop', 'function'):
+            profiles = [p for p in self.profiles.values() if p.kind == kind]
+
+            out.write('tiers: {} {}s, {} specialized, {} deoptimized\n'
+                      .format(len(profiles), kind,
+                              sum(1 for p in profiles if p.specialized),
+                              sum(p.deoptimized for p in profiles)))
+
+    # Call
+    def _executeLocalMethodCall(self, stmt, scope):
+        return self.call(scope, stmt.selectors,
+                         [self.execute(arg, scope)
+                          for arg in stmt.selector_args])
+
+    # Loop
+    def _executeForBlock(self, stmt, scope):
+        self.g.flow = True
+
+        start = self.execute(stmt.start, scope)
+        end = self.execute(stmt.end, scope)
+
+        if stmt.interval is not None:
+            interval = self.execute(stmt.interval, scope)
+        else:
+            interval = coalInt(1)
+
+        if not isinstance(start, CoalInt)\
+           or not isinstance(end, CoalInt)\
+           or (stmt.interval is not None
+               and not isinstance(interval, CoalInt)):
+            throwError(0, 0, 'TypeError: The values for "start", '
+                             '"end" and "interval" must be "Int".')
+
+        if stmt.name in scope['names']:
+            var_type = scope['names'][stmt.name].object_type
+
+            if var_type != 'Void(Any)' and var_type != 'Int':
+                throwError(0, 3, 'TypeError: Wrong value type for {}: Int'
+                                 .format(var_type))
+        else:
+            profile = self.profile(stmt, 'loop')
+            i = CoalInt(start.value)
+            scope['names'][stmt.name] = i
+
+            while i.value <= end.value:
+                if scope['names'][stmt.name] is not i:
+                    ownValue(scope['names'], stmt.name).value = i.value
+
+                if self.iterate(profile, stmt.suite, scope) is BREAK:
+                    return
+
+                i.value += interval.value
+
+            del scope['names'][stmt.name]
+
+        self.g.flow = False
+
+        return CoalVoid()
+
+    def _executeEachBlock(self, stmt, scope):
+        self.g.flow = True
+
+        iterable = self.execute(stmt.iterable, scope)
+
+        if not isinstance(iterable, CoalIterableObject):
+            throwError('TypeError: "{}" object is not iterable.'
+                       .format(iterable.object_type))
+
+        if stmt.name not in scope['names']:
+            profile = self.profile(stmt, 'loop')
+            scope['names'][stmt.name] = CoalVoid(obj_type='Any')
+
+            length = iterable.call('length:', []).value
+            i = CoalInt(0)
+
+            while i.value < length:
+                scope['names'][stmt.name] = iterable.iter(i)
+
+                if self.iterate(profile, stmt.suite, scope) is BREAK:
+                    return
+
+                i.value += 1
+
+            del scope['names'][stmt.name]
+
+        self.g.flow = False
+
+        return CoalVoid()
+
+    def _executeWhileBlock(self, stmt, scope):
+        self.g.flow = True
+
+        profile = self.profile(stmt, 'loop')
+
+        while True:
+            status = self.iterate(profile, stmt.suite, scope, stmt.test)
+
+            if status is BREAK:
+                return
+            elif status is END:
+                break
+
+        self.g.flow = False
+
+        return CoalVoid()
+
+
+TieredInterpreter.handlers.update({
+    LocalMethodCall: TieredInterpreter._executeLocalMethodCall,
+    ForBlock: TieredInterpreter._executeForBlock,
+    EachBlock: TieredInterpreter._executeEachBlock,
+    WhileBlock: TieredInterpreter._executeWhileBlock
+})
@@ -0,0 +1,792 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Python transpiler
+ # version 0.1
+##
+
+# Imports
+import os
+import sys
+import math
+import marshal
+import operator
+import hashlib
+import tempfile
+import importlib.util
+
+from ast import *
+
+# Options
+CODE_MAGIC = b'COALPY1\n'
+CACHE_DIRECTORY = '__coalcache__'
+INDENT = '    '
+
+# Python operators for the expression classes
+ARITHMETIC = {
+    ExprAddition: '+',
+    ExprSubtraction: '-',
+    ExprMultiplication: '*',
+    ExprDivision: '/',
+    ExprModulo: '%'
+}
+
+COMPARISONS = {
+    ExprEqual: '==',
+    ExprNotEqual: '!=',
+    ExprGreater: '>',
+    ExprLess: '<',
+    ExprEqualGreater: '>=',
+    ExprEqualLess: '<='
+}
+
+# The operators above as functions, for _operate()
+OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '%': operator.mod,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le
+}
+
+# Nodes that run no code of the program, so reading the left operand's
+# value before one of them runs gives what the tree walker gets
+PLAIN = (Name, Constant, Void, ItemFromIterable) + tuple(ARITHMETIC) +\
+    tuple(COMPARISONS)
+
+# Returned by a function body that ends without "return"
+NO_RETURN = object()
+
+
+# Utils
+def collectNodes(stmts):
+    '''
+    Every node of a program, in a fixed order. Generated code refers to
+    nodes by their position in this list, so it can be loaded again for
+    the same program.
+    '''
+
+    nodes = []
+    stack = [stmts]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+        elif isinstance(item, CoalAST):
+            nodes.append(item)
+            stack.extend(reversed(list(vars(item).values())))
+
+    return nodes
+
+
+def functionNodes(nodes):
+    '''
+    Positions of the FuncDefs whose bodies are transpiled (lazily kept
+    bodies aren't: they are only parsed when called).
+    '''
+
+    return [i for i, node in enumerate(nodes)
+            if isinstance(node, FuncDef)
+            and not isinstance(node.suite, LazySuite)]
+
+
+# Runtime helpers, the parts of a statement that aren't worth inlining
+def _unknownName(name):
+    throwError(0, 0, 'NameError: Unknown name "{}"'.format(name))
+
+
+def _checkAssign(current, result, value_node):
+    if isinstance(current, CoalVoid):
+        var_type = current.value
+
+        if var_type != 'Any' and var_type != result.object_type:
+            throwError(0, 3, 'TypeError: Wrong value type for Void({}): {}'
+                             .format(var_type, value_node.object_type))
+    elif current.object_type != result.object_type:
+        throwError(0, 3, 'TypeError: Wrong value type for {}: {}'
+                         .format(current.object_type, result.object_type))
+
+
+def _nameDef(it, scope, name, name_type, result):
+    builtin_types = it.builtins.types
+
+    if name_type in builtin_types:
+        scope['names'][name] =\
+            builtin_types[name_type]['init'](result.value, result.object_type)
+    elif name_type in scope['types']:
+        if result.object_type != name_type:
+            throwError(0, 0, 'TypeError: Unknown value type for "{}": {}'
+                             .format(name_type, result.object_type))
+
+        scope['names'][name] = result
+
+
+def _nameDefEmpty(scope, name, name_type):
+    if name_type in scope['types'] or name_type == 'Any':
+        scope['names'][name] = CoalVoid(obj_type=name_type)
+    else:
+        throwError(0, 4, 'TypeError: Unknown type "{}"'.format(name_type))
+
+
+def _storeItem(names, name, index, result):
+    if name not in names:
+        throwError(0, 0, 'NameError: Unknown name "{}"'.format(name))
+
+    target = names[name]
+
+    if not isinstance(target, CoalIterableObject):
+        throwError(0, 0, 'Exception: "{}" object is not a writable iterable'
+                         .format(target.object_type))
+
+    target.assign(index, result)
+
+
+def _defFunc(scope, node):
+    scope['methods'][node.selectors] = CoalFunction(
+        node.selectors,
+        node.selector_names,
+        node.selector_types,
+        node.selector_aliases,
+        node.return_type,
+        node.suite,
+        node.simple
+    )
+
+
+def _forValues(start, end, interval, has_interval):
+    if not isinstance(start, CoalInt)\
+       or not isinstance(end, CoalInt)\
+       or (has_interval and not isinstance(interval, CoalInt)):
+        throwError(0, 0, 'TypeError: The values for "start", "end" and'
+                         ' "interval" must be "Int".')
+
+
+def _forName(names, name):
+    var_type = names[name].object_type
+
+    if var_type != 'Void(Any)' and var_type != 'Int':
+        throwError(0, 3, 'TypeError: Wrong value type for {}: Int'
+                         .format(var_type))
+
+
+def _eachValue(items):
+    if not isinstance(items, CoalIterableObject):
+        throwError('TypeError: "{}" object is not iterable.'
+                   .format(items.object_type))
+
+
+def _flowBreak(g):
+    if not g.flow:
+        throwError('SyntaxError: Invalid syntax: "break".')
+
+    g.flow_break = True
+
+
+def _flowNext(g):
+    if not g.flow:
+        throwError('SyntaxError: Invalid syntax: "next".')
+
+    g.flow_next = True
+
+
+def _operate(symbol, a, b):
+    '''
+    `symbol` on the values of two operands that both ran already (the
+    right one may have changed the left one in place).
+    '''
+
+    return OPERATORS[symbol](a.value, b.value)
+
+
+def plain(node):
+    '''
+    Whether `node` (and everything in it) is PLAIN.
+    '''
+
+    if not isinstance(node, PLAIN):
+        return False
+
+    return all(plain(child) for child in vars(node).values()
+               if isinstance(child, CoalAST))
+
+
+def _exit(result):
+    if not isinstance(result, CoalInt) and not isinstance(result, CoalBool):
+        throwError(0, 0, 'TypeError: The program must return "Int" or'
+                         ' "Bool".')
+
+    raise CoalExit(result.value)
+
+
+# What generated code can see, besides _nodes and _call
+RUNTIME = {
+    'CoalVoid': CoalVoid,
+    'CoalBool': CoalBool,
+    'CoalInt': CoalInt,
+    'CoalFloat': CoalFloat,
+    'CoalString': CoalString,
+    'CoalList': CoalList,
+    'coalInt': coalInt,
+    'coalBool': coalBool,
+    'exprResult': exprResult,
+    'ownValue': ownValue,
+    'unshared': unshared,
+    '_NO_RETURN': NO_RETURN,
+    '_unknownName': _unknownName,
+    '_checkAssign': _checkAssign,
+    '_nameDef': _nameDef,
+    '_nameDefEmpty': _nameDefEmpty,
+    '_storeItem': _storeItem,
+    '_defFunc': _defFunc,
+    '_forValues': _forValues,
+    '_forName': _forName,
+    '_eachValue': _eachValue,
+    '_flowBreak': _flowBreak,
+    '_flowNext': _flowNext,
+    '_operate': _operate,
+    '_exit': _exit
+}
+
+
+class Generator(object):
+    '''
+    Writes a program as Python source: one function for the top level,
+    called as _program(it, scope), and one per function body. Statements
+    do what Interpreter.execute() does for the same nodes; node types the
+    generator doesn't know are handed to Interpreter.execute().
+
+    (The source is text, not a Python AST: our ast module shadows the
+    standard library one.)
+    '''
+
+    def __init__(self, stmts):
+        self.stmts = stmts
+        self.nodes = collectNodes(stmts)
+        self.index = {id(node): i for i, node in enumerate(self.nodes)}
+        self.lines = []
+        self.depth = 0
+        self.temps = 0
+
+        self.statements = {
+            NameDef: self._statementNameDef,
+            NameDefEmpty: self._statementNameDefEmpty,
+            NameAssign: self._statementNameAssign,
+            IterableItemAssign: self._statementIterableItemAssign,
+            FuncDef: self._statementFuncDef,
+            IfBlock: self._statementIfBlock,
+            ForBlock: self._statementForBlock,
+            EachBlock: self._statementEachBlock,
+            WhileBlock: self._statementWhileBlock,
+            FlowBreak: self._statementFlowBreak,
+            FlowNext: self._statementFlowNext,
+            Exit: self._statementExit
+        }
+
+    def generate(self):
+        for i in functionNodes(self.nodes):
+            self.function('_f{}'.format(i), self.nodes[i].suite, True)
+
+        self.function('_program', self.stmts, False)
+
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, line):
+        self.lines.append(INDENT * self.depth + line)
+
+    def temp(self, prefix):
+        self.temps += 1
+
+        return '_{}{}'.format(prefix, self.temps)
+
+    def node(self, node):
+        return '_nodes[{}]'.format(self.index[id(node)])
+
+    def function(self, name, suite, is_body):
+        self.emit('def {}(it, scope):'.format(name))
+        self.depth += 1
+        self.emit('names = scope[\'names\']')
+        self.emit('g = it.g')
+
+        for st in suite:
+            # Only a "return" at the top of a body returns
+            if is_body and isinstance(st, FuncRet):
+                self.emit('return {}'.format(self.expression(st.value)))
+            else:
+                self.statement(st)
+
+        if is_body:
+            self.emit('return _NO_RETURN')
+
+        self.depth -= 1
+        self.emit('')
+
+    def block(self, suite):
+        self.depth += 1
+
+        for st in suite:
+            self.statement(st)
+
+        if not suite:
+            self.emit('pass')
+
+        self.depth -= 1
+
+    def loopBody(self, suite, broken):
+        '''
+        A loop's suite, with "next" and "break" checked before each
+        statement. Leaving the inner loop skips to the next iteration;
+        `broken` is set when the whole loop has to end.
+        '''
+
+        self.emit('{} = False'.format(broken))
+        self.emit('while True:')
+        self.depth += 1
+
+        for st in suite:
+            self.emit('if g.flow_next:')
+            self.emit(INDENT + 'g.flow_next = False')
+            self.emit(INDENT + 'break')
+            self.emit('if g.flow_break:')
+            self.emit(INDENT + 'g.flow_break = False')
+            self.emit(INDENT + '{} = True'.format(broken))
+            self.emit(INDENT + 'break')
+            self.statement(st)
+
+        self.emit('break')
+        self.depth -= 1
+        self.emit('if {}:'.format(broken))
+        self.emit(INDENT + 'break')
+
+    # Statement
+    def statement(self, st):
+        generate = self.statements.get(type(st))
+
+        if generate is None:
+            self.emit(self.expression(st))
+        else:
+            generate(st)
+
+    def _statementNameDef(self, st):
+        self.emit('_nameDef(it, scope, {!r}, {!r}, {})'
+                  .format(st.name, st.type, self.expression(st.value)))
+
+    def _statementNameDefEmpty(self, st):
+        self.emit('_nameDefEmpty(scope, {!r}, {!r})'.format(st.name, st.type))
+
+    def _statementNameAssign(self, st):
+        result = self.temp('v')
+        current = self.temp('c')
+
+        self.emit('{} = {}'.format(result, self.expression(st.value)))
+        self.emit('{0} = names[{1!r}] if {1!r} in names else'
+                  ' _unknownName({1!r})'.format(current, st.name))
+        self.emit('if isinstance({0}, CoalVoid) or'
+                  ' {0}.object_type != {1}.object_type:'
+                  .format(current, result))
+        self.emit(INDENT + '_checkAssign({}, {}, {}.value)'
+                  .format(current, result, self.node(st)))
+
+        if st.mode == '=':
+            self.emit('names[{!r}] = unshared({})'.format(st.name, result))
+        elif st.mode in ('+=', '-=', '*=', '/='):
+            self.emit('if {}.shared:'.format(current))
+            self.emit(INDENT + '{} = ownValue(names, {!r})'
+                      .format(current, st.name))
+            self.emit('{}.value {} {}.value'.format(current, st.mode, result))
+
+    def _statementIterableItemAssign(self, st):
+        self.emit('_storeItem(names, {!r}, {}, {})'
+                  .format(st.name,
+                          self.expression(st.index),
+                          self.expression(st.value)))
+
+    def _statementFuncDef(self, st):
+        self.emit('_defFunc(scope, {})'.format(self.node(st)))
+
+    def _statementIfBlock(self, st):
+        branches = [(st.test, st.suite)]
+
+        if st.elif_blocks is not None:
+            branches.extend((block[0], block[1]) for block in st.elif_blocks)
+
+        depth = self.depth
+
+        for test, suite in branches:
+            self.emit('if {}:'.format(self.condition(test)))
+            self.block(suite)
+            self.emit('else:')
+            self.depth += 1
+
+        if st.else_suite is not None:
+            for else_st in st.else_suite:
+                self.statement(else_st)
+
+        self.emit('pass')
+        self.depth = depth
+
+    def condition(self, test):
+        '''
+        An "if" test, as a Python condition (evaluated where it is used).
+        '''
+
+        result = self.temp('t')
+
+        self.emit('{} = {}'.format(result, self.expression(test)))
+
+        return '{0}.value and not isinstance({0}.value, CoalVoid)'\
+               .format(result)
+
+    def _statementForBlock(self, st):
+        start = self.temp('s')
+        end = self.temp('e')
+        interval = self.temp('n')
+        i = self.temp('i')
+        broken = self.temp('b')
+        has_interval = st.interval is not None
+
+        self.emit('g.flow = True')
+        self.emit('{} = {}'.format(start, self.expression(st.start)))
+        self.emit('{} = {}'.format(end, self.expression(st.end)))
+
+        if has_interval:
+            self.emit('{} = {}'.format(interval,
+                                       self.expression(st.interval)))
+        else:
+            self.emit('{} = coalInt(1)'.format(interval))
+
+        self.emit('_forValues({}, {}, {}, {})'
+                  .format(start, end, interval, has_interval))
+        self.emit('if {!r} in names:'.format(st.name))
+        self.emit(INDENT + '_forName(names, {!r})'.format(st.name))
+        self.emit(INDENT + 'g.flow = False')
+        self.emit('else:')
+        self.depth += 1
+        self.emit('{} = CoalInt({}.value)'.format(i, start))
+        self.emit('names[{!r}] = {}'.format(st.name, i))
+        self.emit('while {}.value <= {}.value:'.format(i, end))
+        self.depth += 1
+        self.emit('if names[{!r}] is not {}:'.format(st.name, i))
+        self.emit(INDENT + 'ownValue(names, {!r}).value = {}.value'
+                  .format(st.name, i))
+        self.loopBody(st.suite, broken)
+        self.emit('{}.value += {}.value'.format(i, interval))
+        self.depth -= 1
+
+        # A "break" leaves the loop without this
+        self.emit('else:')
+        self.emit(INDENT + 'del names[{!r}]'.format(st.name))
+        self.emit(INDENT + 'g.flow = False')
+        self.depth -= 1
+
+    def _statementEachBlock(self, st):
+        items = self.temp('l')
+        length = self.temp('n')
+        i = self.temp('i')
+        broken = self.temp('b')
+
+        self.emit('g.flow = True')
+        self.emit('{} = {}'.format(items, self.expression(st.iterable)))
+        self.emit('_eachValue({})'.format(items))
+        self.emit('if {!r} in names:'.format(st.name))
+        self.emit(INDENT + 'g.flow = False')
+        self.emit('else:')
+        self.depth += 1
+        self.emit('names[{!r}] = CoalVoid(obj_type=\'Any\')'.format(st.name))
+        self.emit('{} = {}.call(\'length:\', []).value'.format(length, items))
+        self.emit('{} = CoalInt(0)'.format(i))
+        self.emit('while {}.value < {}:'.format(i, length))
+        self.depth += 1
+        self.emit('names[{!r}] = {}.iter({})'.format(st.name, items, i))
+        self.loopBody(st.suite, broken)
+        self.emit('{}.value += 1'.format(i))
+        self.depth -= 1
+        self.emit('else:')
+        self.emit(INDENT + 'del names[{!r}]'.format(st.name))
+        self.emit(INDENT + 'g.flow = False')
+        self.depth -= 1
+
+    def _statementWhileBlock(self, st):
+        broken = self.temp('b')
+
+        self.emit('g.flow = True')
+        self.emit('while {}.value:'.format(self.expression(st.test)))
+        self.depth += 1
+        self.loopBody(st.suite, broken)
+        self.depth -= 1
+        self.emit('else:')
+        self.emit(INDENT + 'g.flow = False')
+
+    def _statementFlowBreak(self, st):
+        self.emit('_flowBreak(g)')
+
+    def _statementFlowNext(self, st):
+        self.emit('_flowNext(g)')
+
+    def _statementExit(self, st):
+        self.emit('_exit({})'.format(self.expression(st.value)))
+
+    # Expression
+    def expression(self, node):
+        node_type = type(node)
+
+        if node_type in ARITHMETIC:
+            return 'exprResult({})'.format(
+                self.operation(node, ARITHMETIC[node_type]))
+        elif node_type in COMPARISONS:
+            return 'coalBool({})'.format(
+                self.operation(node, COMPARISONS[node_type]))
+        elif node_type is Name:
+            return '(names[{0!r}] if {0!r} in names else' \
+                   ' _unknownName({0!r}))'.format(node.name)
+        elif node_type is LocalMethodCall:
+            return '_call(it, scope, {!r}, [{}])'.format(
+                node.selectors,
+                ', '.join(self.expression(arg)
+                          for arg in node.selector_args))
+        elif node_type is ObjectMethodCall:
+            return '{}.call({!r}, [{}])'.format(
+                self.expression(node.object),
+                node.selectors,
+                ', '.join(self.expression(arg)
+                          for arg in node.selector_args))
+        elif node_type is ItemFromIterable:
+            return '{}.iter({}, {})'.format(
+                self.expression(node.name),
+                self.expression(node.index),
+                'None' if node.end is None else self.expression(node.end))
+        elif node_type is FuncRet:
+            return self.expression(node.value)
+        elif node_type is List:
+            return 'CoalList([{}])'.format(
+                ', '.join('unshared({})'.format(self.expression(item))
+                          for item in node.value))
+        elif isinstance(node, Constant):
+            return '{}.constant'.format(self.node(node))
+        elif node_type is Void:
+            return 'CoalVoid({})'.format(self.literal(node))
+        elif not isinstance(node, CoalAST):
+            # Stray tokens in a suite do nothing
+            return 'CoalVoid()'
+
+        return 'it.execute({}, scope)'.format(self.node(node))
+
+    def operation(self, node, symbol):
+        '''
+        `symbol` on the values of node.a and node.b. Both operands run
+        before either value is read, like the tree walker does, unless the
+        right one can't change the left.
+        '''
+
+        a = self.expression(node.a)
+        b = self.expression(node.b)
+
+        if plain(node.b):
+            return '{}.value {} {}.value'.format(a, symbol, b)
+
+        return '_operate({!r}, {}, {})'.format(symbol, a, b)
+
+    def literal(self, node):
+        value = node.value
+
+        if type(value) in (int, str, bool) or\
+           (type(value) == float and math.isfinite(value)):
+            return repr(value)
+
+        return '{}.value'.format(self.node(node))
+
+
+def source(stmts):
+    '''
+    The Python source for a program.
+    '''
+
+    return Generator(stmts).generate()
+
+
+# Running
+class Program(object):
+    '''
+    A transpiled program, called as fn(interpreter, scope) like the other
+    compiled engines.
+    '''
+
+    def __init__(self, stmts, code=None):
+        self.nodes = collectNodes(stmts)
+        self.stmts = stmts
+        namespace = dict(RUNTIME, _nodes=self.nodes, _call=self.call)
+
+        if code is not None:
+            exec(code, namespace)
+
+            self.program = namespace['_program']
+        else:
+            # Too deeply nested for Python; walk the tree instead
+            self.program = self.walk
+
+        # Python functions for the bodies, by id() of their suite
+        self.bodies = {}
+
+        for i in functionNodes(self.nodes):
+            name = '_f{}'.format(i)
+
+            if name in namespace:
+                self.bodies[id(self.nodes[i].suite)] = namespace[name]
+
+    def __call__(self, it, scope):
+        self.program(it, scope)
+
+    def walk(self, it, scope):
+        for st in self.stmts:
+            it.execute(st, scope)
+
+    def call(self, it, scope, selectors, args):
+        if selectors in it.builtins.public:
+            return it.builtins.call(selectors, args)
+        elif selectors in scope['methods']:
+            g = it.g
+
+            if g.scope_depth == 0:
+                n_scope = it.newScope()
+            else:
+                n_scope = scope
+
+            g.scope_depth += 1
+
+            suite, n_scope, rtype = scope['methods'][selectors](n_scope, args)
+            body = self.bodies.get(id(suite))
+
+            if body is not None:
+                result = body(it, n_scope)
+
+                if result is not NO_RETURN:
+                    if result.object_type != rtype:
+                        throwError(0, 0, 'TypeError: Invalid return type for'
+                                         ' "{}": "{}"'
+                                         .format(rtype, result.object_type))
+
+                    g.scope_depth -= 1
+                    return result
+            else:
+                # Defined by another program (a prelude, an image...)
+                for st in suite:
+                    result = it.execute(st, n_scope)
+
+                    if isinstance(st, FuncRet):
+                        if result.object_type != rtype:
+                            throwError(0, 0,
+                                       'TypeError: Invalid return type for'
+                                       ' "{}": "{}"'
+                                       .format(rtype, result.object_type))
+
+                        g.scope_depth -= 1
+                        return result
+
+            g.scope_depth -= 1
+
+        return CoalVoid()
+
+
+def compileCode(stmts):
+    '''
+    Transpile and compile a program to a Python code object, or None if
+    Python can't compile it (it nests too deeply).
+    '''
+
+    try:
+        return compile(source(stmts), '<coal>', 'exec')
+    except (SyntaxError, RecursionError, MemoryError):
+        return None
+
+
+# On-disk cache, in __coalcache__ next to the source
+def cachePath(path):
+    directory, name = os.path.split(os.path.abspath(path))
+
+    return os.path.join(directory, CACHE_DIRECTORY, name + '.pyc')
+
+
+def cacheHeader(src, version, stmts):
+    h = hashlib.sha1()
+    h.update(version.encode('utf-8'))
+    h.update(src.encode('utf-8'))
+
+    # The same source parsed lazily has other nodes and bodies
+    nodes = collectNodes(stmts)
+
+    return (importlib.util.MAGIC_NUMBER, h.hexdigest(),
+            len(nodes), functionNodes(nodes))
+
+
+def loadCode(path, header):
+    try:
+        with open(cachePath(path), 'rb') as f:
+            if f.read(len(CODE_MAGIC)) != CODE_MAGIC:
+                return None
+
+            if marshal.load(f) != header:
+                return None
+
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def storeCode(path, header, code):
+    cache = cachePath(path)
+    directory = os.path.dirname(cache)
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    except OSError:
+        # A read-only directory just means no cache
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(CODE_MAGIC)
+            marshal.dump(header, f)
+            marshal.dump(code, f)
+
+        os.replace(tmp, cache)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+        return False
+
+    return True
+
+
+def compileProgram(stmts, path=None, src=None, version=''):
+    '''
+    Transpile a program into a Program. With the `path` and `src` it was
+    read from, the code object is cached next to it and reused while the
+    source and `version` stay the same.
+    '''
+
+    if path is None or src is None:
+        return Program(stmts, compileCode(stmts))
+
+    header = cacheHeader(src, version, stmts)
+    code = loadCode(path, header)
+
+    if code is None:
+        code = compileCode(stmts)
+
+        if code is not None:
+            storeCode(path, header, code)
+
+    return Program(stmts, code)
@@ -0,0 +1,734 @@
+#: vim set encoding=utf-8 :
+##
+ # Coal
+ # Python implementation of the Coal language
+ #
+ # Module: Bytecode compiler and virtual machine
+ # version 0.1
+##
+
+# Imports
+import sys
+import operator
+
+from ast import *
+
+# Opcodes
+OPNAMES = [
+    'LOAD_NAME',         # name: push a name's value
+    'LOAD_CONST',        # object: push a pooled literal object
+    'LOAD_LITERAL',      # (factory, value): push a new literal object
+    'BINARY',            # (symbol, fn): pop b and a, push fn(a, b)
+    'BUILD_LIST',        # count: pop items, push a List
+    'GET_ITEM',          # has_end: pop [end], index and iterable, push item
+    'CALL_LOCAL',        # (selectors, argc): call a builtin or a function
+    'CALL_METHOD',       # (selectors, argc): pop args and object, call
+    'EXECUTE',           # node: run a node with the tree walker, push result
+    'POP_TOP',           # -: drop the top of the stack
+    'STORE_DEF',         # (name, type): "let name: type = <pop>"
+    'DEF_EMPTY',         # (name, type): "let name: type"
+    'STORE_ASSIGN',      # (name, mode, value node): "name <mode> <pop>"
+    'STORE_ITEM',        # name: pop value and index, "name{index} = value"
+    'DEF_FUNC',          # FuncDef: define a function
+    'JUMP',              # target
+    'JUMP_UNLESS_TRUE',  # target: pop, jump unless it passes an "if" test
+    'JUMP_UNLESS',       # target: pop, jump unless its value is true
+    'SET_FLOW',          # bool: enter or leave a loop
+    'FLOW_CHECK',        # (next, break): honour "next"/"break" in a loop
+    'FLOW_BREAK',        # -: "break"
+    'FLOW_NEXT',         # -: "next"
+    'FOR_PREP',          # (name, has_interval, exit): start a "for" loop
+    'FOR_ITER',          # (name, done): next counter value, or leave
+    'FOR_STEP',          # top: advance the counter, jump back
+    'EACH_PREP',         # (name, exit): start an "each" loop
+    'EACH_ITER',         # (name, done): next item, or leave
+    'EACH_STEP',         # top: advance the index, jump back
+    'LOOP_END',          # name: drop the loop state and the loop name
+    'RETURN',            # -: return <pop> from a function
+    'RETURN_VOID',       # -: return from a function without a value
+    'EXIT',              # -: "exit <pop>"
+    'HALT'               # -: end of the program
+]
+
+for _opcode, _opname in enumerate(OPNAMES):
+    globals()[_opname] = _opcode
+
+# Ops whose argument is (or starts with) a jump target
+JUMPS = {
+    JUMP: (0,),
+    JUMP_UNLESS_TRUE: (0,),
+    JUMP_UNLESS: (0,),
+    FLOW_CHECK: (0, 1),
+    FOR_PREP: (2,),
+    FOR_ITER: (1,),
+    FOR_STEP: (0,),
+    EACH_PREP: (1,),
+    EACH_ITER: (1,),
+    EACH_STEP: (0,)
+}
+
+
+# Expression classes, their symbols and what they do with their operands
+OPERATORS = {
+    ExprAddition: ('+', operator.add),
+    ExprSubtraction: ('-', operator.sub),
+    ExprMultiplication: ('*', operator.mul),
+    ExprDivision: ('/', operator.truediv),
+    ExprModulo: ('%', operator.mod),
+    ExprEqual: ('==', operator.eq),
+    ExprNotEqual: ('!=', operator.ne),
+    ExprGreater: ('>', operator.gt),
+    ExprLess: ('<', operator.lt),
+    ExprEqualGreater: ('>=', operator.ge),
+    ExprEqualLess: ('<=', operator.le)
+}
+
+# Literal classes and the objects they make (other literals are pooled)
+LITERALS = {
+    Void: CoalVoid
+}
+
+
+class Label(object):
+    '''
+    A jump target, placed once the code after it is known.
+    '''
+
+    __slots__ = ('target',)
+
+    def __init__(self):
+        self.target = None
+
+
+class Code(object):
+    '''
+    Compiled bytecode: a flat list of (opcode, argument) pairs. Calling
+    it as code(interpreter, scope) runs it, like a compiled closure.
+    '''
+
+    def __init__(self, compiler, name='<program>'):
+        self.compiler = compiler
+        self.name = name
+        self.ops = []
+
+    def emit(self, op, arg=None):
+        self.ops.append((op, arg))
+
+    def place(self, label):
+        label.target = len(self.ops)
+
+    def resolve(self):
+        '''
+        Replace labels by their targets.
+        '''
+
+        for i, (op, arg) in enumerate(self.ops):
+            if op not in JUMPS:
+                continue
+
+            if isinstance(arg, tuple):
+                arg = tuple(item.target if isinstance(item, Label) else item
+                            for item in arg)
+            else:
+                arg = arg.target
+
+            self.ops[i] = (op, arg)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __call__(self, it, scope):
+        return execute(self, it, scope)
+
+
+class Compiler(object):
+    '''
+    Compiles statements into Code. Function bodies are compiled on their
+    first call and kept, so a Compiler should live as long as the
+    programs it compiled.
+    '''
+
+    def __init__(self):
+        # Compiled function bodies, by id() of their suite
+        self.suites = {}
+
+    def compileProgram(self, stmts):
+        code = Code(self)
+
+        for stmt in stmts:
+            self.statement(code, stmt)
+
+        code.emit(HALT)
+        code.resolve()
+
+        return code
+
+    def functionBody(self, suite, selectors=''):
+        '''
+        The Code of a function body; only its top-level "return"s return.
+        '''
+
+        entry = self.suites.get(id(suite))
+
+        if entry is None or entry[0] is not suite:
+            code = Code(self, '<def {}>'.format(selectors))
+
+            for st in suite:
+                if isinstance(st, FuncRet):
+                    self.value(code, st.value)
+                    code.emit(RETURN)
+                else:
+                    self.statement(code, st)
+
+            code.emit(RETURN_VOID)
+            code.resolve()
+
+            # The suite is kept too, so its id() isn't reused
+            entry = (suite, code)
+            self.suites[id(suite)] = entry
+
+        return entry[1]
+
+    def suite(self, code, suite, loop=None):
+        '''
+        Compile a block. In a loop body (`loop` is its (next, break)
+        labels), "next" and "break" are honoured before every statement.
+        '''
+
+        for st in suite:
+            if loop is not None:
+                code.emit(FLOW_CHECK, loop)
+
+            self.statement(code, st)
+
+    # Statements leave the stack as they found it
+    def statement(self, code, stmt):
+        stmt_type = type(stmt)
+
+        if stmt_type is NameDef:
+            self.value(code, stmt.value)
+            code.emit(STORE_DEF, (stmt.name, stmt.type))
+        elif stmt_type is NameDefEmpty:
+            code.emit(DEF_EMPTY, (stmt.name, stmt.type))
+        elif stmt_type is NameAssign:
+            self.value(code, stmt.value)
+            code.emit(STORE_ASSIGN, (stmt.name, stmt.mode, stmt.value))
+        elif stmt_type is IterableItemAssign:
+            self.value(code, stmt.index)
+            self.value(code, stmt.value)
+            code.emit(STORE_ITEM, stmt.name)
+        elif stmt_type is FuncDef:
+            code.emit(DEF_FUNC, stmt)
+        elif stmt_type is FuncRet:
+            # Only returns at the top of a function body return
+            self.value(code, stmt.value)
+            code.emit(POP_TOP)
+        elif stmt_type is IfBlock:
+            self.ifBlock(code, stmt)
+        elif stmt_type is ForBlock:
+            self.forBlock(code, stmt)
+        elif stmt_type is EachBlock:
+            self.eachBlock(code, stmt)
+        elif stmt_type is WhileBlock:
+            self.whileBlock(code, stmt)
+        elif stmt_type is FlowBreak:
+            code.emit(FLOW_BREAK)
+        elif stmt_type is FlowNext:
+            code.emit(FLOW_NEXT)
+        elif stmt_type is Exit:
+            self.value(code, stmt.value)
+            code.emit(EXIT)
+        else:
+            self.value(code, stmt)
+            code.emit(POP_TOP)
+
+    def ifBlock(self, code, stmt):
+        branches = [(stmt.test, stmt.suite)]
+
+        if stmt.elif_blocks is not None:
+            branches.extend((block[0], block[1]) for block in stmt.elif_blocks)
+
+        end = Label()
+
+        for test, suite in branches:
+            skip = Label()
+
+            self.value(code, test)
+            code.emit(JUMP_UNLESS_TRUE, skip)
+            self.suite(code, suite)
+            code.emit(JUMP, end)
+            code.place(skip)
+
+        if stmt.else_suite is not None:
+            self.suite(code, stmt.else_suite)
+
+        code.place(end)
+
+    def forBlock(self, code, stmt):
+        top, step, done, leave, stop, after = (Label() for _ in range(6))
+        has_interval = stmt.interval is not None
+
+        code.emit(SET_FLOW, True)
+        self.value(code, stmt.start)
+        self.value(code, stmt.end)
+
+        if has_interval:
+            self.value(code, stmt.interval)
+
+        code.emit(FOR_PREP, (stmt.name, has_interval, leave))
+        code.place(top)
+        code.emit(FOR_ITER, (stmt.name, done))
+        self.suite(code, stmt.suite, (step, stop))
+        code.place(step)
+        code.emit(FOR_STEP, top)
+        code.place(done)
+        code.emit(LOOP_END, stmt.name)
+        code.place(leave)
+        code.emit(SET_FLOW, False)
+        code.emit(JUMP, after)
+
+        # "break" leaves the loop name and the flow flag as they are
+        code.place(stop)
+        code.emit(POP_TOP)
+        code.place(after)
+
+    def eachBlock(self, code, stmt):
+        top, step, done, leave, stop, after = (Label() for _ in range(6))
+
+        code.emit(SET_FLOW, True)
+        self.value(code, stmt.iterable)
+        code.emit(EACH_PREP, (stmt.name, leave))
+        code.place(top)
+        code.emit(EACH_ITER, (stmt.name, done))
+        self.suite(code, stmt.suite, (step, stop))
+        code.place(step)
+        code.emit(EACH_STEP, top)
+        code.place(done)
+        code.emit(LOOP_END, stmt.name)
+        code.place(leave)
+        code.emit(SET_FLOW, False)
+        code.emit(JUMP, after)
+        code.place(stop)
+        code.emit(POP_TOP)
+        code.place(after)
+
+    def whileBlock(self, code, stmt):
+        top, done, after = Label(), Label(), Label()
+
+        code.emit(SET_FLOW, True)
+        code.place(top)
+        self.value(code, stmt.test)
+        code.emit(JUMP_UNLESS, done)
+        self.suite(code, stmt.suite, (top, after))
+        code.emit(JUMP, top)
+        code.place(done)
+        code.emit(SET_FLOW, False)
+        code.place(after)
+
+    # Values push exactly one object
+    def value(self, code, node):
+        '''
+        Compile an expression. Nested operands are compiled from a work
+        list, not by recursion, so any nesting depth compiles.
+        '''
+
+        work = [node]
+
+        while work:
+            item = work.pop()
+
+            # An op waiting for its operands to be compiled
+            if isinstance(item, tuple):
+                code.emit(*item)
+                continue
+
+            item_type = type(item)
+
+            if item_type in OPERATORS:
+                work.append((BINARY, OPERATORS[item_type]))
+                work.append(item.b)
+                work.append(item.a)
+            elif item_type is Name:
+                code.emit(LOAD_NAME, item.name)
+            elif isinstance(item, Constant):
+                code.emit(LOAD_CONST, item.constant)
+            elif item_type in LITERALS:
+                code.emit(LOAD_LITERAL, (LITERALS[item_type], item.value))
+            elif item_type is List:
+                work.append((BUILD_LIST, len(item.value)))
+                work.extend(reversed(item.value))
+            elif item_type is ItemFromIterable:
+                work.append((GET_ITEM, item.end is not None))
+
+                if item.end is not None:
+                    work.append(item.end)
+
+                work.append(item.index)
+                work.append(item.name)
+            elif item_type is LocalMethodCall:
+                args = item.selector_args
+                work.append((CALL_LOCAL, (item.selectors, len(args))))
+                work.extend(reversed(args))
+            elif item_type is ObjectMethodCall:
+                args = item.selector_args
+                work.append((CALL_METHOD, (item.selectors, len(args))))
+                work.extend(reversed(args))
+                work.append(item.object)
+            else:
+                code.emit(EXECUTE, item)
+
+
+# Virtual machine
+def execute(code, it, scope):
+    '''
+    Run Code for interpreter `it` in `scope`. Function calls push a frame
+    instead of recursing, so only the tree walker fallback (EXECUTE)
+    uses the Python stack.
+    '''
+
+    g = it.g
+    builtins = it.builtins
+    functionBody = code.compiler.functionBody
+
+    stack = []
+    push = stack.append
+    pop = stack.pop
+
+    # (ops, pc, scope, return type) of the callers
+    frames = []
+
+    ops = code.ops
+    pc = 0
+
+    while True:
+        op, arg = ops[pc]
+        pc += 1
+
+        if op == LOAD_NAME:
+            names = scope['names']
+
+            if arg not in names:
+                throwError(0, 0, 'NameError: Unknown name "{}"'.format(arg))
+
+            push(names[arg])
+        elif op == LOAD_CONST:
+            push(arg)
+        elif op == LOAD_LITERAL:
+            push(arg[0](arg[1]))
+        elif op == BINARY:
+            b = pop()
+            push(exprResult(arg[1](pop().value, b.value)))
+        elif op == FLOW_CHECK:
+            if g.flow_next:
+                g.flow_next = False
+                pc = arg[0]
+            elif g.flow_break:
+                g.flow_break = False
+                pc = arg[1]
+        elif op == STORE_ASSIGN:
+            name, mode, value_node = arg
+            value = pop()
+            names = scope['names']
+
+            if name not in names:
+                throwError(0, 1, 'NameError: Unknown name "{}"'.format(name))
+
+            current = names[name]
+
+            if isinstance(current, CoalVoid):
+                var_type = current.value
+
+                if var_type != 'Any' and var_type != value.object_type:
+                    throwError(0, 3,
+                               'TypeError: Wrong value type for Void({}): {}'
+                               .format(var_type, value_node.object_type))
+            elif current.object_type != value.object_type:
+                throwError(0, 3, 'TypeError: Wrong value type for {}: {}'
+                                 .format(current.object_type,
+                                         value.object_type))
+
+            if mode == '=':
+                names[name] = unshared(value)
+            elif mode == '+=':
+                ownValue(names, name).value += value.value
+            elif mode == '-=':
+                ownValue(names, name).value -= value.value
+            elif mode == '*=':
+                ownValue(names, name).value *= value.value
+            elif mode == '/=':
+                ownValue(names, name).value /= value.value
+        elif op == FOR_ITER:
+            state = stack[-1]
+
+            if state[0].value <= state[1].value:
+                if scope['names'][arg[0]] is not state[0]:
+                    ownValue(scope['names'], arg[0]).value = state[0].value
+            else:
+                pc = arg[1]
+        elif op == FOR_STEP:
+            state = stack[-1]
+            state[0].value += state[2].value
+            pc = arg
+        elif op == JUMP_UNLESS_TRUE:
+            test = pop()
+
+            if not (test.value and not isinstance(test.value, CoalVoid)):
+                pc = arg
+        elif op == JUMP_UNLESS:
+            if not pop().value:
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == POP_TOP:
+            pop()
+        elif op == CALL_LOCAL:
+            selectors, argc = arg
+
+            if argc:
+                args = stack[-argc:]
+                del stack[-argc:]
+            else:
+                args = []
+
+            if selectors in builtins.public:
+                push(builtins.call(selectors, args))
+            elif selectors in scope['methods']:
+                if g.scope_depth == 0:
+                    n_scope = it.newScope()
+                else:
+                    n_scope = scope
+
+                g.scope_depth += 1
+
+                defs = scope['methods'][selectors](n_scope, args)
+                suite, n_scope, rtype = defs
+
+                frames.append((ops, pc, scope, rtype))
+                ops = functionBody(suite, selectors).ops
+                pc = 0
+                scope = n_scope
+            else:
+                push(CoalVoid())
+        elif op == RETURN:
+            result = pop()
+            rtype = frames[-1][3]
+
+            if result.object_type != rtype:
+                throwError(0, 0,
+                           'TypeError: Invalid return type for "{}": "{}"'
+                           .format(rtype, result.object_type))
+
+            g.scope_depth -= 1
+            ops, pc, scope, _ = frames.pop()
+            push(result)
+        elif op == RETURN_VOID:
+            g.scope_depth -= 1
+            ops, pc, scope, _ = frames.pop()
+            push(CoalVoid())
+        elif op == CALL_METHOD:
+            selectors, argc = arg
+
+            if argc:
+                args = stack[-argc:]
+                del stack[-argc:]
+            else:
+                args = []
+
+            push(pop().call(selectors, args))
+        elif op == STORE_DEF:
+            name, name_type = arg
+            value = pop()
+            builtin_types = builtins.types
+
+            if name_type in builtin_types:
+                scope['names'][name] =\
+                    builtin_types[name_type]['init'](value.value,
+                                                     value.object_type)
+            elif name_type in scope['types']:
+                if value.object_type != name_type:
+                    throwError(0, 0,
+                               'TypeError: Unknown value type for "{}": {}'
+                               .format(name_type, value.object_type))
+
+                scope['names'][name] = value
+        elif op == BUILD_LIST:
+            if arg:
+                items = stack[-arg:]
+                del stack[-arg:]
+            else:
+                items = []
+
+            push(CoalList([unshared(item) for item in items]))
+        elif op == GET_ITEM:
+            end = pop() if arg else None
+            index = pop()
+            push(pop().iter(index, end))
+        elif op == SET_FLOW:
+            g.flow = arg
+        elif op == FLOW_BREAK:
+            if not g.flow:
+                throwError('SyntaxError: Invalid syntax: "break".')
+
+            g.flow_break = True
+        elif op == FLOW_NEXT:
+            if not g.flow:
+                throwError('SyntaxError: Invalid syntax: "next".')
+
+            g.flow_next = True
+        elif op == FOR_PREP:
+            name, has_interval, leave = arg
+            interval = pop() if has_interval else coalInt(1)
+            end = pop()
+            start = pop()
+
+            if not isinstance(start, CoalInt)\
+               or not isinstance(end, CoalInt)\
+               or (has_interval and not isinstance(interval, CoalInt)):
+                throwError(0, 0, 'TypeError: The values for "start", '
+                                 '"end" and "interval" must be "Int".')
+
+            names = scope['names']
+
+            if name in names:
+                var_type = names[name].object_type
+
+                if var_type != 'Void(Any)' and var_type != 'Int':
+                    throwError(0, 3, 'TypeError: Wrong value type for {}: Int'
+                                     .format(var_type))
+
+                pc = leave
+            else:
+                i = CoalInt(start.value)
+                names[name] = i
+                push((i, end, interval))
+        elif op == EACH_PREP:
+            name, leave = arg
+            iterable = pop()
+
+            if not isinstance(iterable, CoalIterableObject):
+                throwError('TypeError: "{}" object is not iterable.'
+                           .format(iterable.object_type))
+
+            names = scope['names']
+
+            if name in names:
+                pc = leave
+            else:
+                names[name] = CoalVoid(obj_type='Any')
+                length = iterable.call('length:', []).value
+                push((CoalInt(0), length, iterable))
+        elif op == EACH_ITER:
+            state = stack[-1]
+
+            if state[0].value < state[1]:
+                scope['names'][arg[0]] = state[2].iter(state[0])
+            else:
+                pc = arg[1]
+        elif op == EACH_STEP:
+            stack[-1][0].value += 1
+            pc = arg
+        elif op == LOOP_END:
+            pop()
+            del scope['names'][arg]
+        elif op == DEF_EMPTY:
+            name, name_type = arg
+
+            if name_type in scope['types'] or name_type == 'Any':
+                scope['names'][name] = CoalVoid(obj_type=name_type)
+            else:
+                throwError(0, 4,
+                           'TypeError: Unknown type "{}"'.format(name_type))
+        elif op == STORE_ITEM:
+            value = pop()
+            index = pop()
+
+            if arg not in scope['names']:
+                throwError(0, 0, 'NameError: Unknown name "{}"'.format(arg))
+
+            target = scope['names'][arg]
+
+            if not isinstance(target, CoalIterableObject):
+                throwError(0, 0, 'Exception: "{}" object is not a writable'
+                           ' iterable'.format(target.object_type))
+
+            target.assign(index, value)
+        elif op == DEF_FUNC:
+            scope['methods'][arg.selectors] = CoalFunction(
+                arg.selectors,
+                arg.selector_names,
+                arg.selector_types,
+                arg.selector_aliases,
+                arg.return_type,
+                arg.suite,
+                arg.simple
+            )
+        elif op == EXECUTE:
+            push(it.execute(arg, scope))
+        elif op == EXIT:
+            result = pop()
+
+            if not isinstance(result, CoalInt) and\
+               not isinstance(result, CoalBool):
+                throwError(0, 0, 'TypeError: The program must return "Int"'
+                                 ' or "Bool".')
+
+            raise CoalExit(result.value)
+        elif op == HALT:
+            return
+
+
+# Disassembler
+def formatArg(op, arg):
+    if arg is None:
+        return ''
+    elif op == LOAD_CONST:
+        return '{}({!r})'.format(arg.object_type, arg.value)
+    elif op == LOAD_LITERAL:
+        return '{}({!r})'.format(arg[0].__name__[4:], arg[1])
+    elif op == BINARY:
+        return arg[0]
+    elif op == STORE_ASSIGN:
+        return '{} {}'.format(arg[0], arg[1])
+    elif op == DEF_FUNC:
+        return arg.selectors
+    elif op == EXECUTE:
+        return '<{}>'.format(type(arg).__name__)
+    elif op in (FOR_PREP, FOR_ITER, EACH_PREP, EACH_ITER):
+        return '{} -> {}'.format(arg[0], arg[-1])
+    elif op == FLOW_CHECK:
+        return 'next -> {}, break -> {}'.format(*arg)
+    elif op in JUMPS:
+        return '-> {}'.format(arg)
+    elif isinstance(arg, tuple):
+        return ' '.join(str(item) for item in arg)
+
+    return str(arg)
+
+
+def disassemble(code, out=sys.stdout):
+    '''
+    Print Code, one op per line, then the bodies of the functions it
+    defines.
+    '''
+
+    targets = set()
+
+    for op, arg in code.ops:
+        for index in JUMPS.get(op, ()):
+            targets.add(arg[index] if isinstance(arg, tuple) else arg)
+
+    out.write('{}:\n'.format(code.name))
+
+    for pc, (op, arg) in enumerate(code.ops):
+        out.write('{:>2} {:>4} {:<17} {}\n'.format(
+            '>>' if pc in targets else '',
+            pc,
+            OPNAMES[op],
+            formatArg(op, arg)
+        ).rstrip() + '\n')
+
+    for op, arg in code.ops:
+        if op == DEF_FUNC:
+            out.write('\n')
+            disassemble(code.compiler.functionBody(arg.suite, arg.selectors),
+                        out)